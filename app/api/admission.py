@@ -0,0 +1,97 @@
+import json
+
+from .. import clock
+from .utils import encode_response
+
+# Answers for clients which are turned away, encoded once so that
+# rejecting a client costs no more than a write
+TOO_MANY_REQUESTS = encode_response("Too many requests", 429, "text/plain",
+                                    ["Retry-After: 1", "Connection: close"])
+UNAVAILABLE = encode_response("Busy", 503, "text/plain",
+                              ["Retry-After: 1", "Connection: close"])
+
+
+class Admission:
+    """ Decides which clients are served. Only so many connections
+    are served at once, and each address has a bucket of tokens,
+    one spent per request, refilled at rate_per_s up to burst """
+
+    def __init__(self, slots=6, rate_per_s=5, burst=10, max_tracked=16):
+        self.slots = slots
+        self.busy = 0
+
+        # Tokens are counted in thousandths, so refilling needs no
+        # floats
+        self._rate = rate_per_s
+        self._burst = burst * 1000
+        self._max_tracked = max_tracked
+
+        # [tokens, ticks when last refilled] by address
+        self._buckets = {}
+
+        self.admitted = 0
+        self.rejected_busy = 0
+        self.rejected_rate = 0
+
+    def acquire(self):
+        """ Take a connection slot, if one's free """
+        if self.busy >= self.slots:
+            self.rejected_busy += 1
+            return False
+        self.busy += 1
+        return True
+
+    def release(self):
+        """ Give back a connection slot """
+        self.busy -= 1
+
+    def allow(self, host):
+        """ Spend one of the address's tokens on a request, if it has
+        one left """
+        now = clock.ticks_ms()
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._track(host, now)
+        else:
+            elapsed = clock.ticks_diff(now, bucket[1])
+            bucket[0] = min(self._burst, bucket[0] + elapsed * self._rate)
+            bucket[1] = now
+
+        if bucket[0] < 1000:
+            self.rejected_rate += 1
+            return False
+
+        bucket[0] -= 1000
+        self.admitted += 1
+        return True
+
+    def _track(self, host, now):
+        """ Start a full bucket for a new address, forgetting another
+        if too many are tracked. Full buckets go first, as forgetting
+        them changes nothing """
+        if len(self._buckets) >= self._max_tracked:
+            forget = None
+            for other, bucket in self._buckets.items():
+                forget = other
+                elapsed = clock.ticks_diff(now, bucket[1])
+                if bucket[0] + elapsed * self._rate >= self._burst:
+                    break
+            del self._buckets[forget]
+
+        bucket = [self._burst, now]
+        self._buckets[host] = bucket
+        return bucket
+
+    def summary(self):
+        return {
+            "busy": self.busy,
+            "slots": self.slots,
+            "admitted": self.admitted,
+            "rejected": {
+                "busy": self.rejected_busy,
+                "rate": self.rejected_rate,
+            },
+        }
+
+    def to_json(self):
+        return json.dumps(self.summary())
@@ -0,0 +1,132 @@
+import asyncio
+import json
+
+PRESS = "press"
+LONG_PRESS = "long-press"
+DIAL = "dial"
+WIFI = "wifi"
+UPDATE = "update"
+
+
+class Subscriber:
+    """ Events waiting to be sent to one client. Once the ring is
+    full, the oldest are dropped to make room, so a slow client
+    costs no more than its ring """
+
+    def __init__(self, size):
+        self._ring = [None] * size
+        self._start = 0
+        self._count = 0
+
+        # Events are published from IRQ handlers, where only a
+        # ThreadSafeFlag may be set
+        self._flag = asyncio.ThreadSafeFlag()
+
+        # Events lost to a full ring
+        self.dropped = 0
+
+        # Set once the client has gone
+        self.closed = False
+
+    def put(self, event):
+        size = len(self._ring)
+        if self._count == size:
+            self._ring[self._start] = None
+            self._start = (self._start + 1) % size
+            self._count -= 1
+            self.dropped += 1
+
+        self._ring[(self._start + self._count) % size] = event
+        self._count += 1
+        self._flag.set()
+
+    def full(self):
+        return self._count == len(self._ring)
+
+    def take(self):
+        """ Take every waiting event, oldest first """
+        size = len(self._ring)
+        events = []
+        while self._count > 0:
+            events.append(self._ring[self._start])
+            self._ring[self._start] = None
+            self._start = (self._start + 1) % size
+            self._count -= 1
+        return events
+
+    async def wait(self):
+        """ Wait until an event has been put, or the client's gone """
+        await self._flag.wait()
+
+    def close(self):
+        self.closed = True
+        self._flag.set()
+
+
+class EventStream:
+    """ Fans events out to subscribers as Server-Sent Events. Each
+    event is encoded once, however many are watching, and not at
+    all when nobody is """
+
+    ring_size = 16
+
+    # Subscribers with nothing to send are pinged this often, to
+    # find clients which have gone
+    heartbeat_s = 15
+
+    def __init__(self, max_subscribers=3):
+        self.max_subscribers = max_subscribers
+        self.subscribers = []
+        self._id = 0
+
+    def subscribe(self):
+        """ Start collecting events for a new client, or None if too
+        many are already watching """
+        if len(self.subscribers) >= self.max_subscribers:
+            return None
+        subscriber = Subscriber(EventStream.ring_size)
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+        # Deliveries the client never got go back to their sender
+        for event in subscriber.take():
+            if isinstance(event, tuple):
+                event[1](False)
+
+    def publish(self, name, data):
+        """ Send an event to every subscriber, dropping their oldest
+        if they're behind """
+        if len(self.subscribers) == 0:
+            return
+
+        event = self._encode(name, json.dumps(data))
+        for subscriber in self.subscribers:
+            subscriber.put(event)
+
+    def deliver(self, name, data, done):
+        """ Send already encoded data to the first subscriber with
+        room for it, dropping nothing. done(True) is called once it's
+        been written to the client, or done(False) if the client
+        leaves first. Returns whether any subscriber took it """
+        for subscriber in self.subscribers:
+            if not subscriber.closed and not subscriber.full():
+                subscriber.put((self._encode(name, data), done))
+                return True
+
+        return False
+
+    def _encode(self, name, data):
+        # Ids let clients see which events they've missed
+        self._id += 1
+        return ("id: %d\nevent: %s\ndata: %s\n\n" %
+                (self._id, name, data)).encode()
+
+
+stream = EventStream()
+
+# Local consumers which take presses in place of the webhook
+deliveries = EventStream(max_subscribers=2)
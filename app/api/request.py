@@ -0,0 +1,210 @@
+import asyncio
+
+from .utils import encode_response, parse_query_string
+
+# How much is read from the client at a time
+READ_SIZE = 256
+
+
+class RequestError(Exception):
+    """ A request which can't be served, and the status to answer
+    it with """
+
+    def __init__(self, status, message=""):
+        super().__init__(message)
+        self.status = status
+
+
+class HTTPRequest:
+    """ A request, parsed once as it arrives. The body is read
+    separately, either whole for small bodies or in chunks by
+    streaming handlers """
+
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.version = version
+        self.headers = headers
+
+        path_end = target.find("?")
+        if path_end < 0:
+            self.path = target
+            self.query = ""
+        else:
+            self.path = target[0:path_end]
+            self.query = target[path_end + 1:]
+
+        # HTTP/1.1 keeps connections open unless asked not to, and
+        # HTTP/1.0 only when asked to
+        connection = headers.get("connection", "").lower()
+        if version == "HTTP/1.1":
+            self.keep_alive = connection != "close"
+        else:
+            self.keep_alive = connection == "keep-alive"
+
+        self.content_length = 0
+        length = headers.get("content-length")
+        if length is not None:
+            try:
+                self.content_length = int(length)
+            except ValueError:
+                raise RequestError(400, "bad Content-Length")
+            if self.content_length < 0:
+                raise RequestError(400, "bad Content-Length")
+
+        # Captures from the route's path, by name
+        self.params = {}
+
+        # The whole body, once read with read_body()
+        self.body = None
+
+        # Set by the server, for handlers which respond themselves
+        self.writer = None
+
+        # How long each read of the body may wait for the client
+        self.read_timeout_s = 5
+
+        self._reader = None
+        self._buffered = b""
+        self._remaining = self.content_length
+
+        self._query_params = None
+        self._post_params = None
+
+    @staticmethod
+    def parse_head(head):
+        """ Parse the request line and headers, without the blank
+        line which ends them """
+        lines = str(head, "utf8").split("\r\n")
+
+        parts = lines[0].split(" ")
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise RequestError(400, "bad request line")
+
+        headers = {}
+        for line in lines[1:]:
+            colon = line.find(":")
+            if colon <= 0:
+                raise RequestError(400, "bad header")
+            headers[line[0:colon].strip().lower()] = line[colon + 1:].strip()
+
+        return HTTPRequest(parts[0], parts[1], parts[2], headers)
+
+    async def read(self, size=READ_SIZE):
+        """ Read up to size bytes of the body, or b"" once it's all
+        been read """
+        if self._remaining <= 0:
+            return b""
+
+        if len(self._buffered) > 0:
+            chunk = self._buffered[0:min(size, self._remaining)]
+            self._buffered = self._buffered[len(chunk):]
+        else:
+            chunk = await asyncio.wait_for(
+                self._reader.read(min(size, self._remaining)),
+                self.read_timeout_s)
+            if len(chunk) == 0:
+                raise RequestError(400, "body cut short")
+
+        self._remaining -= len(chunk)
+        return chunk
+
+    async def read_body(self):
+        """ Read the rest of the body into self.body """
+        chunks = []
+        while True:
+            chunk = await self.read(self._remaining)
+            if len(chunk) == 0:
+                break
+            chunks.append(chunk)
+
+        self.body = b"".join(chunks)
+        return self.body
+
+    async def wait_closed(self):
+        """ Wait for the client to close its connection, discarding
+        anything else it sends """
+        while len(await self._reader.read(READ_SIZE)) > 0:
+            pass
+
+    def query_params(self):
+        if self._query_params is None:
+            self._query_params = parse_query_string(self.query)
+        return self._query_params
+
+    def post_params(self):
+        if self.method != "POST":
+            return None
+        if self._post_params is None:
+            body = self.body or b""
+            self._post_params = parse_query_string(str(body, "utf8"))
+        return self._post_params
+
+    def send(self, data):
+        """ Send data to the client, for handlers which respond
+        after yielding """
+        if isinstance(data, str):
+            data = data.encode()
+        self.writer.write(data)
+
+    def respond(self,
+                response,
+                http_code=200,
+                content_type="text/plain",
+                extend_headers=None):
+        """ Send a whole response at once, with its Content-Length """
+        self.writer.write(
+            self.frame_response(response, http_code, content_type,
+                                extend_headers))
+
+    def frame_response(self,
+                       response,
+                       http_code=200,
+                       content_type="text/plain",
+                       extend_headers=None):
+        """ Encode a response to this request, telling the client
+        whether the connection stays open """
+        headers = list(extend_headers or ())
+        version = "HTTP/1.0"
+        if self.version == "HTTP/1.1":
+            version = self.version
+            if not self.keep_alive:
+                headers.append("Connection: close")
+        elif self.keep_alive:
+            headers.append("Connection: keep-alive")
+
+        return encode_response(response, http_code, content_type, headers,
+                               version)
+
+    def leftover(self):
+        """ Bytes read past the end of this request, the start of
+        the next one if the client pipelines """
+        return self._buffered
+
+
+async def read_request(reader, max_header_size, buf=b""):
+    """ Read and parse a request's head, keeping any of the body
+    which arrived with it. buf holds any of the head already read.
+    Returns None if the client left without sending anything """
+    end = buf.find(b"\r\n\r\n")
+    while end < 0:
+        if len(buf) > max_header_size:
+            raise RequestError(431, "headers too large")
+
+        chunk = await reader.read(READ_SIZE)
+        if len(chunk) == 0:
+            if len(buf) == 0:
+                return None
+            raise RequestError(400, "head cut short")
+
+        # Only search where the end of the head could have arrived
+        start = max(0, len(buf) - 3)
+        buf += chunk
+        end = buf.find(b"\r\n\r\n", start)
+
+    if end > max_header_size:
+        raise RequestError(431, "headers too large")
+
+    request = HTTPRequest.parse_head(buf[0:end])
+    request._reader = reader
+    request._buffered = buf[end + 4:]
+    return request
@@ -1,11 +1,101 @@
-from . import config
+import asyncio
 
+from .. import shared
+from ..metrics import latency
+from . import events
+from .server import Server
+from .utils import etag_matches
 
-def get_info(server):
-    server.send("HTTP/1.0 200 OK\r\n")
-    server.send("Content-Type: application/json\r\n\r\n")
-    server.send(config.info())
 
+# Served from the config's cached encoding, answering 304 when the
+# client already has it
+def get_info(server, request):
+    body, etag = shared.config.encodedinfo()
+    headers = ["ETag: " + etag, "Cache-Control: no-cache"]
 
-def setup_routes(server):
-    server.add_route(path="/info", handler=lambda r: get_info(server))
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        server.respond(b"", 304, extend_headers=headers)
+        return
+
+    server.respond(body,
+                   content_type="application/json",
+                   extend_headers=headers)
+
+
+# Press-to-acknowledge latency percentiles, per stage
+def get_latency(server):
+    server.respond(latency.stats.to_json(), content_type="application/json")
+
+
+# Connections served and turned away by the API's admission control
+def get_admission(server):
+    server.respond(server.admission.to_json(), content_type="application/json")
+
+
+# Live events as Server-Sent Events, for as long as the client
+# stays. Events which arrive while it's being written to wait in
+# its ring
+async def get_events(request):
+    await serve_stream(request, events.stream)
+
+
+# Presses, as they'd be sent to the webhook, for local consumers
+# which take them in its place
+async def get_presses(request):
+    await serve_stream(request, events.deliveries)
+
+
+async def serve_stream(request, stream):
+    subscriber = stream.subscribe()
+    if subscriber is None:
+        request.respond("Too many subscribers", 503)
+        return
+
+    # The client sends nothing more, so reading finds when it leaves
+    async def watch():
+        await request.wait_closed()
+        subscriber.close()
+
+    watcher = asyncio.create_task(watch())
+
+    # Told whether deliveries sent since the last drain made it
+    unwritten = []
+    try:
+        request.send(request.version + " 200 Ok\r\n"
+                     "Content-Type: text/event-stream\r\n"
+                     "Cache-Control: no-cache\r\n"
+                     "Connection: close\r\n\r\n")
+        while not subscriber.closed:
+            await asyncio.wait_for(request.writer.drain(),
+                                   Server.write_timeout_s)
+            for done in unwritten:
+                done(True)
+            unwritten = []
+
+            try:
+                await asyncio.wait_for(subscriber.wait(),
+                                       events.EventStream.heartbeat_s)
+            except asyncio.TimeoutError:
+                request.send(": ping\n\n")
+                continue
+
+            for event in subscriber.take():
+                if isinstance(event, tuple):
+                    event, done = event
+                    unwritten.append(done)
+                request.send(event)
+    finally:
+        watcher.cancel()
+        for done in unwritten:
+            done(False)
+        stream.unsubscribe(subscriber)
+
+
+def setup_routes(server, push_presses=False):
+    server.add_route(path="/info", handler=lambda r: get_info(server, r))
+    server.add_route(path="/latency", handler=lambda r: get_latency(server))
+    server.add_route(path="/admission",
+                     handler=lambda r: get_admission(server))
+    server.add_route(path="/events", handler=get_events, stream=True)
+    if push_presses:
+        server.add_route(path="/presses", handler=get_presses, stream=True)
@@ -25,109 +25,392 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
+import asyncio
 import re
-import socket
 import sys
 import io
 
+from .admission import TOO_MANY_REQUESTS, UNAVAILABLE, Admission
+from .request import READ_SIZE, HTTPRequest, RequestError, read_request
+from .utils import encode_response
+
+_PATTERN_CHARS = "<^$*+?()[]{}|\\"
+
+
+def _is_pattern(path):
+    """ Whether a route path needs matching, rather than comparing """
+    for c in path:
+        if c in _PATTERN_CHARS:
+            return True
+    return False
+
+
+def _compile_path(path):
+    """ Compile a route path once, turning each <name> segment into
+    a capture. MicroPython's re has no named groups, so names are
+    kept alongside the pattern, in capture order """
+    names = []
+    pattern = ""
+    start = 0
+    while True:
+        open_at = path.find("<", start)
+        close_at = path.find(">", open_at)
+        if open_at < 0 or close_at < 0:
+            break
+
+        names.append(path[open_at + 1:close_at])
+        pattern += path[start:open_at] + "([^/]+)"
+        start = close_at + 1
+
+    return names, re.compile("^" + pattern + path[start:] + "$")
+
+
+def _parse_request_line(request):
+    """ Split the method and path out of the request line """
+    method_end = request.find(" ")
+    if method_end < 0:
+        return request, ""
+
+    start = method_end + 1
+    end = request.find(" ", start)
+    if end < 0:
+        end = request.find("\r", start)
+    if end < 0:
+        end = len(request)
+
+    # The query string isn't part of the path
+    query = request.find("?", start, end)
+    if query >= 0:
+        end = query
+
+    return request[0:method_end], request[start:end]
+
 
 class Server:
 
+    # How long a client has to send its whole request, and to
+    # accept the response, before it's disconnected
+    read_timeout_s = 5
+    write_timeout_s = 5
+
+    # Larger requests are turned away. Bodies over max_body_size
+    # are only accepted by streaming routes, which read them in
+    # chunks rather than all at once
+    max_header_size = 2048
+    max_body_size = 1024
+
+    # Clients may keep their connection open between requests for
+    # up to idle_timeout_s, while fewer than max_idle_clients are
+    # waiting. Others are closed after each response
+    idle_timeout_s = 30
+    max_idle_clients = 4
+
+    # Only max_clients connections are served at once, and each
+    # address may make burst requests, then rate_per_s. Others are
+    # turned away early with a 503 or 429
+    max_clients = 6
+    rate_per_s = 5
+    burst = 10
+
     def __init__(self, host="0.0.0.0", port=80):
         """ Constructor """
         self._host = host
         self._port = port
         self._routes = []
-        self._connect = None
+
+        # Exact paths by method and path, and compiled patterns by
+        # method, in the order they were added
+        self._static = {}
+        self._patterns = {}
+
+        # Captures from the last route found, by name
+        self.params = {}
+
+        self._server = None
+
+        # The request being handled now, and the fragments sent by
+        # its handler, written together once it returns. Unframed
+        # fragments, sent without respond(), end the connection
+        self._request = None
+        self._out = None
+        self._unframed = False
+
+        # Connections waiting for their next request
+        self._idle = 0
+
+        self.admission = Admission(Server.max_clients, Server.rate_per_s,
+                                   Server.burst)
+
         self._on_request_handler = None
         self._on_not_found_handler = None
         self._on_error_handler = None
-        self._sock = None
         self.on = False
 
-    def start(self):
+    async def start(self):
         """ Start server """
         self.on = True
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self._sock.bind((self._host, self._port))
-        self._sock.listen(1)
+        self._server = await asyncio.start_server(self._serve_client,
+                                                  self._host,
+                                                  self._port,
+                                                  backlog=Server.max_clients)
         print("Server listening on :%d" % self._port)
 
-    def poll(self):
-        if self._sock is None:
+    async def serve(self):
+        """ Long-lived task which serves clients until stopped """
+        if self._server is None:
+            await self.start()
+        await self._server.wait_closed()
+
+    def stop(self):
+        """ Stop the server """
+        self.on = False
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        print("Server stop")
+
+    async def _serve_client(self, reader, writer):
+        """ Serve a single client, alongside any others, for as long
+        as it keeps its connection open """
+        address = writer.get_extra_info("peername")
+        host = address[0] if address else None
+        if not self.admission.acquire():
+            await self._reject(writer, UNAVAILABLE)
             return
 
-        connect = None
-        address = None
+        buf = b""
+        idle = False
 
         try:
-            self._sock.settimeout(0.5)
-            connect, address = self._sock.accept()
+            while True:
+                if len(buf) == 0:
+                    buf = await self._wait_for_request(reader, idle)
+                    if len(buf) == 0:
+                        break
+
+                if not self.admission.allow(host):
+                    writer.write(TOO_MANY_REQUESTS)
+                    break
+
+                request = await asyncio.wait_for(
+                    read_request(reader, Server.max_header_size, buf),
+                    Server.read_timeout_s)
+                request.writer = writer
+                request.read_timeout_s = Server.read_timeout_s
+                await self._serve_request(request, address)
+                if not request.keep_alive:
+                    break
+
+                # Answers to pipelined requests are written together
+                buf = request.leftover()
+                if len(buf) == 0:
+                    await asyncio.wait_for(writer.drain(),
+                                           Server.write_timeout_s)
+                idle = True
+
+            await asyncio.wait_for(writer.drain(), Server.write_timeout_s)
+        except RequestError as e:
+            print("Bad request:", e.status, e)
+            writer.write(
+                encode_response(str(e), e.status, "text/plain",
+                                ["Connection: close"]))
+            try:
+                await asyncio.wait_for(writer.drain(), Server.write_timeout_s)
+            except Exception:
+                pass
+        except asyncio.TimeoutError:
+            print("Client timed out:", address)
         except Exception as e:
+            print("Client error:", e)
+        finally:
+            self.admission.release()
+            await self._close(writer)
+
+    async def _reject(self, writer, response):
+        """ Turn a client away with a pre-encoded response """
+        writer.write(response)
+        try:
+            await asyncio.wait_for(writer.drain(), Server.write_timeout_s)
+        except Exception:
+            pass
+        await self._close(writer)
+
+    async def _close(self, writer):
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+    async def _wait_for_request(self, reader, idle):
+        """ Wait for the start of the next request. Clients may idle
+        between requests, while there's room, and are closed quietly
+        once they've idled too long """
+        if not idle:
+            return await asyncio.wait_for(reader.read(READ_SIZE),
+                                          Server.read_timeout_s)
+
+        if self._idle >= Server.max_idle_clients:
+            return b""
+
+        self._idle += 1
+        try:
+            return await asyncio.wait_for(reader.read(READ_SIZE),
+                                          Server.idle_timeout_s)
+        except asyncio.TimeoutError:
+            return b""
+        finally:
+            self._idle -= 1
+
+    async def _serve_request(self, request, address):
+        """ Read the body, unless the route streams it, then route """
+        route = self.match_route(request.method, request.path)
+        request.params = self.params
+
+        # Don't promise to keep the connection open without room
+        # for it to idle
+        if self._idle >= Server.max_idle_clients:
+            request.keep_alive = False
+
+        # Streaming handlers may leave some of the body unread, so
+        # their connections are closed after
+        if route is not None and route.get("stream"):
+            request.keep_alive = False
+            self._begin(request)
+            try:
+                accepted = self._accept(request, address)
+            finally:
+                self._flush()
+            if accepted:
+                await route["handler"](request)
             return
 
-        self._connect = connect
+        if request.content_length > Server.max_body_size:
+            raise RequestError(413, "body too large")
+
+        await request.read_body()
+        self._handle(request, address, route)
+
+    def _accept(self, request, address):
+        """ Give the request handler a chance to turn a request away """
+        if self._on_request_handler is None:
+            return True
+        return self._on_request_handler(request, address)
 
+    def _handle(self, request, address, route):
+        """ Handle a request. Handlers run without yielding, so the
+        response is written to this client alone """
+        self._begin(request)
         try:
-            self._sock.settimeout(15)
-            request = self.get_request()
-            if len(request) == 0:
-                self._connect.close()
+            if not self._accept(request, address):
                 return
-            if self._on_request_handler:
-                if not self._on_request_handler(request, address):
-                    return
-            route = self.find_route(request)
             if route:
                 route["handler"](request)
             else:
                 self._route_not_found(request)
         except Exception as e:
+            self._out = []
+            self._unframed = False
             self._internal_error(e)
         finally:
-            self._connect.close()
+            self._flush()
 
-    def stop(self):
-        """ Stop the server """
-        self._connect.close()
-        self._sock.close()
-        self._sock = None
-        print("Server stop")
+    def _begin(self, request):
+        """ Start collecting what's sent in answer to a request """
+        self._request = request
+        self._out = []
+        self._unframed = False
+
+    def _flush(self):
+        """ Write everything the handler sent in one go. If it didn't
+        answer, or sent fragments the client can't tell the end of,
+        the connection is closed after """
+        request = self._request
+        out = self._out
+        if len(out) == 0 or self._unframed:
+            request.keep_alive = False
+        if len(out) > 0:
+            request.writer.write(b"".join(out))
 
-    def add_route(self, path, handler, method="GET"):
-        """ Add new route  """
-        self._routes.append({
+        self._request = None
+        self._out = None
+
+    def add_route(self, path, handler, method="GET", stream=False):
+        """ Add new route. Paths may name segments as <name>, or be
+        regular expressions. Streaming routes take coroutine handlers,
+        which read the body with request.read() and respond with
+        request.send() """
+        route = {
             "path": path,
             "handler": handler,
-            "method": method
-        })
+            "method": method,
+            "stream": stream,
+        }
+        self._routes.append(route)
+
+        if not _is_pattern(path):
+            self._static.setdefault(method, {})[path] = route
+            return
+
+        names, pattern = _compile_path(path)
+        route["params"] = names
+        self._patterns.setdefault(method, []).append((pattern, route))
 
     def send(self, data):
-        """ Send data to client """
-        if self._connect is None:
+        """ Send data to client. It's buffered until the handler
+        returns, so prefer respond() which also sets Content-Length
+        and lets the client keep its connection """
+        self._unframed = True
+        self._write(data)
+
+    def respond(self,
+                response,
+                http_code=200,
+                content_type="text/plain",
+                extend_headers=None):
+        """ Send a whole response, with its Content-Length """
+        if self._request is None:
+            raise Exception("Can't send response, no connection instance")
+        self._write(
+            self._request.frame_response(response, http_code, content_type,
+                                         extend_headers))
+
+    def _write(self, data):
+        if self._out is None:
             raise Exception("Can't send response, no connection instance")
-        self._connect.sendall(data.encode())
+        if isinstance(data, str):
+            data = data.encode()
+        self._out.append(data)
 
     def find_route(self, request):
-        """ Find route """
-        lines = request.split("\r\n")
-        method = re.search("^([A-Z]+)", lines[0]).group(1)
-        path = re.search("^[A-Z]+\\s+(/[-a-zA-Z0-9_.]*)", lines[0]).group(1)
-        for route in self._routes:
-            if method != route["method"]:
-                continue
-            if path == route["path"]:
+        """ Find route for a parsed request, or a raw one, parsing
+        its request line without regex """
+        if isinstance(request, HTTPRequest):
+            return self.match_route(request.method, request.path)
+
+        method, path = _parse_request_line(request)
+        return self.match_route(method, path)
+
+    def match_route(self, method, path):
+        """ Find the route for a method and path """
+        static = self._static.get(method)
+        if static is not None:
+            route = static.get(path)
+            if route is not None:
+                self.params = {}
+                return route
+
+        for pattern, route in self._patterns.get(method, ()):
+            match = pattern.match(path)
+            if match:
+                names = route["params"]
+                self.params = {
+                    names[i]: match.group(i + 1)
+                    for i in range(len(names))
+                }
                 return route
-            else:
-                match = re.search("^" + route["path"] + "$", path)
-                if match:
-                    print(method, path, route["path"])
-                    return route
 
-    def get_request(self, buffer_length=4096):
-        """ Return request body """
-        return str(self._connect.recv(buffer_length), "utf8")
+        return None
 
     def on_request(self, handler):
         """ Set request handler """
@@ -147,9 +430,7 @@ class Server:
             self._on_not_found_handler(request)
         else:
             """ Default not found handler """
-            self.send("HTTP/1.0 404 Not Found\r\n")
-            self.send("Content-Type: text/plain\r\n\r\n")
-            self.send("Not found")
+            self.respond("Not found", 404)
 
     def _internal_error(self, error):
         """ Internal error handler """
@@ -164,7 +445,5 @@ class Server:
                 output.close()
             else:
                 str_error = str(error)
-            self.send("HTTP/1.0 500 Internal Server Error\r\n")
-            self.send("Content-Type: text/plain\r\n\r\n")
-            self.send("Error: " + str_error)
+            self.respond("Error: " + str_error, 500)
             print(str_error)
@@ -25,8 +25,6 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
-
-import re
 """ HTTP response codes """
 HTTP_CODES = {
     100: 'Continue',
@@ -90,36 +88,57 @@ HTTP_CODES = {
 }
 
 
+def encode_response(response,
+                    http_code=200,
+                    content_type="text/html",
+                    extend_headers=None,
+                    version="HTTP/1.0"):
+    """ encode a whole response, with its Content-Length, so it can
+    be written at once. 204 and 304 responses have no body, and a
+    304 mustn't contradict the headers of the response it stands
+    in for, so neither gets a Content-Type or Content-Length """
+    if isinstance(response, str):
+        response = response.encode()
+    head = "%s %d %s\r\n" % (version, http_code, HTTP_CODES.get(http_code))
+    if http_code == 204 or http_code == 304:
+        response = b""
+    else:
+        head += "Content-Type: %s\r\nContent-Length: %d\r\n" % (content_type,
+                                                                len(response))
+    if extend_headers is not None:
+        for header in extend_headers:
+            head += header + "\r\n"
+    return b"".join((head.encode(), b"\r\n", response))
+
+
 def send_response(server,
                   response,
                   http_code=200,
                   content_type="text/html",
                   extend_headers=None):
     """ send response """
-    server.send("HTTP/1.0 " + str(http_code) + " " +
-                HTTP_CODES.get(http_code) + "\r\n")
-    server.send("Content type:" + content_type + "\r\n")
-    if extend_headers is not None:
-        for header in extend_headers:
-            server.send(header + "\r\n")
-    server.send("\r\n")
-    server.send(response)
+    server.respond(response, http_code, content_type, extend_headers)
+
+
+def etag_matches(if_none_match, etag):
+    """ whether an If-None-Match header matches an ETag """
+    if if_none_match is None:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag == etag or tag == "W/" + etag:
+            return True
+    return False
 
 
 def get_request_method(request):
     """ return http request method """
-    lines = request.split("\r\n")
-    return re.search("^([A-Z]+)", lines[0]).group(1)
+    return request.method
 
 
 def get_request_query_string(request):
     """ return http request query string """
-    lines = request.split("\r\n")
-    match = re.search("\\?(.+)\\s", lines[0])
-    if match is None:
-        return ""
-    else:
-        return match.group(1)
+    return request.query
 
 
 def parse_query_string(query_string):
@@ -141,20 +160,12 @@ def parse_query_string(query_string):
 
 def get_request_query_params(request):
     """ return http request query params """
-    query_string = get_request_query_string(request)
-    return parse_query_string(query_string)
+    return request.query_params()
 
 
 def get_request_post_params(request):
     """ return params from POST request """
-    request_method = get_request_method(request)
-    if request_method != "POST":
-        return None
-    match = re.search("\r\n\r\n(.+)", request)
-    if match is None:
-        return {}
-    query_string = match.group(1)
-    return parse_query_string(query_string)
+    return request.post_params()
 
 
 def unquote(string):
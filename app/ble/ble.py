@@ -2,6 +2,7 @@ import asyncio
 from ..lib import aioble
 import bluetooth
 from .. import shared
+from ..metrics import latency
 
 _ADV_INTERVAL_US = 250000
 
@@ -13,8 +14,12 @@ TYPE_CHAR_UUID = bluetooth.UUID("19B10001-E8F2-537E-4F6C-D104768A1214")
 NAME_CHAR_UUID = bluetooth.UUID("19B10001-E8F2-537E-4F6C-D104768A1214")
 LAYOUT_CHAR_UUID = bluetooth.UUID("19B10002-E8F2-537E-4F6C-D104768A1214")
 VERSION_CHAR_UUID = bluetooth.UUID("19B10003-E8F2-537E-4F6C-D104768A1214")
-IP_CHAR_UUID = bluetooth.UUID("19B10004-E8F2-537E-4F6Cg-D104768A1214")
+IP_CHAR_UUID = bluetooth.UUID("19B10004-E8F2-537E-4F6C-D104768A1214")
 HA_IP_CHAR_UUID = bluetooth.UUID("19B10004-E8F2-537E-4F6C-D104768A1214")
+LATENCY_CHAR_UUID = bluetooth.UUID("19B10005-E8F2-537E-4F6C-D104768A1214")
+
+# How often the latency characteristic is refreshed while connected
+_LATENCY_REFRESH_S = 1
 
 # BLE advertising name
 DEVICE_NAME = "Pico-Switch"
@@ -50,6 +55,11 @@ def _get_ha_ip_value():
     return "ha-ip: " + shared.config.value["home-assistant-ip"]
 
 
+# Press-to-acknowledge p50/p95/p99
+def _get_latency_value():
+    return "latency: " + latency.stats.compact()
+
+
 async def ble_server_task():
     """Main BLE server task."""
     global _server, _conn_handle, _service, _server_running
@@ -107,6 +117,13 @@ async def ble_server_task():
         notify=True,
     )
 
+    latency_char = aioble.Characteristic(
+        _service,
+        LATENCY_CHAR_UUID,
+        read=True,
+        notify=True,
+    )
+
     # Register service
     aioble.register_services(_service)
 
@@ -123,6 +140,7 @@ async def ble_server_task():
     version_char.write(version_bytes)
     ip_char.write(ip_bytes)
     ha_ip_char.write(ha_ip_bytes)
+    latency_char.write(_get_latency_value().encode())
 
     print("BLE services registered")
 
@@ -139,7 +157,12 @@ async def ble_server_task():
                 timeout_ms=30000,
         ) as connection:
             print("Connection from", connection.device)
-            await connection.disconnected(timeout_ms=None)
+
+            # Keep latency current, notifying subscribers
+            while connection.is_connected():
+                await asyncio.sleep(_LATENCY_REFRESH_S)
+                latency_char.write(_get_latency_value().encode(), True)
+
             print("Connection terminated")
     except Exception as e:
         print("BLE error:", e)
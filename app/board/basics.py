@@ -1,5 +1,8 @@
 from machine import Pin, PWM, Timer
-import time
+import asyncio
+
+from .. import clock
+from ..metrics import latency
 
 
 # Configure a pushbutton using one or more pins using a PULL_UP mode
@@ -30,13 +33,19 @@ class PushButton:
                      handler=irq_handler)
 
     def _on_interrupt(self):
+        at = clock.ticks_ms()
         self.last_pressed = self.pressed
 
         # Check equal to zero due to using PULL_UP
         self.pressed = any(pin.value() == 0 for pin in self.gpios)
 
         if self.pressed != self.last_pressed:
-            self._on_change()
+            # Requests made by the handlers are timed from here
+            latency.stats.interrupt(at)
+            try:
+                self._on_change()
+            finally:
+                latency.stats.interrupt_done()
 
     def _on_change(self):
         if self.pressed:
@@ -93,6 +102,6 @@ class RgbLED:
     async def flash(self, r, g, b, seconds=0.1, times=1):
         for x in range(times):
             self.do_color(r, g, b)
-            time.sleep(seconds)
+            await asyncio.sleep(seconds)
             self.off()
-            time.sleep(seconds)
+            await asyncio.sleep(seconds)
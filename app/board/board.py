@@ -150,6 +150,11 @@ class Board:
             if self._pair_press_timer is not None:
                 self._pair_press_timer.deinit()
 
+    # Called when the request queue fills up, and again once
+    # it has drained
+    def on_backpressure(self, active: bool):
+        pass
+
     def on_wifi_connecting(self):
         self._wifi_connecting = True
 
@@ -199,6 +204,15 @@ class BasicButtonBoard(Board):
         self._button_unpress(key)
         self.on_release(key)
 
+    def on_backpressure(self, active: bool):
+        super().on_backpressure(active)
+
+        # Hold amber until the queue catches up
+        if active:
+            self.led.do_color(50, 20, 0)
+        else:
+            self.led.off()
+
     def on_wifi_connecting(self):
         super().on_wifi_connecting()
 
@@ -265,6 +279,7 @@ class DialBoard(BasicButtonBoard):
 
         self.on_dial_press = on_dial_press
         self.on_dial_longpress = on_dial_press
+        self.on_dial_rotate = on_dial_press
 
         def _on_dial_press(routine: Routine):
             if self.on_dial_press is not None:
@@ -274,8 +289,13 @@ class DialBoard(BasicButtonBoard):
             if self.on_dial_longpress is not None:
                 self.on_dial_longpress(routine)
 
+        def _on_dial_rotate(routine: Routine):
+            if self.on_dial_rotate is not None:
+                self.on_dial_rotate(routine)
+
         self.dial.on_press = _on_dial_press
         self.dial.on_long_press = _on_dial_longpress
+        self.dial.on_rotate = _on_dial_rotate
 
     def _dial_press(self, routine: Routine):
         self.on_dial_press(routine)
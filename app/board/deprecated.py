@@ -31,8 +31,12 @@ class Wheel:
         def on_long_press(routine: Routine):
             pass
 
+        def on_rotate(routine: Routine):
+            pass
+
         self.on_press = on_press
         self.on_long_press = on_long_press
+        self.on_rotate = on_rotate
 
         self.last_pressed = False
         self.pressed = False
@@ -85,6 +89,7 @@ class Wheel:
         self.value = self.value % self.size
 
         print("scrolled to: " + self.options[self.value].name)
+        self.on_rotate(self.options[self.value])
 
         self._flash_color()
         self._reset_timer()
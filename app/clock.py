@@ -0,0 +1,27 @@
+import time
+
+# MicroPython exposes a wrapping millisecond tick counter on the time
+# module. On the host, ticks come from the simulated hardware's clock,
+# which follows real time unless a simulation is driving it.
+if hasattr(time, 'ticks_ms'):
+
+    def ticks_ms() -> int:
+        return time.ticks_ms()
+
+    def ticks_diff(a: int, b: int) -> int:
+        return time.ticks_diff(a, b)
+
+    def ticks_add(ticks: int, delta: int) -> int:
+        return time.ticks_add(ticks, delta)
+
+else:
+    from sim.clock import clock as _clock
+
+    def ticks_ms() -> int:
+        return _clock.ticks_ms()
+
+    def ticks_diff(a: int, b: int) -> int:
+        return a - b
+
+    def ticks_add(ticks: int, delta: int) -> int:
+        return ticks + delta
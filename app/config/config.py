@@ -31,6 +31,10 @@ class Config:
         self.value = ConfigValue({})
         self.version = 'v0.0.0'
 
+        # publicinfo(), encoded, and its ETag, until the config or
+        # version next changes
+        self._info = None
+
     def load(self):
         # Load the config file
         try:
@@ -52,7 +56,10 @@ class Config:
             else:
                 self.version = 'v0.0.0'
 
+        self.changed()
+
     def dump(self):
+        self.changed()
         with open(Config.filename, 'w') as f:
             json.dump(self.raw, f)
 
@@ -61,7 +68,19 @@ class Config:
         del safe_value["wifi"]
 
         return json.dumps({
-            "_uuid": Config.device_uuid(),
+            "_uuid": str(Config.device_uuid(), "utf8"),
             "_version": self.version,
             "config": safe_value,
         })
+
+    # Forget the cached public info, after changing the config or
+    # version other than by loading or dumping
+    def changed(self):
+        self._info = None
+
+    # publicinfo(), encoded once, with an ETag to validate it by
+    def encodedinfo(self) -> tuple[bytes, str]:
+        if self._info is None:
+            body = self.publicinfo().encode()
+            self._info = (body, '"%08x"' % binascii.crc32(body))
+        return self._info
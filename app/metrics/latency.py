@@ -0,0 +1,104 @@
+import array
+import json
+
+from .. import clock
+
+# Stages of a press, each timed from the end of the one before
+QUEUED = 'queued'  # Button interrupt -> added to the request queue
+SENT = 'sent'  # Added to the queue -> written to the socket
+ANSWERED = 'answered'  # Written to the socket -> response received
+TOTAL = 'total'  # Button interrupt -> successful response
+
+STAGES = (QUEUED, SENT, ANSWERED, TOTAL)
+
+
+# The most recent samples of one stage, in a fixed ring of
+# preallocated slots, so recording never allocates
+class Histogram:
+
+    size = 64
+
+    def __init__(self, size: int = size):
+        self._samples = array.array('I', bytes(4 * size))
+        self._next = 0
+
+        # Samples recorded since boot, and the slowest of them
+        self.count = 0
+        self.max_ms = 0
+
+    def add(self, ms: int):
+        if ms < 0:
+            ms = 0
+
+        self._samples[self._next] = ms
+        self._next = (self._next + 1) % len(self._samples)
+        self.count += 1
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    # Percentiles of the samples still in the ring, nearest rank
+    def percentiles(self, *ps: int) -> tuple:
+        n = min(self.count, len(self._samples))
+        if n == 0:
+            return tuple(0 for _ in ps)
+
+        ordered = sorted(self._samples[0:n])
+        return tuple(ordered[max(0, (p * n + 99) // 100 - 1)] for p in ps)
+
+    def summary(self) -> dict:
+        p50, p95, p99 = self.percentiles(50, 95, 99)
+        return {
+            "count": self.count,
+            "p50": p50,
+            "p95": p95,
+            "p99": p99,
+            "max": self.max_ms,
+        }
+
+
+# Where time goes between a button being pressed and Home
+# Assistant acknowledging it. Requests carry their own
+# timestamps, and each stage is recorded as it completes
+class LatencyStats:
+
+    def __init__(self, size: int = Histogram.size):
+        self.histograms = {stage: Histogram(size) for stage in STAGES}
+
+        # Tick of the button interrupt being handled, if any.
+        # Requests created by its handlers are timed from it
+        self._interrupt_ms = None
+
+    def interrupt(self, at: int):
+        self._interrupt_ms = at
+
+    def interrupt_done(self):
+        self._interrupt_ms = None
+
+    # When a request created now was really pressed. Requests
+    # which don't come straight from a button, like journal
+    # replays, are timed from when they were created
+    def pressed_ms(self, now: int) -> int:
+        if self._interrupt_ms is None:
+            return now
+        return self._interrupt_ms
+
+    # Record how long a stage took, from the given tick until now
+    def record(self, stage: str, since: int, now: int | None = None):
+        if now is None:
+            now = clock.ticks_ms()
+        self.histograms[stage].add(clock.ticks_diff(now, since))
+
+    def summary(self) -> dict:
+        return {stage: self.histograms[stage].summary() for stage in STAGES}
+
+    def to_json(self) -> str:
+        return json.dumps(self.summary())
+
+    # Short enough for a single BLE characteristic read
+    def compact(self) -> str:
+        p50, p95, p99 = self.histograms[TOTAL].percentiles(50, 95, 99)
+        return 'ms ' + str(p50) + '/' + str(p95) + '/' + str(p99)
+
+
+# Shared by the board and the request queue
+stats = LatencyStats()
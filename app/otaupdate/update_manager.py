@@ -1,3 +1,4 @@
+import asyncio
 import time
 import os
 
@@ -8,6 +9,9 @@ _last_restart_day = 0
 _check_ticker_interval = 80
 _check_ticker = _check_ticker_interval
 
+# How often the update task wakes up to check the clock
+check_interval_s = 60
+
 
 def should_check_update():
     (_, _, day, hour, _, _, _, _) = time.localtime()
@@ -37,11 +41,23 @@ def last_update():
 
 
 def record_update(day):
+    global _last_restart_day
+
+    _last_restart_day = day
     with open(_dir + '/' + _last_restart_file_name, 'w') as last_restart_file:
         last_restart_file.write(str(day))
         last_restart_file.close()
 
 
+# Long-lived task which checks for updates on an interval
+async def run():
+    while True:
+        if should_check_update():
+            try_update()
+
+        await asyncio.sleep(check_interval_s)
+
+
 def try_update():
     import machine, gc
 
@@ -0,0 +1,139 @@
+from machine import Timer
+
+from .. import clock
+from .journal import PressJournal
+from .queue import RequestQueue
+from .request import Request, PRIORITY_LOW
+
+
+# Sits between the board and the request queue, turning bursts
+# of input into fewer, more meaningful requests:
+#   - repeats of a key within the window are dropped
+#   - dial presses settle for the window, and only the latest
+#     selection is sent
+#   - optionally, keys pressed while earlier presses are still
+#     waiting to be sent join their request
+#   - while offline, presses are kept in the journal until they
+#     can be replayed
+class PressBatcher:
+
+    window_ms = 200
+
+    def __init__(
+        self,
+        queue: RequestQueue,
+        new_request,
+        window_ms: int = window_ms,
+        batch: bool = False,
+        journal: PressJournal | None = None,
+    ):
+        self.queue = queue
+        self.window_ms = window_ms
+        self.batch = batch
+
+        # Whether presses can be sent right now. Otherwise they
+        # go to the journal, if there is one
+        self.journal = journal
+        self.online = lambda: True
+
+        # Builds a request carrying one or more keys
+        self.new_request = new_request
+
+        # Tick of the last press sent for each key
+        self._last_sent: dict[str, int] = {}
+
+        # The latest request which may still accept more keys,
+        # along with the keys it carries
+        self._open: Request | None = None
+        self._open_keys: list[str] = []
+
+        # The latest dial selection, waiting to settle
+        self._dial: str | None = None
+        self._dial_timer: Timer | None = None
+
+        # Number of presses absorbed since boot
+        self.coalesced = 0
+
+    # Handle a key press
+    def press(self, key: str, priority: int | None = None):
+        now = clock.ticks_ms()
+
+        last = self._last_sent.get(key)
+        if last is not None and clock.ticks_diff(now, last) < self.window_ms:
+            print("Coalesced repeat press: " + key)
+            self.coalesced += 1
+            return
+
+        self._last_sent[key] = now
+
+        if self.journal is not None and not self.online():
+            self.journal.append(key, priority, Request.boot_id,
+                                Request.new_id())
+            return
+
+        if self.batch and self._open is not None:
+            keys = self._open_keys + [key]
+            merged = self.new_request(keys)
+            merged.priority = min(merged.priority, self._open.priority)
+            if self.queue.replace(self._open, merged):
+                self._open = merged
+                self._open_keys = keys
+                self.coalesced += 1
+                return
+
+        req = self.new_request([key])
+        if priority is not None:
+            req.priority = priority
+        self.queue.add(req)
+
+        self._open = req
+        self._open_keys = [key]
+
+    # Send a press replayed from the journal, with the idempotency
+    # key it was journaled with. Returns False, without sending, if
+    # the queue has no room for it yet
+    def resubmit(self,
+                 key: str,
+                 priority: int | None = None,
+                 ident: tuple | None = None) -> bool:
+        if not self.queue.has_room():
+            return False
+
+        req = self.new_request([key])
+        if priority is not None:
+            req.priority = priority
+        if ident is not None:
+            req.boot, req.id = ident
+        self.queue.add(req)
+        return True
+
+    # Replay presses journaled while offline
+    async def replay(self):
+        if self.journal is not None:
+            await self.journal.replay(self.resubmit)
+
+    # Handle a dial press. The press is held until the dial
+    # settles, and replaced if another selection comes first
+    def dial(self, key: str):
+        if self._dial is not None:
+            self.coalesced += 1
+
+        self._dial = key
+
+        if self._dial_timer is not None:
+            self._dial_timer.deinit()
+
+        self._dial_timer = Timer(
+            -1,
+            mode=Timer.ONE_SHOT,
+            period=self.window_ms,
+            callback=lambda _: self._settle(),
+        )
+
+    def _settle(self):
+        self._dial_timer = None
+
+        key = self._dial
+        self._dial = None
+        if key is not None:
+            self.press(key, PRIORITY_LOW)
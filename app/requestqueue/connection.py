@@ -0,0 +1,250 @@
+import errno
+import select
+import socket
+
+from .. import clock
+from .request import Request
+from .response import ResponseParser
+
+# Connection states
+CONNECTING = 'connecting'
+IDLE = 'idle'
+SENDING = 'sending'
+AWAITING = 'awaiting'
+CLOSED = 'closed'
+
+# Outcomes reported back to the queue as the state advances
+SENT = 'sent'
+DONE = 'done'
+FAILED = 'failed'
+
+# Errors from non-blocking sockets which only mean "not yet"
+WOULD_BLOCK = (errno.EAGAIN, errno.EINPROGRESS)
+
+
+# Split a "host[:port]" string into its parts
+def parse_host(host: str, default_port: int) -> tuple[str, int]:
+    ind = host.rfind(':')
+    if ind < 0:
+        return (host, default_port)
+    return (host[0:ind], int(host[ind + 1:]))
+
+
+# select.poll reports events against the socket itself on
+# MicroPython, but against its file descriptor on CPython
+def poll_key(sock) -> object:
+    if hasattr(sock, 'fileno'):
+        return sock.fileno()
+    return sock
+
+
+# Whether a non-blocking connect() finished without an error, once
+# the socket is writable. CPython reports connection errors through
+# SO_ERROR, MicroPython through POLLERR/POLLHUP
+def connected(sock) -> bool:
+    if hasattr(socket, 'SO_ERROR'):
+        return sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+    return True
+
+
+# Read into a buffer, returning the number of bytes read. MicroPython
+# sockets read into buffers as streams, returning None when nothing
+# is waiting
+def recv_into(sock, buf) -> int | None:
+    if hasattr(sock, 'recv_into'):
+        return sock.recv_into(buf)
+    return sock.readinto(buf)
+
+
+# A single non-blocking HTTP connection. Nothing here waits on
+# the network: each poll event moves the connection through
+# connecting -> sending -> awaiting a response -> idle
+class Connection:
+
+    connect_timeout_ms = 2000
+    recv_size = 256
+
+    # Requests are encoded into a buffer owned by the connection,
+    # which lives as long as the connection does
+    buffer_size = 512
+
+    def __init__(self, address, poller):
+        self.poller = poller
+        self.state = CONNECTING
+        self.request: Request | None = None
+
+        # Whether a previous request completed on this
+        # connection, meaning the server may since have
+        # closed it
+        self.reused = False
+
+        self.socket = socket.socket()
+        self.socket.setblocking(False)
+        self.key = poll_key(self.socket)
+
+        # Connections which never finish connecting are
+        # abandoned after this tick
+        self.deadline = clock.ticks_add(clock.ticks_ms(),
+                                        Connection.connect_timeout_ms)
+
+        self.buffer = bytearray(Connection.buffer_size)
+
+        # Responses are read into a fixed buffer, and parsed as
+        # they arrive
+        self._rx = bytearray(Connection.recv_size)
+        self._parser = ResponseParser()
+
+        # Bytes still to be written for the current request
+        self._out: memoryview | None = None
+
+        try:
+            self.socket.connect(address)
+        except OSError as e:
+            if e.args[0] not in WOULD_BLOCK:
+                self.socket.close()
+                raise e
+
+        # The socket becomes writable once connected
+        self.poller.register(self.socket, select.POLLOUT)
+
+    def is_expired(self) -> bool:
+        return (self.state == CONNECTING
+                and clock.ticks_diff(clock.ticks_ms(), self.deadline) > 0)
+
+    # Begin sending a request. Returns an outcome if one is
+    # reached without waiting
+    def start(self, req: Request, raw) -> str | None:
+        self.request = req
+        self._out = memoryview(raw)
+        self._parser.reset()
+
+        if self.state == IDLE:
+            self.state = SENDING
+            return self._write()
+
+        return None
+
+    # Advance the state machine for a poll event
+    def on_event(self, event: int) -> str | None:
+        if self.state == CONNECTING:
+            if event & (select.POLLERR | select.POLLHUP):
+                return self._fail()
+
+            if event & select.POLLOUT:
+                if not connected(self.socket):
+                    return self._fail()
+
+                if self.request is None:
+                    self.state = IDLE
+                    self.poller.modify(self.socket, select.POLLIN)
+                    return None
+
+                self.state = SENDING
+                return self._write()
+
+        elif self.state == SENDING:
+            if event & (select.POLLERR | select.POLLHUP):
+                return self._fail()
+
+            if event & select.POLLOUT:
+                return self._write()
+
+        elif self.state == AWAITING:
+            if event & (select.POLLIN | select.POLLERR | select.POLLHUP):
+                return self._read()
+
+        elif self.state == IDLE:
+            # An idle connection became readable, so the server
+            # either closed it or sent data nobody asked for.
+            # Either way it can't be trusted for a request
+            return self._fail()
+
+        return None
+
+    # Detach and return the current request
+    def finish(self) -> Request | None:
+        req = self.request
+        self.request = None
+        self._out = None
+        return req
+
+    def close(self):
+        if self.state == CLOSED:
+            return
+
+        self.state = CLOSED
+        self.poller.unregister(self.socket)
+        self.socket.close()
+
+    # Write as much of the request as the socket accepts,
+    # picking up where the last partial write stopped
+    def _write(self) -> str | None:
+        try:
+            n = self.socket.send(self._out)
+        except OSError as e:
+            if e.args[0] not in WOULD_BLOCK:
+                return self._fail()
+            n = 0
+
+        if n is not None:
+            self._out = self._out[n:]
+
+        # Wait until the socket is writable again, as an idle
+        # connection is only polled for reads
+        if len(self._out) > 0:
+            self.poller.modify(self.socket, select.POLLOUT)
+            return None
+
+        self._out = None
+        self.state = AWAITING
+        self.poller.modify(self.socket, select.POLLIN)
+        return SENT
+
+    def _read(self) -> str | None:
+        try:
+            n = recv_into(self.socket, self._rx)
+        except OSError as e:
+            if e.args[0] in WOULD_BLOCK:
+                return None
+            return self._fail()
+
+        if n is None:
+            return None
+
+        parser = self._parser
+        if n == 0:
+            # The server closed the connection. That's only a
+            # response if the body was running until close, and
+            # otherwise means the server dropped the request
+            if parser.received > 0 and parser.finish():
+                return self._complete()
+            return self._fail()
+
+        used = parser.feed(self._rx, n)
+        if not parser.done:
+            return None
+
+        if parser.error:
+            return self._fail()
+
+        # Anything after the response wasn't asked for, so the
+        # connection can't be trusted with another request
+        if used < n:
+            parser.keep_alive = False
+
+        return self._complete()
+
+    def _complete(self) -> str:
+        self.request.status_code = self._parser.status
+        self.reused = True
+
+        if self._parser.keep_alive:
+            self.state = IDLE
+        else:
+            self.close()
+
+        return DONE
+
+    def _fail(self) -> str:
+        self.close()
+        return FAILED
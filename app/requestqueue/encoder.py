@@ -0,0 +1,114 @@
+import json
+
+from .request import Request
+
+_HEX = b'0123456789abcdef'
+
+# Stands in for the idempotency key in templates. Keys are
+# always written as two fixed-width hex numbers, so the
+# template's Content-Length never changes
+_ID_PLACEHOLDER = b'XXXXXXXX-XXXXXXXX'
+
+
+# Write a request's idempotency key into a buffer, in place
+def _write_id(buf, offset: int, req: Request):
+    boot = req.boot
+    seq = req.id
+    for i in range(8):
+        buf[offset + 7 - i] = _HEX[(boot >> (4 * i)) & 0xf]
+        buf[offset + 16 - i] = _HEX[(seq >> (4 * i)) & 0xf]
+    buf[offset + 8] = 0x2d
+
+
+# Renders webhook requests into a connection's preallocated
+# buffer. The switch name, layout and host never change, so
+# single-key presses are copied from a template rendered once
+# per key, and only the idempotency key is written per press
+class RequestEncoder:
+
+    def __init__(self, host: str, switch: str = '', layout: str = ''):
+        self.host = host.encode('utf-8')
+        self.switch = switch
+        self.layout = layout
+
+        # (path, key) -> (template, offsets of the idempotency
+        # key within it)
+        self._templates: dict[tuple, tuple] = {}
+
+    # Render templates ahead of time, so the first press of each
+    # key doesn't have to
+    def prepare(self, path: str, keys: list[str]):
+        for key in keys:
+            self._template(path, key)
+
+    def press_body(self, keys: list[str], id_text: str) -> str:
+        body = {
+            "switch": self.switch,
+            "layout": self.layout,
+            "key": keys[0],
+            # Stays the same across retries, so Home Assistant
+            # can ignore duplicates
+            "id": id_text,
+        }
+
+        # Batched presses list every key, in the order pressed
+        if len(keys) > 1:
+            body["keys"] = keys
+
+        return json.dumps(body)
+
+    def _head(self, path: str, length: int, id_text: bytes) -> bytes:
+        return (b'POST /api/webhook/' + path.encode('utf-8') +
+                b' HTTP/1.1\r\nHost: ' + self.host +
+                b'\r\nContent-Type: application/json' +
+                b'\r\nContent-Length: ' + str(length).encode('utf-8') +
+                b'\r\nIdempotency-Key: ' + id_text +
+                b'\r\nConnection: keep-alive\r\n\r\n')
+
+    def _template(self, path: str, key: str) -> tuple:
+        template = self._templates.get((path, key))
+        if template is not None:
+            return template
+
+        body = self.press_body([key], _ID_PLACEHOLDER.decode()).encode()
+        raw = self._head(path, len(body), _ID_PLACEHOLDER) + body
+
+        offsets = []
+        ind = raw.find(_ID_PLACEHOLDER)
+        while ind >= 0:
+            offsets.append(ind)
+            ind = raw.find(_ID_PLACEHOLDER, ind + 1)
+
+        template = (raw, tuple(offsets))
+        self._templates[(path, key)] = template
+        return template
+
+    # Encode a request into buf, returning the bytes to send.
+    # Requests which don't fit get a buffer of their own
+    def encode(self, req: Request, buf: bytearray):
+        if req.keys is not None and len(req.keys) == 1:
+            raw, offsets = self._template(req.path, req.keys[0])
+            n = len(raw)
+            if n <= len(buf):
+                view = memoryview(buf)
+                view[0:n] = raw
+                for offset in offsets:
+                    _write_id(buf, offset, req)
+                return view[0:n]
+
+        # Batched presses, and anything which isn't a press, are
+        # rendered from scratch
+        id_text = req.id_text()
+        if req.keys is not None:
+            body = self.press_body(req.keys, id_text).encode('utf-8')
+        else:
+            body = req.body.encode('utf-8')
+
+        raw = self._head(req.path, len(body), id_text.encode('utf-8')) + body
+        n = len(raw)
+        if n > len(buf):
+            return raw
+
+        view = memoryview(buf)
+        view[0:n] = raw
+        return view[0:n]
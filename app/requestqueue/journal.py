@@ -0,0 +1,185 @@
+import asyncio
+import os
+import struct
+import time
+
+# Record types. Presses journaled without their idempotency key,
+# including those written by older firmware, are given a new one
+# on replay
+_EMPTY = 0
+_PRESS = 1
+_ACK = 2
+_PRESS_ID = 3
+
+# seq, time, type, priority, length, data
+_RECORD = '<IIBBB53s'
+_RECORD_SIZE = 64
+
+# Stored in place of a priority when the press had none
+_NO_PRIORITY = 255
+
+# Boot id and sequence number, ahead of the key
+_ID = '<II'
+_ID_SIZE = 8
+
+
+# An append-only ring of fixed-size records on flash, holding
+# presses made while offline until they can be sent. Records are
+# written in sequence around the ring and never rewritten in
+# place, so writes are spread evenly across the file. Replayed
+# presses are marked with an ack record rather than erased
+class PressJournal:
+
+    filename = 'journal.bin'
+    slots = 64
+    max_age_s = 600
+
+    # How many presses are replayed between acks
+    ack_every = 8
+
+    # How long replay waits for room in the queue
+    replay_wait_s = 0.1
+
+    def __init__(
+        self,
+        filename: str = filename,
+        slots: int = slots,
+        max_age_s: int = max_age_s,
+    ):
+        self.filename = filename
+        self.slots = slots
+        self.max_age_s = max_age_s
+
+        # Sequence number of the last record written, and of the
+        # last press acknowledged
+        self._seq = 0
+        self._acked = 0
+
+        self._replaying = False
+
+        self._load()
+
+    # Create the file if needed, then find where the ring left off
+    def _load(self):
+        size = self.slots * _RECORD_SIZE
+
+        try:
+            if os.stat(self.filename)[6] != size:
+                raise OSError('journal size changed')
+        except OSError:
+            with open(self.filename, 'wb') as f:
+                f.write(bytes(size))
+            return
+
+        for seq, _, kind, _, data in self._records():
+            if seq > self._seq:
+                self._seq = seq
+            if kind == _ACK:
+                acked = struct.unpack('<I', data[0:4])[0]
+                if acked > self._acked:
+                    self._acked = acked
+
+    def _records(self):
+        with open(self.filename, 'rb') as f:
+            for _ in range(self.slots):
+                raw = f.read(_RECORD_SIZE)
+                seq, at, kind, priority, length, data = struct.unpack(
+                    _RECORD, raw)
+                if kind != _EMPTY:
+                    yield (seq, at, kind, priority, data[0:length])
+
+    def _write(self, kind: int, priority: int, data: bytes):
+        self._seq += 1
+        raw = struct.pack(
+            _RECORD,
+            self._seq,
+            int(time.time()),
+            kind,
+            priority,
+            len(data),
+            data,
+        )
+
+        with open(self.filename, 'r+b') as f:
+            f.seek(((self._seq - 1) % self.slots) * _RECORD_SIZE)
+            f.write(raw)
+
+    # Record a press made while offline, along with the boot id
+    # and sequence number making up its idempotency key, so a
+    # replay sent twice can be told apart from a new press
+    def append(self,
+               key: str,
+               priority: int | None = None,
+               boot: int | None = None,
+               press_id: int | None = None):
+        data = key.encode('utf-8')
+        if priority is None:
+            priority = _NO_PRIORITY
+
+        if press_id is None:
+            self._write(_PRESS, priority, data[0:53])
+        else:
+            ident = struct.pack(_ID, boot, press_id)
+            self._write(_PRESS_ID, priority, ident + data[0:53 - _ID_SIZE])
+        print('Journaled offline press: ' + key)
+
+    def _ack(self, seq: int):
+        self._acked = seq
+        self._write(_ACK, 0, struct.pack('<I', seq))
+
+    # Presses not yet replayed, oldest first, as (seq, time,
+    # key, priority, (boot, id)). The idempotency key is None for
+    # presses journaled without one
+    def pending(self) -> list[tuple]:
+        presses = []
+        for seq, at, kind, priority, data in self._records():
+            if kind not in (_PRESS, _PRESS_ID) or seq <= self._acked:
+                continue
+
+            if priority == _NO_PRIORITY:
+                priority = None
+
+            ident = None
+            if kind == _PRESS_ID:
+                ident = struct.unpack(_ID, data[0:_ID_SIZE])
+                data = data[_ID_SIZE:]
+
+            presses.append((seq, at, data.decode('utf-8'), priority, ident))
+
+        presses.sort(key=lambda press: press[0])
+        return presses
+
+    # Send journaled presses in order through submit(key,
+    # priority, ident), which returns False while there's no room
+    # for another. Presses older than max_age_s are skipped
+    async def replay(self, submit):
+        if self._replaying:
+            return
+
+        self._replaying = True
+        try:
+            presses = self.pending()
+            if len(presses) == 0:
+                return
+
+            print('Replaying ' + str(len(presses)) + ' offline presses')
+
+            now = int(time.time())
+            unacked = 0
+            for seq, at, key, priority, ident in presses:
+                # A negative age means the clock was reset since
+                # the press, so its age can't be trusted
+                age = now - at
+                if 0 <= age and age <= self.max_age_s:
+                    while not submit(key, priority, ident):
+                        await asyncio.sleep(PressJournal.replay_wait_s)
+
+                unacked += 1
+                if unacked >= PressJournal.ack_every:
+                    self._ack(seq)
+                    unacked = 0
+
+            if unacked > 0:
+                self._ack(presses[-1][0])
+        finally:
+            self._replaying = False
@@ -0,0 +1,546 @@
+import select
+import socket
+import struct
+
+from .. import clock
+from .connection import WOULD_BLOCK, connected, parse_host, poll_key, recv_into
+from .encoder import RequestEncoder
+from .request import Request
+from .transport import Transport
+
+# Control packet types, as the high nibble of the first byte
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+PINGREQ = 0xc0
+PINGRESP = 0xd0
+DISCONNECT = 0xe0
+
+# Flags in the low nibble of a PUBLISH
+DUP = 0x08
+QOS_1 = 0x02
+RETAIN = 0x01
+
+# Connection states
+CLOSED = 'closed'
+CONNECTING = 'connecting'
+HANDSHAKE = 'handshake'
+CONNECTED = 'connected'
+
+
+def _length(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = n & 0x7f
+        n >>= 7
+        if n > 0:
+            byte |= 0x80
+        out.append(byte)
+        if n == 0:
+            return bytes(out)
+
+
+def _string(s: bytes) -> bytes:
+    return struct.pack('!H', len(s)) + s
+
+
+def packet(first: int, body: bytes = b'') -> bytes:
+    return bytes([first]) + _length(len(body)) + body
+
+
+# Sessions are kept by the broker across reconnects unless clean is
+# set, and the will is published for us if we drop without saying
+# goodbye
+def connect_packet(client_id: str,
+                   keepalive_s: int,
+                   clean: bool = False,
+                   will: tuple | None = None,
+                   username: str | None = None,
+                   password: str | None = None) -> bytes:
+    flags = 0x02 if clean else 0
+    payload = _string(client_id.encode('utf-8'))
+
+    if will is not None:
+        topic, message = will
+        # Will flag, will QoS 1, will retain
+        flags |= 0x04 | 0x08 | 0x20
+        payload += _string(topic.encode('utf-8')) + _string(message)
+
+    if username is not None:
+        flags |= 0x80
+        payload += _string(username.encode('utf-8'))
+    if password is not None:
+        flags |= 0x40
+        payload += _string(password.encode('utf-8'))
+
+    return packet(
+        CONNECT,
+        _string(b'MQTT') + struct.pack('!BBH', 4, flags, keepalive_s) +
+        payload)
+
+
+def publish_packet(topic: str,
+                   payload: bytes,
+                   pid: int = 0,
+                   retain: bool = False,
+                   dup: bool = False) -> bytes:
+    first = PUBLISH
+    body = _string(topic.encode('utf-8'))
+    if pid > 0:
+        first |= QOS_1
+        body += struct.pack('!H', pid)
+    if retain:
+        first |= RETAIN
+    if dup:
+        first |= DUP
+
+    return packet(first, body + payload)
+
+
+# Returns (first byte, body, bytes used) for the packet at the start
+# of buf, or None until all of it has arrived
+def parse_packet(buf: bytes) -> tuple | None:
+    length = 0
+    shift = 0
+    i = 1
+    while True:
+        if i >= len(buf):
+            return None
+        if i > 4:
+            raise ValueError('Malformed remaining length')
+
+        byte = buf[i]
+        length |= (byte & 0x7f) << shift
+        shift += 7
+        i += 1
+        if byte & 0x80 == 0:
+            break
+
+    if len(buf) < i + length:
+        return None
+
+    return buf[0], buf[i:i + length], i + length
+
+
+# A QoS 1 publish awaiting its PUBACK
+class Publish:
+
+    def __init__(self, req: Request | None, topic: str, payload: bytes,
+                 pid: int, retain: bool):
+        self.req = req
+        self.topic = topic
+        self.payload = payload
+        self.pid = pid
+        self.retain = retain
+
+        # Whether it's been written to any connection, so resends
+        # are marked as duplicates
+        self.sent = False
+
+        # Connections lost while it was in flight
+        self.losses = 0
+
+
+# Publishes presses to an MQTT 3.1.1 broker over one persistent
+# connection. Each press is published at QoS 1 to <prefix>/<id>/press
+# with the webhook's body, and counts as delivered once the broker
+# acks it. Presses in flight when the connection drops are resent
+# once it's back. They're given up on after max_losses, or once
+# they've waited as long as a webhook request would.
+#
+# The switch's availability is kept retained on
+# <prefix>/<id>/availability, with the broker publishing "offline"
+# for us if the connection dies, and its last press is kept retained
+# on <prefix>/<id>/state
+class MqttTransport(Transport):
+
+    default_port = 1883
+    prefix = 'pico-switch'
+
+    keepalive_s = 60
+
+    # How long the broker has to answer a CONNECT, PUBLISH or
+    # PINGREQ before the connection is taken to be dead
+    response_timeout_ms = 5000
+
+    # Wait between connection attempts
+    reconnect_ms = 2000
+
+    # Presses awaiting acks at once
+    window = 8
+
+    # Connections a press may outlive before it's given up on
+    max_losses = 3
+
+    recv_size = 128
+
+    def __init__(self,
+                 host: str,
+                 client_id: str,
+                 encoder: RequestEncoder,
+                 prefix: str | None = None,
+                 username: str | None = None,
+                 password: str | None = None):
+        super().__init__()
+
+        self.host, self.port = parse_host(host, MqttTransport.default_port)
+        self.client_id = client_id
+        self.encoder = encoder
+        self.username = username
+        self.password = password
+
+        base = (prefix or MqttTransport.prefix) + '/' + client_id
+        self.topic = base
+        self.availability_topic = base + '/availability'
+        self.state_topic = base + '/state'
+
+        self.state = CLOSED
+        self.socket = None
+        self.key = None
+        self.poller = None
+
+        # Bytes written but not yet accepted by the socket, and
+        # bytes received but not yet parsed
+        self._out = b''
+        self._in = b''
+        self._rx = bytearray(MqttTransport.recv_size)
+
+        # Publishes awaiting acks, in the order taken
+        self._publishes: list[Publish] = []
+        self._last_pid = 0
+
+        # Tick by which the broker must answer, while it owes us
+        # an answer
+        self._deadline: int | None = None
+        self._pinging = False
+
+        # Tick of the last packet sent, for keep-alive pings
+        self._last_sent = 0
+
+        # Tick of the next connection attempt, while closed
+        self._retry_at = 0
+
+        self.session_present = False
+        self.connects = 0
+        self.pings = 0
+
+    def open(self, poller):
+        self.poller = poller
+        self._connect()
+
+    # Start connecting. Failing straight away, as before WiFi is up,
+    # counts against the presses waiting just as a dropped
+    # connection does
+    def _connect(self):
+        try:
+            address = socket.getaddrinfo(self.host, self.port)[0][-1]
+            self.socket = socket.socket()
+            self.socket.setblocking(False)
+            self.key = poll_key(self.socket)
+            self.socket.connect(address)
+        except OSError as e:
+            if e.args[0] not in WOULD_BLOCK:
+                if self.socket is not None:
+                    self.socket.close()
+                    self.socket = None
+                self._lost('failed to reach broker: ' + str(e))
+                return
+
+        self.state = CONNECTING
+        self.connects += 1
+        self._in = b''
+        self._out = connect_packet(self.client_id,
+                                   MqttTransport.keepalive_s,
+                                   will=(self.availability_topic, b'offline'),
+                                   username=self.username,
+                                   password=self.password)
+        self._deadline = clock.ticks_add(clock.ticks_ms(),
+                                         MqttTransport.response_timeout_ms)
+
+        # The socket becomes writable once connected
+        self.poller.register(self.socket, select.POLLOUT)
+
+    def takes(self, req: Request) -> bool:
+        return True
+
+    def send(self, req: Request) -> bool:
+        if req.keys is not None:
+            payload = self.encoder.press_body(req.keys, req.id_text())
+        else:
+            payload = req.body or ''
+        payload = payload.encode('utf-8')
+
+        req.started()
+        self._publish(req, self.topic + '/' + req.path, payload)
+
+        # Only the latest press is worth keeping, so it's
+        # retained without waiting for an ack
+        if req.keys is not None and self.state == CONNECTED:
+            self._write(publish_packet(self.state_topic, payload, retain=True))
+        return True
+
+    def busy(self) -> bool:
+        return self.in_flight() >= MqttTransport.window
+
+    def _publish(self,
+                 req: Request | None,
+                 topic: str,
+                 payload: bytes,
+                 retain: bool = False):
+        self._last_pid = self._last_pid % 0xffff + 1
+        publish = Publish(req, topic, payload, self._last_pid, retain)
+        self._publishes.append(publish)
+
+        if self.state == CONNECTED:
+            self._transmit(publish)
+
+    def _transmit(self, publish: Publish):
+        self._write(
+            publish_packet(publish.topic, publish.payload, publish.pid,
+                           publish.retain, publish.sent))
+        publish.sent = True
+        self._expect_answer()
+
+    def _expect_answer(self):
+        if self._deadline is None:
+            self._deadline = clock.ticks_add(clock.ticks_ms(),
+                                             MqttTransport.response_timeout_ms)
+
+    # Nothing's written once the connection has died, as the next
+    # one starts afresh
+    def _write(self, data: bytes):
+        if self.socket is None:
+            return
+        self._out += data
+        if self.state != CONNECTING:
+            self._flush()
+
+    # Write as much as the socket accepts, keeping the rest until
+    # it's writable again
+    def _flush(self):
+        if self.socket is None:
+            return
+
+        if len(self._out) > 0:
+            try:
+                n = self.socket.send(self._out)
+            except OSError as e:
+                if e.args[0] not in WOULD_BLOCK:
+                    self._lost('send failed: ' + str(e))
+                    return
+                n = 0
+
+            if n is not None and n > 0:
+                self._out = self._out[n:]
+                self._last_sent = clock.ticks_ms()
+
+        mask = select.POLLIN
+        if len(self._out) > 0:
+            mask |= select.POLLOUT
+        self.poller.modify(self.socket, mask)
+
+    def on_event(self, key, event: int) -> bool:
+        if self.socket is None or key != self.key:
+            return False
+
+        if event & (select.POLLERR | select.POLLHUP):
+            self._lost('connection closed')
+            return True
+
+        if self.state == CONNECTING and event & select.POLLOUT:
+            if not connected(self.socket):
+                self._lost('connection refused')
+                return True
+            self.state = HANDSHAKE
+
+        if event & select.POLLOUT:
+            self._flush()
+        if event & select.POLLIN and self.socket is not None:
+            self._read()
+        return True
+
+    def _read(self):
+        try:
+            n = recv_into(self.socket, self._rx)
+        except OSError as e:
+            if e.args[0] not in WOULD_BLOCK:
+                self._lost('receive failed: ' + str(e))
+            return
+
+        if n is None:
+            return
+        if n == 0:
+            self._lost('closed by broker')
+            return
+
+        self._in += bytes(self._rx[0:n])
+        while self.socket is not None:
+            try:
+                parsed = parse_packet(self._in)
+            except ValueError as e:
+                self._lost(str(e))
+                return
+
+            if parsed is None:
+                return
+
+            first, body, used = parsed
+            self._in = self._in[used:]
+            self._on_packet(first & 0xf0, body)
+
+    def _on_packet(self, kind: int, body: bytes):
+        # Both always carry exactly two bytes
+        if kind in (CONNACK, PUBACK) and len(body) != 2:
+            self._lost('malformed packet from broker')
+            return
+
+        if kind == CONNACK:
+            if body[1] != 0:
+                self._lost('connection refused with code %d' % body[1])
+                return
+            self.session_present = body[0] & 0x01 == 1
+            self._deadline = None
+            self.state = CONNECTED
+            self._on_connected()
+            if self.state != CONNECTED:
+                return
+
+        elif kind == PUBACK:
+            pid = struct.unpack('!H', body)[0]
+            for i, publish in enumerate(self._publishes):
+                if publish.pid == pid and publish.sent:
+                    del self._publishes[i]
+                    if publish.req is not None:
+                        publish.req.status_code = 200
+                        self.on_done(publish.req, True)
+                    break
+
+        elif kind == PINGRESP:
+            self._pinging = False
+
+        # Keep waiting while the broker still owes us answers
+        self._deadline = None
+        if self._pinging or any(p.sent for p in self._publishes):
+            self._expect_answer()
+
+    def _on_connected(self):
+        self._publish(None, self.availability_topic, b'online', retain=True)
+
+        # Everything taken while disconnected, or not acked before
+        # the connection dropped, goes out now, unless it drops again
+        # partway through
+        for publish in list(self._publishes):
+            if self.state != CONNECTED:
+                return
+            if publish.req is not None:
+                self._transmit(publish)
+
+    # The connection died. Presses still in flight wait for the next
+    # one, unless they've already outlived too many
+    def _lost(self, reason: str):
+        print('MQTT connection down: ' + reason)
+        self._close_socket()
+        self._retry_at = clock.ticks_add(clock.ticks_ms(),
+                                         MqttTransport.reconnect_ms)
+
+        kept = []
+        failed = []
+        for publish in self._publishes:
+            if publish.req is None:
+                # Availability is republished on reconnecting
+                continue
+            publish.losses += 1
+            if publish.losses >= MqttTransport.max_losses:
+                failed.append(publish.req)
+            else:
+                kept.append(publish)
+        self._publishes = kept
+
+        for req in failed:
+            self.on_done(req, False)
+
+    def _close_socket(self):
+        if self.socket is not None:
+            self.poller.unregister(self.socket)
+            self.socket.close()
+            self.socket = None
+
+        self.state = CLOSED
+        self._out = b''
+        self._deadline = None
+        self._pinging = False
+
+    # Give up on presses which have waited as long as a webhook
+    # request would, reconnect, and ping or drop a connection gone
+    # quiet
+    def service(self):
+        now = clock.ticks_ms()
+
+        for publish in list(self._publishes):
+            if publish.req is not None and publish.req.is_expired(now):
+                self._publishes.remove(publish)
+                self.on_done(publish.req, False)
+
+        if self.state == CLOSED:
+            if (self.poller is not None
+                    and clock.ticks_diff(now, self._retry_at) >= 0):
+                self._connect()
+            return
+
+        if (self._deadline is not None
+                and clock.ticks_diff(now, self._deadline) >= 0):
+            self._lost('broker stopped answering')
+            return
+
+        if (self.state == CONNECTED and not self._pinging
+                and clock.ticks_diff(now, self._ping_due()) >= 0):
+            self._pinging = True
+            self.pings += 1
+            self._write(packet(PINGREQ))
+            self._expect_answer()
+
+    def _ping_due(self) -> int:
+        return clock.ticks_add(self._last_sent,
+                               MqttTransport.keepalive_s * 1000)
+
+    def in_flight(self) -> int:
+        count = 0
+        for publish in self._publishes:
+            if publish.req is not None:
+                count += 1
+        return count
+
+    def next_due_ms(self) -> int | None:
+        if self.poller is None:
+            return None
+
+        due = None
+        if self.state == CLOSED:
+            due = self._retry_at
+        elif self._deadline is not None:
+            due = self._deadline
+        elif self.state == CONNECTED:
+            due = self._ping_due()
+
+        now = clock.ticks_ms()
+        nearest = None if due is None else clock.ticks_diff(due, now)
+        for publish in self._publishes:
+            if publish.req is not None:
+                remaining = clock.ticks_diff(publish.req.expiry, now)
+                if nearest is None or remaining < nearest:
+                    nearest = remaining
+
+        return None if nearest is None else max(0, nearest)
+
+    # Say goodbye, so the broker doesn't publish the will, and
+    # leave the switch marked offline
+    def close(self):
+        if self.state == CONNECTED:
+            self._write(
+                publish_packet(
+                    self.availability_topic, b'offline', retain=True) +
+                packet(DISCONNECT))
+
+        self._close_socket()
+        self.poller = None
@@ -0,0 +1,109 @@
+import socket
+
+from .connection import Connection, CONNECTING, IDLE, CLOSED, parse_host
+
+
+# Keeps a small set of persistent HTTP/1.1 connections to a
+# single host, so requests don't pay for a TCP handshake
+class ConnectionPool:
+
+    default_port = 8123
+
+    # Split a "host[:port]" string into its parts
+    @staticmethod
+    def parse_host(host: str) -> tuple[str, int]:
+        return parse_host(host, ConnectionPool.default_port)
+
+    def __init__(self, host: str, size: int, poller):
+        self.host, self.port = ConnectionPool.parse_host(host)
+        self.size = size
+
+        # Connections register themselves with the queue's
+        # poller, so their events arrive alongside requests
+        self.poller = poller
+
+        self._address = None
+
+        # Open connections, indexed by poll key
+        self._connections: dict[object, Connection] = {}
+
+        # Number of connections dropped since the last refill
+        self._dropped = 0
+
+    def _resolve(self):
+        if self._address is None:
+            self._address = socket.getaddrinfo(self.host, self.port)[0][-1]
+        return self._address
+
+    def _connect(self) -> Connection:
+        conn = Connection(self._resolve(), self.poller)
+        self._connections[conn.key] = conn
+        return conn
+
+    # Number of open connections
+    def open(self) -> int:
+        return len(self._connections)
+
+    # Find the connection matching a polled object
+    def by_key(self, key) -> Connection | None:
+        return self._connections.get(key)
+
+    # Take a connection without a request, preferring one
+    # which is already established. Opens a new connection
+    # if there's room, and returns None otherwise
+    def acquire(self) -> Connection | None:
+        waiting = None
+        for conn in self._connections.values():
+            if conn.request is not None:
+                continue
+            if conn.state == IDLE:
+                return conn
+            if conn.state == CONNECTING and waiting is None:
+                waiting = conn
+
+        if waiting is not None:
+            return waiting
+
+        if self.open() >= self.size:
+            return None
+
+        return self._connect()
+
+    # Close and forget a connection which can't be reused
+    def discard(self, conn: Connection):
+        if self._connections.get(conn.key) is not conn:
+            return
+
+        conn.close()
+        del self._connections[conn.key]
+        self._dropped += 1
+
+    # Drop connections which are closed, or never finished
+    # connecting. Connections carrying a request are left to
+    # the request's own timeout
+    def prune(self):
+        for conn in list(self._connections.values()):
+            if conn.request is not None:
+                continue
+            if conn.state == CLOSED or conn.is_expired():
+                self.discard(conn)
+
+    # Reopen connections dropped since the last call, so the
+    # next press finds a warm connection waiting
+    def refill(self):
+        while self._dropped > 0:
+            self._dropped -= 1
+            if self.open() >= self.size:
+                continue
+
+            try:
+                self._connect()
+            except OSError as e:
+                print('Failed to reconnect: ' + str(e))
+                self._dropped += 1
+                return
+
+    def close(self):
+        for conn in self._connections.values():
+            conn.close()
+        self._connections = {}
@@ -1,6 +1,14 @@
+import asyncio
+import heapq
 import select
-import socket
-from .request import Request
+from .. import clock
+from ..metrics import latency
+from .connection import Connection, CLOSED, SENT, DONE, FAILED
+from .encoder import RequestEncoder
+from .pool import ConnectionPool
+from .request import Request, PRIORITY_LOW
+from .retry import RetryPolicy
+from .transport import Transport
 
 
 # Polls multiple sockets in parallel, allowing sending
@@ -8,84 +16,485 @@ from .request import Request
 # the event loop
 class RequestQueue:
 
-    socket_connect_s = 2
+    # How long the run loop yields between polls while
+    # requests are in flight
+    poll_interval_ms = 5
 
-    @staticmethod
-    def new_socket(host: str) -> socket.Socket:
-        sock = socket.socket()
-        sock.settimeout(RequestQueue.socket_connect_s)
-        sock.connect(host)
-        return sock
+    # How often idle pooled connections are checked, and
+    # dropped ones reopened, while no requests are in flight
+    idle_check_s = 1
 
-    def __init__(self, capacity: int, host: str):
+    def __init__(
+        self,
+        capacity: int,
+        host: str,
+        connections: int = 2,
+        retry: RetryPolicy | None = None,
+        backlog: int = 128,
+    ):
         self.host = host
 
         # Create a new poller, which can be used to poll
         # multiple sockets in parallel
         self.poller = select.poll()
 
-        # Set up a list of requests for the queue
-        self._requests: list[Request] = []
+        # Persistent connections shared by all requests
+        self.pool = ConnectionPool(host, connections, self.poller)
+
+        # Renders requests into each connection's buffer
+        self.encoder = RequestEncoder(self.pool.host)
+
+        # Requests in flight, indexed by the poll key of the
+        # connection carrying them. Capacity bounds requests in
+        # flight over connections, with a transport keeping its own
+        # window, and backlog those waiting to be sent or retried.
+        # Both are fixed, but a storm of presses can wait behind
+        # the slots rather than being turned away
+        self._requests: dict[object, Request] = {}
         self.capacity = capacity
+        self.backlog = backlog
 
-    def request_by_socket(self, sock: socket.Socket) -> Request | None:
-        for req in self._requests:
-            if req.socket == sock:
-                return req
+        # Min-heap of (deadline, seq, request) for requests in
+        # flight. Entries for finished requests are left in place
+        # and skipped once they surface, or compacted away.
+        # Deadlines are stored in ms since _epoch, which is moved
+        # forward whenever the heap empties, so wrapping tick
+        # values still order correctly
+        self._deadlines: list[tuple] = []
+        self._epoch = clock.ticks_ms()
+        self._seq = 0
 
-        return None
+        # Requests added from input handlers, waiting to be
+        # sent by the run loop. One backlog per priority
+        self._pending: list[list[Request]] = [[]
+                                              for _ in range(PRIORITY_LOW + 1)]
+
+        # Set by add(), which runs from IRQ and timer callbacks,
+        # where only a ThreadSafeFlag may be set
+        self._wake = asyncio.ThreadSafeFlag()
+
+        # Failed requests waiting out their backoff before being
+        # sent again
+        self.retry = retry if retry is not None else RetryPolicy()
+        self._retrying: list[Request] = []
+
+        # The board is told when the backlog fills past the high
+        # watermark, and again once it drains below the low one
+        self.high_watermark = max(1, (backlog * 3) // 4)
+        self.low_watermark = backlog // 4
+        self.backpressure = False
+        self.on_backpressure = lambda active: None
+        self.evicted = 0
+
+        # Where each request's time goes, from press to response
+        self.latency = latency.stats
+
+        # Hands a request straight to a local consumer, in place of
+        # sending it. Returns False if nobody took it. Consumers
+        # which take one report back through push_done()
+        self.push = lambda req: False
+        self.pushed = 0
+
+        # Offered each request before it's given a connection,
+        # once set with use_transport()
+        self.transport: Transport | None = None
+
+    def use_transport(self, transport: Transport):
+        self.transport = transport
+        transport.on_done = self._transport_done
+        transport.open(self.poller)
 
-    # Adds a request to the queue, and send it
-    def add(self, req: Request):
-        if len(self._requests) >= self.capacity:
-            print("Request queue at capacity")
+    # Number of requests waiting to be sent, including those
+    # waiting to be retried
+    def pending(self) -> int:
+        return self._backlog() + len(self._retrying)
+
+    def _backlog(self) -> int:
+        return sum(len(backlog) for backlog in self._pending)
+
+    # Number of requests on their way, over connections or the
+    # transport
+    def _in_flight(self) -> int:
+        if self.transport is None:
+            return len(self._requests)
+        return len(self._requests) + self.transport.in_flight()
+
+    # Whether another request can be added without turning it
+    # or another request away
+    def has_room(self) -> bool:
+        return self.pending() < self.backlog
+
+    # Adds a request to the queue. It is sent from the run
+    # loop, so this is safe to call from input handlers.
+    # Returns False if the request was turned away
+    def add(self, req: Request) -> bool:
+        if self.push(req):
+            req.queued_ms = clock.ticks_ms()
+            self.latency.record(latency.QUEUED, req.pressed_ms, req.queued_ms)
+            return True
+
+        if not self.has_room():
+            # Make room by giving up the oldest request which
+            # matters less than this one, if there is one
+            victim = self._evict(req.priority)
+            if victim is None:
+                print("Request queue backlog full")
+                req.failed()
+                self._update_backpressure()
+                return False
+
+            print("Request queue backlog full, dropped a lower "
+                  "priority request")
+            self.evicted += 1
+            victim.failed()
+
+        req.queued_ms = clock.ticks_ms()
+        self.latency.record(latency.QUEUED, req.pressed_ms, req.queued_ms)
+
+        self._pending[req.priority].append(req)
+        self._update_backpressure()
+        self._wake.set()
+        return True
+
+    # A local consumer finished with a request push handed it.
+    # Requests written to the consumer are done, and the rest go
+    # to the webhook after all
+    def push_done(self, req: Request, ok: bool):
+        if not ok:
+            self._pending[req.priority].insert(0, req)
+            self._update_backpressure()
+            self._wake.set()
             return
 
-        self._requests.append(req)
-        req.socket = RequestQueue.new_socket(self.host)
+        req.sent_ms = clock.ticks_ms()
+        self.latency.record(latency.TOTAL, req.pressed_ms, req.sent_ms)
 
-        self.poller.register(req.socket, select.POLLIN)
-        req.send(req.socket)
+        self.pushed += 1
+        req.succeeded()
 
-    # Trigger timeouts
-    def prune_queue(self):
-        to_prune = []
+    def _evict(self, priority: int) -> Request | None:
+        for p in range(PRIORITY_LOW, priority, -1):
+            if len(self._pending[p]) > 0:
+                return self._pending[p].pop(0)
+
+        return None
+
+    def _next(self) -> Request | None:
+        for backlog in self._pending:
+            if len(backlog) > 0:
+                return backlog[0]
+
+        return None
+
+    def _update_backpressure(self):
+        waiting = self.pending()
+
+        if not self.backpressure and waiting >= self.high_watermark:
+            self.backpressure = True
+            self.on_backpressure(True)
+        elif self.backpressure and waiting <= self.low_watermark:
+            self.backpressure = False
+            self.on_backpressure(False)
+
+    # Swap a request which hasn't been sent yet for another.
+    # Returns False if the request is already on its way
+    def replace(self, old: Request, new: Request) -> bool:
+        backlog = self._pending[old.priority]
+        for i in range(len(backlog)):
+            if backlog[i] is old:
+                # The replacement has waited as long as the first
+                # press it carries
+                new.pressed_ms = old.pressed_ms
+                new.queued_ms = old.queued_ms
+
+                if new.priority == old.priority:
+                    backlog[i] = new
+                else:
+                    backlog.pop(i)
+                    self._pending[new.priority].append(new)
+                return True
+
+        return False
+
+    # Hand pending requests to connections, as long as there
+    # are connections available to carry them
+    def flush(self):
+        self._promote_retries()
+
+        while True:
+            req = self._next()
+            if req is None:
+                return
+
+            if self.transport is not None and self.transport.takes(req):
+                if self.transport.busy():
+                    # Wait for the transport, rather than sending
+                    # presses out of order over the webhook
+                    return
+                if self.transport.send(req):
+                    self._pending[req.priority].pop(0)
+                    self._sent(req)
+                    self._update_backpressure()
+                    continue
+
+            if len(self._requests) >= self.capacity:
+                return
+
+            try:
+                conn = self.pool.acquire()
+            except OSError as e:
+                print("Failed to connect: " + str(e))
+                self._pending[req.priority].pop(0)
+                self._fail(req)
+                continue
+
+            if conn is None:
+                # Every connection is busy, try again once a
+                # response frees one up
+                return
+
+            self._pending[req.priority].pop(0)
+            self._dispatch(req, conn)
+
+    def _dispatch(self, req: Request, conn: Connection):
+        req.connection = conn
+        req.reused = conn.reused
+        req.started()
+        self._requests[conn.key] = req
+        self._track_deadline(req)
+
+        self._handle(conn,
+                     conn.start(req, self.encoder.encode(req, conn.buffer)))
+
+    # React to a connection reaching a new outcome
+    def _handle(self, conn: Connection, outcome: str | None):
+        if outcome == SENT:
+            self._sent(conn.request)
 
-        for req in self._requests:
-            if req.is_expired():
-                to_prune.append(req)
+        elif outcome == DONE:
+            req = self._detach(conn)
+            if conn.state == CLOSED:
+                self.pool.discard(conn)
+            if req is not None:
+                self._answered(req)
 
-        for req in to_prune:
-            self._requests.remove(req)
+            # A connection just freed up
+            self.flush()
+
+        elif outcome == FAILED:
+            req = self._detach(conn)
+            self.pool.discard(conn)
+            if req is None:
+                return
+
+            if req.reused:
+                # The pooled connection was closed by the server
+                # since it was last checked, so try a fresh one
+                req.reused = False
+                self._pending[req.priority].insert(0, req)
+                self.flush()
+            else:
+                self._fail(req)
+
+    def _sent(self, req: Request):
+        req.sent_ms = clock.ticks_ms()
+        self.latency.record(latency.SENT, req.queued_ms, req.sent_ms)
+
+    def _answered(self, req: Request):
+        now = clock.ticks_ms()
+        self.latency.record(latency.ANSWERED, req.sent_ms, now)
+
+        if req.is_success():
+            self.latency.record(latency.TOTAL, req.pressed_ms, now)
+            req.succeeded()
+        else:
+            self._fail(req, req.status_code)
+
+    # The transport finished with a request, delivered or not
+    def _transport_done(self, req: Request, ok: bool):
+        self._update_backpressure()
+        if ok:
+            self._answered(req)
+        else:
+            self._fail(req)
+
+        # The transport has room for another
+        self.flush()
+
+    # Schedule a retry for a failed request, or give up on it
+    def _fail(self, req: Request, status: int = 0):
+        delay_ms = self.retry.next_retry(req, status)
+        if delay_ms is None:
             req.failed()
+            return
 
-    # Poll any active sockets for data
-    def poll(self):
-        events = self.poller.poll(500)
+        print("Retrying " + req.path + " in " + str(delay_ms) + "ms")
+        req.retry_at = clock.ticks_add(clock.ticks_ms(), delay_ms)
+        self._retrying.append(req)
 
-        if len(events) == 0:
-            # Nothing to process, use this time to clean up!
-            self.prune_queue()
+    # Move retries whose backoff has elapsed back into the
+    # backlog, ahead of requests which haven't been tried yet
+    def _promote_retries(self):
+        if len(self._retrying) == 0:
             return
 
+        now = clock.ticks_ms()
+        for req in list(self._retrying):
+            if clock.ticks_diff(now, req.retry_at) >= 0:
+                self._retrying.remove(req)
+                req.retry_at = None
+                self._pending[req.priority].insert(0, req)
+
+    # Milliseconds until the nearest retry is due, or None
+    def _next_retry_ms(self) -> int | None:
+        now = clock.ticks_ms()
+        nearest = None
+        for req in self._retrying:
+            remaining = max(0, clock.ticks_diff(req.retry_at, now))
+            if nearest is None or remaining < nearest:
+                nearest = remaining
+        return nearest
+
+    def _detach(self, conn: Connection) -> Request | None:
+        req = conn.finish()
+        if req is not None:
+            req.connection = None
+            del self._requests[conn.key]
+            self._update_backpressure()
+        return req
+
+    def _track_deadline(self, req: Request):
+        if len(self._deadlines) == 0:
+            self._epoch = clock.ticks_ms()
+
+        self._seq += 1
+        req.seq = self._seq
+        heapq.heappush(
+            self._deadlines,
+            (clock.ticks_diff(req.expiry, self._epoch), req.seq, req),
+        )
+
+        # Requests which finish early leave their entries behind,
+        # so rebuild the heap before it outgrows the queue
+        if len(self._deadlines) > 2 * self.capacity:
+            self._deadlines = [
+                entry for entry in self._deadlines
+                if RequestQueue._is_live(entry)
+            ]
+            heapq.heapify(self._deadlines)
+
+    # Whether a deadline entry still belongs to a request in
+    # flight, rather than an earlier attempt or a finished one
+    @staticmethod
+    def _is_live(entry: tuple) -> bool:
+        req = entry[2]
+        return req.connection is not None and req.seq == entry[1]
+
+    # Trigger timeouts, popping expired requests off the
+    # deadline heap
+    def prune_queue(self):
+        now = clock.ticks_ms()
+
+        while len(self._deadlines) > 0:
+            entry = self._deadlines[0]
+            if not RequestQueue._is_live(entry):
+                heapq.heappop(self._deadlines)
+                continue
+
+            req = entry[2]
+            if not req.is_expired(now):
+                break
+
+            heapq.heappop(self._deadlines)
+            conn = req.connection
+            self._detach(conn)
+            self.pool.discard(conn)
+            self._fail(req)
+
+    # Milliseconds until the nearest request deadline, or None
+    # if nothing is in flight
+    def next_deadline_ms(self) -> int | None:
+        while len(self._deadlines) > 0:
+            entry = self._deadlines[0]
+            if RequestQueue._is_live(entry):
+                remaining = clock.ticks_diff(entry[2].expiry, clock.ticks_ms())
+                return max(0, remaining)
+
+            heapq.heappop(self._deadlines)
+
+        return None
+
+    # Poll any active sockets, waiting at most timeout_ms for
+    # one to become ready, but never past the nearest deadline
+    def poll(self, timeout_ms: int = 0):
+        deadline_ms = self.next_deadline_ms()
+        if deadline_ms is not None and deadline_ms < timeout_ms:
+            timeout_ms = deadline_ms
+
+        events = self.poller.poll(timeout_ms)
+
         # Handle results from polling
-        for sock, event in events:
-            if event & select.POLLIN:
-                self.poller.unregister(sock)
-
-                req = self.request_by_socket(sock)
-                if req is None:
-                    print(
-                        "socket in queue has data, but could not tie it to a request"
-                    )
-                    sock.close()
-                    return
+        for key, event in events:
+            self._on_event(key, event)
+
+        # Expire requests even while other sockets are busy
+        self.prune_queue()
+        if self.transport is not None:
+            self.transport.service()
+
+    # Dispatch a single poll event to its connection
+    def _on_event(self, key, event: int):
+        if self.transport is not None and self.transport.on_event(key, event):
+            return
+
+        conn = self.pool.by_key(key)
+        if conn is None:
+            print("socket in queue is ready, but could not tie it "
+                  "to a connection")
+            self.poller.unregister(key)
+            return
+
+        self._handle(conn, conn.on_event(event))
+
+    # How long the run loop can sleep before it next has work
+    def _next_wait_ms(self) -> int:
+        if self._in_flight() > 0 or self._backlog() > 0:
+            wait_ms = RequestQueue.poll_interval_ms
+        else:
+            wait_ms = RequestQueue.idle_check_s * 1000
+
+        transport_ms = None
+        if self.transport is not None:
+            transport_ms = self.transport.next_due_ms()
+
+        for due_ms in (self.next_deadline_ms(), self._next_retry_ms(),
+                       transport_ms):
+            if due_ms is not None and due_ms < wait_ms:
+                wait_ms = due_ms
+
+        return wait_ms
+
+    # Long-lived task which sends queued requests and services
+    # their sockets without ever blocking the event loop
+    async def run(self):
+        while True:
+            # Clear before flushing, so a request added from here
+            # on still wakes the wait below
+            self._wake.clear()
+
+            self.flush()
+            self.poll(0)
 
-                self._handle_response(req)
+            wait_ms = self._next_wait_ms()
+            if self._in_flight() > 0 or self._backlog() > 0:
+                await asyncio.sleep(wait_ms / 1000)
+                continue
 
-    # Handle data from polling
-    def _handle_response(self, req: Request):
-        req.recv()
-        req.close()
-        req.handle_response()
-        self._requests.remove(req)
+            # Nothing in flight, so sleep until a request is added
+            # or a retry is due
+            try:
+                await asyncio.wait_for(self._wake.wait(), wait_ms / 1000)
+            except asyncio.TimeoutError:
+                # Look after the idle connections while waiting
+                self.pool.prune()
+                self.pool.refill()
@@ -1,83 +1,112 @@
-import time
-import socket
+import random
+
+from .. import clock
+from ..metrics import latency
+
+# Request priorities, most urgent first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
 
 
 # Handlers for a single HTTP request
 class Request:
 
-    request_timeout_s = 5
+    request_timeout_ms = 5000
+
+    # Idempotency keys pair a random boot id with a sequence
+    # number, so a receiver can tell a retry from a new press
+    boot_id = random.getrandbits(32)
+    _next_id = 0
 
     @staticmethod
-    def parse_response(response: str) -> str:
-        ind = response.find("\r")
-        if ind < 0:
-            return response
-        return response[0:ind]
+    def new_id() -> int:
+        Request._next_id = (Request._next_id + 1) & 0xffffffff
+        return Request._next_id
 
     def __init__(
         self,
         path: str,
         body: str = '',
+        priority: int = PRIORITY_NORMAL,
+        keys: list[str] | None = None,
     ):
         self.path = path
         self.body = body
-        self.socket: socket.Socket | None = None
-        self.bytes_received: bytes = bytes([])
+        self.priority = priority
+
+        # Keys carried by a press. Press bodies are rendered by
+        # the queue's encoder, in place of body
+        self.keys = keys
+
+        # Sent with every attempt at the request. Presses replayed
+        # from the journal keep the boot and id they were made with
+        self.boot = Request.boot_id
+        self.id = Request.new_id()
+        # Status code of the response, or 0 if there wasn't one
+        self.status_code = 0
+
+        # The connection carrying the request, once one is
+        # available. Set and cleared by the queue
+        self.connection = None
 
+        # Whether the request was sent on a pooled connection
+        # which had already served another request
+        self.reused = False
+
+        # Tick after which the current attempt times out
         self.expiry = None
 
+        # Number of attempts started, and the tick before which
+        # the next one shouldn't start
+        self.attempts = 0
+        self.retry_at = None
+
+        # Identifies the current attempt in the queue's
+        # deadline heap
+        self.seq = 0
+
+        # Ticks at which the press was made, added to the queue,
+        # and last written to a socket, used to report latency
+        self.created_ms = clock.ticks_ms()
+        self.pressed_ms = latency.stats.pressed_ms(self.created_ms)
+        self.queued_ms = self.created_ms
+        self.sent_ms = self.created_ms
+
         self.on_success = lambda: None
         self.on_failure = lambda: None
 
-    # Send a request into the provided socket!
-    def send(self, socket: socket.Socket):
-        self.socket = socket
-        self.expiry = time.time() + Request.request_timeout_s
-        self.bytes_received = bytes([])
+    # Start the timeout for a new attempt at the request
+    def started(self):
+        self.attempts += 1
+        self.expiry = clock.ticks_add(clock.ticks_ms(),
+                                      Request.request_timeout_ms)
+        self.status_code = 0
 
-        print('Sending: ' + self.path)
-        raw = b'POST /api/webhook/' + self.path.encode('utf-8')
-        raw += b' HTTP/1.1\r\n\r\n'
-        raw += self.body.encode('utf-8')
-        self.socket.send(raw)
+    # The idempotency key, as sent to the receiver
+    def id_text(self) -> str:
+        return '%08x-%08x' % (self.boot, self.id)
 
     # Check for timeout
-    def is_expired(self):
-        if self.expiry is not None:
-            return time.time() > self.expiry
-
-        return False
+    def is_expired(self, now: int | None = None):
+        if self.expiry is None:
+            return False
 
-    # Receive data from the socket
-    def recv(self):
-        if self.socket is not None:
-            self.bytes_received = self.socket.recv(1000)
+        if now is None:
+            now = clock.ticks_ms()
+        return clock.ticks_diff(now, self.expiry) > 0
 
-    # Handle the response
-    def handle_response(self):
-        if self.bytes_received.startswith(b'HTTP/1.1 200'):
-            self.succeeded()
-        else:
-            self.failed()
+    def is_success(self) -> bool:
+        return 200 <= self.status_code and self.status_code < 300
 
-    # Called on HTTP 200
+    # Called on HTTP 2xx
     # Calls the on_success hook, if one is set
     def succeeded(self):
-        resp = Request.parse_response(str(self.bytes_received))
-        print('Request succeeded: ' + resp)
+        print('Request succeeded: ' + str(self.status_code))
         self.on_success()
-        self.close()
 
-    # Called on HTTP 4xx/5xx
+    # Called on HTTP 4xx/5xx, or once retries run out
     # Calls the on_failure hook, if one is set
     def failed(self):
-        err = Request.parse_response(str(self.bytes_received))
-        print('Request failed: ' + err)
+        print('Request failed: ' + str(self.status_code))
         self.on_failure()
-        self.close()
-
-    # Close the socket
-    def close(self):
-        if self.socket is not None:
-            self.socket.close()
-            self.socket = None
@@ -0,0 +1,216 @@
+# Parser states
+_STATUS = 'status'
+_HEADERS = 'headers'
+_BODY = 'body'
+_CHUNK_SIZE = 'chunk-size'
+_CHUNK_DATA = 'chunk-data'
+_CHUNK_END = 'chunk-end'
+_TRAILERS = 'trailers'
+_UNTIL_CLOSE = 'until-close'
+_DONE = 'done'
+
+_CR = 0x0d
+_LF = 0x0a
+
+
+# Whether a header line starts with the given lowercase name,
+# followed by a colon, without allocating
+def _is_header(line, length: int, name: bytes) -> bool:
+    n = len(name)
+    if length <= n or line[n] != 0x3a:
+        return False
+
+    for i in range(n):
+        if line[i] | 0x20 != name[i]:
+            return False
+
+    return True
+
+
+# Whether a header's value contains the given lowercase token
+def _value_has(line, start: int, length: int, token: bytes) -> bool:
+    n = len(token)
+    for i in range(start, length - n + 1):
+        match = True
+        for j in range(n):
+            if line[i + j] | 0x20 != token[j]:
+                match = False
+                break
+        if match:
+            return True
+
+    return False
+
+
+def _parse_int(line, start: int, length: int, base: int) -> int:
+    value = -1
+    for i in range(start, length):
+        c = line[i]
+        if 0x30 <= c and c <= 0x39:
+            digit = c - 0x30
+        elif base == 16 and 0x61 <= c | 0x20 and c | 0x20 <= 0x66:
+            digit = (c | 0x20) - 0x61 + 10
+        elif value < 0 and (c == 0x20 or c == 0x09):
+            continue
+        else:
+            break
+
+        value = digit if value < 0 else value * base + digit
+
+    return value
+
+
+# Incrementally parses an HTTP/1.1 response as its bytes arrive,
+# in however many pieces. Status and header lines are gathered
+# into a reusable buffer, and body bytes are counted and skipped
+# rather than stored, so memory use doesn't grow with the
+# response. Handles Content-Length, chunked, and read-until-close
+# bodies, and tracks whether the connection can be kept alive
+class ResponseParser:
+
+    max_line = 256
+
+    def __init__(self):
+        self._line = bytearray(ResponseParser.max_line)
+        self.reset()
+
+    def reset(self):
+        self.state = _STATUS
+        self.status = 0
+        self.keep_alive = True
+        self.error = False
+
+        # Total bytes fed in, across every piece
+        self.received = 0
+
+        self._line_len = 0
+        self._length = -1
+        self._chunked = False
+        self._remaining = 0
+
+    @property
+    def done(self) -> bool:
+        return self.state == _DONE
+
+    # Consume bytes from data, returning how many were used.
+    # Parsing stops at the end of the response, so anything left
+    # over belongs to whatever comes after it
+    def feed(self, data, n: int = -1) -> int:
+        if n < 0:
+            n = len(data)
+
+        i = 0
+        while i < n and self.state != _DONE:
+            state = self.state
+
+            if state == _BODY or state == _CHUNK_DATA:
+                take = min(self._remaining, n - i)
+                self._remaining -= take
+                i += take
+                if self._remaining == 0:
+                    self.state = _DONE if state == _BODY else _CHUNK_END
+
+            elif state == _UNTIL_CLOSE:
+                i = n
+
+            else:
+                c = data[i]
+                i += 1
+
+                if c == _LF:
+                    self._on_line()
+                    self._line_len = 0
+                elif c != _CR:
+                    if self._line_len >= ResponseParser.max_line:
+                        self._fail()
+                    else:
+                        self._line[self._line_len] = c
+                        self._line_len += 1
+
+        self.received += i
+        return i
+
+    # The server closed the connection. Returns whether the
+    # response was complete
+    def finish(self) -> bool:
+        if self.state == _UNTIL_CLOSE:
+            self.state = _DONE
+        self.keep_alive = False
+        return self.state == _DONE and not self.error
+
+    def _fail(self):
+        self.error = True
+        self.keep_alive = False
+        self.state = _DONE
+
+    def _on_line(self):
+        line = self._line
+        length = self._line_len
+
+        if self.state == _STATUS:
+            # HTTP/1.x NNN Reason
+            if length < 12 or line[0:7] != b'HTTP/1.':
+                self._fail()
+                return
+
+            # HTTP/1.0 closes by default
+            if line[7] == 0x30:
+                self.keep_alive = False
+
+            self.status = _parse_int(line, 9, 12, 10)
+            if self.status < 100:
+                self._fail()
+                return
+
+            self.state = _HEADERS
+
+        elif self.state == _HEADERS:
+            if length == 0:
+                self._end_headers()
+            elif _is_header(line, length, b'content-length'):
+                self._length = _parse_int(line, 15, length, 10)
+            elif _is_header(line, length, b'transfer-encoding'):
+                self._chunked = _value_has(line, 18, length, b'chunked')
+            elif _is_header(line, length, b'connection'):
+                if _value_has(line, 11, length, b'close'):
+                    self.keep_alive = False
+                elif _value_has(line, 11, length, b'keep-alive'):
+                    self.keep_alive = True
+
+        elif self.state == _CHUNK_SIZE:
+            size = _parse_int(line, 0, length, 16)
+            if size < 0:
+                self._fail()
+            elif size == 0:
+                self.state = _TRAILERS
+            else:
+                self._remaining = size
+                self.state = _CHUNK_DATA
+
+        elif self.state == _CHUNK_END:
+            self.state = _CHUNK_SIZE
+
+        elif self.state == _TRAILERS:
+            if length == 0:
+                self.state = _DONE
+
+    def _end_headers(self):
+        # Informational responses are followed by the real one
+        if 100 <= self.status and self.status < 200:
+            self.state = _STATUS
+            return
+
+        if self.status == 204 or self.status == 304:
+            self.state = _DONE
+        elif self._chunked:
+            self.state = _CHUNK_SIZE
+        elif self._length == 0:
+            self.state = _DONE
+        elif self._length > 0:
+            self._remaining = self._length
+            self.state = _BODY
+        else:
+            # No framing, so the body runs until the server
+            # closes the connection
+            self.keep_alive = False
+            self.state = _UNTIL_CLOSE
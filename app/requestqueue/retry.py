@@ -0,0 +1,87 @@
+import random
+
+from .. import clock
+from .request import Request
+
+
+# Decides whether, and when, a failed request is tried again.
+# Delays grow exponentially with jitter, and every retry spends
+# a token from a slowly refilling budget, so an outage can't
+# turn every press into a retry storm
+class RetryPolicy:
+
+    max_attempts = 4
+    base_delay_ms = 250
+    max_delay_ms = 4000
+
+    budget = 6
+    budget_refill_ms = 5000
+
+    # Responses worth trying again. Anything else is final
+    @staticmethod
+    def is_retryable(status: int) -> bool:
+        return status == 0 or status == 408 or status == 429 or status >= 500
+
+    def __init__(
+        self,
+        max_attempts: int = max_attempts,
+        base_delay_ms: int = base_delay_ms,
+        max_delay_ms: int = max_delay_ms,
+        budget: int = budget,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay_ms = base_delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.budget = budget
+
+        self._tokens = budget
+        self._refilled = clock.ticks_ms()
+
+        # Number of retries refused for lack of budget
+        self.exhausted = 0
+
+    # Delay before the given attempt: half the exponential
+    # delay, plus up to the same again at random
+    def delay_ms(self, attempt: int) -> int:
+        delay = self.base_delay_ms << (attempt - 1)
+        if delay > self.max_delay_ms:
+            delay = self.max_delay_ms
+
+        half = delay // 2
+        return half + random.randint(0, half)
+
+    def _refill(self):
+        now = clock.ticks_ms()
+        elapsed = clock.ticks_diff(now, self._refilled)
+
+        # Long enough to fill the bucket, or so long that the
+        # tick counter wrapped
+        if elapsed < 0 or elapsed >= self.budget * self.budget_refill_ms:
+            self._tokens = self.budget
+            self._refilled = now
+            return
+
+        earned = elapsed // self.budget_refill_ms
+        if earned == 0:
+            return
+
+        self._tokens = min(self.budget, self._tokens + earned)
+        self._refilled = clock.ticks_add(self._refilled,
+                                         earned * self.budget_refill_ms)
+
+    # Returns the delay before the request should be retried,
+    # or None if it should fail now
+    def next_retry(self, req: Request, status: int = 0) -> int | None:
+        if req.attempts >= self.max_attempts:
+            return None
+
+        if not RetryPolicy.is_retryable(status):
+            return None
+
+        self._refill()
+        if self._tokens <= 0:
+            self.exhausted += 1
+            return None
+
+        self._tokens -= 1
+        return self.delay_ms(req.attempts)
@@ -0,0 +1,54 @@
+from .request import Request
+
+
+# Carries requests to the hub some other way than the webhook.
+# The queue offers each request to its transport before giving
+# it a connection, and services the transport from its run loop.
+# A transport keeps its own window of requests in flight, apart
+# from the queue's connection capacity.
+# Requests the transport takes are finished through on_done
+class Transport:
+
+    def __init__(self):
+        # Called with a request taken by the transport, and
+        # whether it was delivered
+        self.on_done = lambda req, ok: None
+
+    # Set up sockets, registering them with the queue's poller
+    def open(self, poller):
+        pass
+
+    # Whether the transport carries this kind of request, rather
+    # than leaving it to the webhook
+    def takes(self, req: Request) -> bool:
+        return False
+
+    # Take a request to deliver. Returns False to leave it to
+    # the webhook
+    def send(self, req: Request) -> bool:
+        return False
+
+    # Whether the transport can't take more requests until some
+    # of those in flight finish. Only asked about requests it takes
+    def busy(self) -> bool:
+        return False
+
+    # Handle a poll event. Returns False if the polled object
+    # isn't the transport's
+    def on_event(self, key, event: int) -> bool:
+        return False
+
+    # Retry or give up on requests which are overdue
+    def service(self):
+        pass
+
+    # Number of requests taken but not yet finished
+    def in_flight(self) -> int:
+        return 0
+
+    # Milliseconds until service() next has work, or None
+    def next_due_ms(self) -> int | None:
+        return None
+
+    def close(self):
+        pass
@@ -0,0 +1,226 @@
+import errno
+import select
+import socket
+import struct
+
+from .. import clock
+from .connection import parse_host, poll_key
+from .request import Request
+from .transport import Transport
+
+MAGIC = b'PS'
+VERSION = 1
+
+# Frame types
+PRESS = 1
+ACK = 2
+
+# Press frames carry the magic, version and type, then the device
+# id, layout and key, NUL padded, then the boot id and sequence
+# number which make up the idempotency key, and the tick the press
+# was made at. Acks echo the device id, boot id and sequence number
+PRESS_FORMAT = '!2sBB8s8s16sIII'
+ACK_FORMAT = '!2sBB8sII'
+PRESS_SIZE = struct.calcsize(PRESS_FORMAT)
+ACK_SIZE = struct.calcsize(ACK_FORMAT)
+
+
+def encode_press(device: bytes, layout: bytes, key: bytes, boot: int, seq: int,
+                 pressed_ms: int) -> bytes:
+    return struct.pack(PRESS_FORMAT, MAGIC, VERSION, PRESS, device, layout,
+                       key, boot, seq, pressed_ms & 0xffffffff)
+
+
+# Returns (device, layout, key, boot, seq, pressed_ms), or None if
+# the frame isn't a press
+def decode_press(frame: bytes) -> tuple | None:
+    if len(frame) != PRESS_SIZE:
+        return None
+
+    magic, version, kind, device, layout, key, boot, seq, pressed_ms = \
+        struct.unpack(PRESS_FORMAT, frame)
+    if magic != MAGIC or version != VERSION or kind != PRESS:
+        return None
+
+    return (device, layout.rstrip(b'\x00'), key.rstrip(b'\x00'), boot, seq,
+            pressed_ms)
+
+
+def encode_ack(device: bytes, boot: int, seq: int) -> bytes:
+    return struct.pack(ACK_FORMAT, MAGIC, VERSION, ACK, device, boot, seq)
+
+
+# Returns (device, boot, seq), or None if the frame isn't an ack
+def decode_ack(frame: bytes) -> tuple | None:
+    if len(frame) != ACK_SIZE:
+        return None
+
+    magic, version, kind, device, boot, seq = struct.unpack(ACK_FORMAT, frame)
+    if magic != MAGIC or version != VERSION or kind != ACK:
+        return None
+
+    return (device, boot, seq)
+
+
+# Sends single-key presses to a bridge as one small datagram each,
+# resending every retransmit_ms until the bridge acks, and giving
+# up after max_transmits. Batched presses, and keys too long for
+# the frame, are left to the webhook
+class UdpTransport(Transport):
+
+    default_port = 5555
+
+    retransmit_ms = 200
+    max_transmits = 5
+
+    # Presses in flight at once
+    window = 8
+
+    # Larger than any ack, so longer datagrams aren't mistaken
+    # for one once truncated
+    recv_size = 64
+
+    def __init__(self, host: str, device: bytes, layout: str):
+        super().__init__()
+
+        self.host, self.port = parse_host(host, UdpTransport.default_port)
+        self.device = device
+        self.layout = layout.encode('utf-8')
+
+        self.socket = None
+        self.key = None
+        self.poller = None
+        self._address = None
+
+        # [request, frame, transmits, tick the next is due] by boot
+        # id and sequence number, as replayed presses keep the boot
+        # they were made in
+        self._in_flight: dict[tuple, list] = {}
+
+        self.retransmits = 0
+
+    # The socket is opened on first use, as the bridge's name may
+    # not resolve until WiFi is up
+    def open(self, poller):
+        self.poller = poller
+
+    # Open the socket if it isn't already. Returns False if the
+    # bridge can't be reached yet
+    def _open(self) -> bool:
+        if self.socket is not None:
+            return True
+
+        sock = None
+        try:
+            if self._address is None:
+                self._address = socket.getaddrinfo(self.host, self.port)[0][-1]
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            sock.connect(self._address)
+        except OSError as e:
+            print('Failed to reach UDP bridge: ' + str(e))
+            if sock is not None:
+                sock.close()
+            return False
+
+        self.socket = sock
+        self.key = poll_key(sock)
+        self.poller.register(sock, select.POLLIN)
+        return True
+
+    def takes(self, req: Request) -> bool:
+        return (req.keys is not None and len(req.keys) == 1
+                and len(req.keys[0].encode('utf-8')) <= 16)
+
+    def send(self, req: Request) -> bool:
+        if not self.takes(req):
+            return False
+
+        req.started()
+        frame = encode_press(self.device, self.layout,
+                             req.keys[0].encode('utf-8'), req.boot, req.id,
+                             req.pressed_ms)
+        entry = [req, frame, 0, 0]
+        self._in_flight[(req.boot, req.id)] = entry
+        self._transmit(entry)
+        return True
+
+    def busy(self) -> bool:
+        return len(self._in_flight) >= UdpTransport.window
+
+    def _transmit(self, entry: list):
+        entry[2] += 1
+        entry[3] = clock.ticks_add(clock.ticks_ms(),
+                                   UdpTransport.retransmit_ms)
+
+        # Lost frames are resent, so failures to send are too
+        if not self._open():
+            return
+
+        try:
+            self.socket.send(entry[1])
+        except OSError as e:
+            print('UDP send failed: ' + str(e))
+
+    def on_event(self, key, event: int) -> bool:
+        if self.socket is None or key != self.key:
+            return False
+
+        while True:
+            try:
+                frame = self.socket.recv(UdpTransport.recv_size)
+            except OSError as e:
+                if e.args[0] != errno.EAGAIN:
+                    print('UDP receive failed: ' + str(e))
+                return True
+
+            if not frame:
+                return True
+
+            ack = decode_ack(frame)
+            if ack is None:
+                continue
+
+            device, boot, seq = ack
+            if device != self.device:
+                continue
+
+            entry = self._in_flight.pop((boot, seq), None)
+            if entry is not None:
+                req = entry[0]
+                req.status_code = 200
+                self.on_done(req, True)
+
+    def service(self):
+        now = clock.ticks_ms()
+        for entry in list(self._in_flight.values()):
+            if clock.ticks_diff(now, entry[3]) < 0:
+                continue
+
+            if entry[2] >= UdpTransport.max_transmits:
+                del self._in_flight[(entry[0].boot, entry[0].id)]
+                self.on_done(entry[0], False)
+                continue
+
+            self.retransmits += 1
+            self._transmit(entry)
+
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def next_due_ms(self) -> int | None:
+        now = clock.ticks_ms()
+        nearest = None
+        for entry in self._in_flight.values():
+            remaining = max(0, clock.ticks_diff(entry[3], now))
+            if nearest is None or remaining < nearest:
+                nearest = remaining
+        return nearest
+
+    def close(self):
+        if self.socket is None:
+            return
+
+        self.poller.unregister(self.socket)
+        self.socket.close()
+        self.socket = None
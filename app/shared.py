@@ -1,17 +1,23 @@
 import asyncio
-import json
+import machine
 
 from .requestqueue.queue import RequestQueue
-from .requestqueue.request import Request
+from .requestqueue.request import Request, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from .requestqueue.batcher import PressBatcher
+from .requestqueue.encoder import RequestEncoder
+from .requestqueue.journal import PressJournal
+from .requestqueue.udp import UdpTransport
+from .requestqueue.mqtt import MqttTransport
 from .board.board import Board, BasicButtonBoard, DialBoard
 from .board import layouts, basics, deprecated
 from .config.config import Config
 from .wifi.wifi import WiFiController
 from .otaupdate import update_manager
 from .ble import ble
-from .api import server, routes
+from .api import server, routes, events
 
 requestqueue: RequestQueue
+batcher: PressBatcher
 board: Board
 config: Config
 wifi: WiFiController
@@ -29,12 +35,61 @@ def setup_request_queue():
     global config, requestqueue
     requestqueue = RequestQueue(
         5,
-        config.value['homeassistant-ip'],
+        config.value['home-assistant-ip'],
+        connections=2,
+    )
+
+    # The switch's name and layout are the same in every press,
+    # so they're rendered into the encoder's templates once
+    requestqueue.encoder = RequestEncoder(
+        requestqueue.pool.host,
+        config.value['name'],
+        str(config.value['layout']),
+    )
+
+    # Presses only go to local consumers in place of the webhook
+    # when asked to, as anyone on the network could take them
+    if config.value.get('push-presses', False):
+        requestqueue.push = push_press
+
+    # Presses can go to a UDP bridge in place of the webhook
+    if config.value.get('transport') == 'udp':
+        requestqueue.use_transport(
+            UdpTransport(
+                config.value['udp-bridge'],
+                machine.unique_id(),
+                str(config.value['layout']),
+            ))
+    # Or to an MQTT broker, over one persistent connection
+    elif config.value.get('transport') == 'mqtt':
+        requestqueue.use_transport(
+            MqttTransport(
+                config.value['mqtt-broker'],
+                str(Config.device_uuid(), 'utf8'),
+                requestqueue.encoder,
+                prefix=config.value.get('mqtt-prefix'),
+                username=config.value.get('mqtt-username'),
+                password=config.value.get('mqtt-password'),
+            ))
+
+
+# Presses go to local consumers holding /presses open, as the
+# webhook's body, rather than to the webhook while there are any.
+# Presses a consumer leaves before being written fall back to the
+# webhook
+def push_press(req: Request) -> bool:
+    if req.keys is None or len(events.deliveries.subscribers) == 0:
+        return False
+
+    return events.deliveries.deliver(
+        req.path,
+        requestqueue.encoder.press_body(req.keys, req.id_text()),
+        lambda ok: requestqueue.push_done(req, ok),
     )
 
 
 def setup_board():
-    global board, config
+    global board, batcher, config
 
     layout = str(config.value['layout'])
 
@@ -129,15 +184,16 @@ def setup_board():
         case _:
             raise Exception("Unknown layout: " + str(layout))
 
-    def new_request(key: str) -> Request:
-        return Request(
-            'press',
-            json.dumps({
-                "switch": config.value["name"],
-                "layout": layout,
-                "key": key,
-            }),
-        )
+    def new_request(keys: list[str]) -> Request:
+        # On/off presses go ahead of everything else, and long
+        # presses wait behind regular ones
+        priority = PRIORITY_NORMAL
+        if keys[0] == 'on' or keys[0] == 'off':
+            priority = PRIORITY_HIGH
+        elif keys[0].endswith('-long'):
+            priority = PRIORITY_LOW
+
+        return Request('press', priority=priority, keys=keys)
 
     if isinstance(board, BasicButtonBoard):
         b = board
@@ -148,13 +204,36 @@ def setup_board():
         def on_req_failure():
             asyncio.create_task(b.led.flash(100, 0, 0, times=2))
 
-        def on_press(key: str):
-            req = new_request(key)
+        def new_press_request(keys: list[str]) -> Request:
+            req = new_request(keys)
             req.on_success = on_req_success
             req.on_failure = on_req_failure
-            requestqueue.add(req)
+            return req
+
+        batcher = PressBatcher(
+            requestqueue,
+            new_press_request,
+            window_ms=int(
+                config.value.get('press-window-ms', PressBatcher.window_ms)),
+            batch=bool(config.value.get('batch-presses', False)),
+            journal=PressJournal(max_age_s=int(
+                config.value.get('journal-max-age-s',
+                                 PressJournal.max_age_s))),
+        )
+
+        # Render every key's request ahead of the first press
+        keys = []
+        for button in b.buttons.values():
+            keys.append(str(button.key))
+            keys.append(str(button.key) + '-long')
+        requestqueue.encoder.prepare('press', keys)
+
+        def on_press(key: str):
+            batcher.press(key)
+            publish_press(key)
 
         b.on_press = on_press
+        requestqueue.on_backpressure = b.on_backpressure
         board = b
 
     # Setup dial handlers
@@ -162,16 +241,31 @@ def setup_board():
         b = board
 
         def on_dial_press(routine: deprecated.Routine):
-            board.on_press(routine.name)
+            batcher.dial(routine.name)
+            events.stream.publish(events.PRESS, {'dial': routine.name})
 
         def on_dial_long_press(routine: deprecated.Routine):
-            board.on_press(routine.name + '-long')
+            batcher.dial(routine.name + '-long')
+            events.stream.publish(events.LONG_PRESS, {'dial': routine.name})
+
+        def on_dial_rotate(routine: deprecated.Routine):
+            events.stream.publish(events.DIAL, {'routine': routine.name})
 
         b.on_dial_press = on_dial_press
         b.on_dial_longpress = on_dial_long_press
+        b.on_dial_rotate = on_dial_rotate
         board = b
 
 
+# Long presses arrive with their key suffixed, and go out as their
+# own event
+def publish_press(key: str):
+    if key.endswith('-long'):
+        events.stream.publish(events.LONG_PRESS, {'key': key[:-len('-long')]})
+    else:
+        events.stream.publish(events.PRESS, {'key': key})
+
+
 def setup_wifi():
     global config, wifi, board
 
@@ -181,9 +275,30 @@ def setup_wifi():
 
     wifi = WiFiController(ssid, psk)
 
-    wifi.on_connecting = board.on_wifi_connecting
-    wifi.on_connected = board.on_wifi_connected
-    wifi.on_failed = board.on_wifi_failed
+    def on_connecting():
+        board.on_wifi_connecting()
+        events.stream.publish(events.WIFI, {'state': 'connecting'})
+
+    def on_connected():
+        board.on_wifi_connected()
+        events.stream.publish(events.WIFI, {'state': 'connected'})
+
+        # Send anything pressed while offline
+        asyncio.create_task(batcher.replay())
+
+    def on_failed(failure: str):
+        board.on_wifi_failed(failure)
+        events.stream.publish(events.WIFI, {
+            'state': 'failed',
+            'reason': failure
+        })
+
+    wifi.on_connecting = on_connecting
+    wifi.on_connected = on_connected
+    wifi.on_failed = on_failed
+
+    # Journal presses while disconnected
+    batcher.online = lambda: wifi._connected
 
 
 def setup_bluetooth():
@@ -214,11 +329,17 @@ def setup_bluetooth():
 def setup_automatic_updates():
     global board
 
-    board.on_update = update_manager.try_update
+    def on_update():
+        events.stream.publish(events.UPDATE, {'state': 'checking'})
+        update_manager.try_update()
+
+    board.on_update = on_update
 
 
 def setup_api():
     global api
 
     api = server.Server()
-    routes.setup_routes(api)
+    routes.setup_routes(api,
+                        push_presses=bool(
+                            config.value.get('push-presses', False)))
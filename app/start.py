@@ -1,7 +1,7 @@
 import asyncio
 
 
-def start():
+async def main():
     from . import shared
     from .otaupdate import update_manager
 
@@ -14,29 +14,25 @@ def start():
     shared.setup_automatic_updates()
     shared.setup_api()
 
-    # Try connecting to WiFi
-    shared.wifi.connect()
-    if not shared.wifi._connected:
-        return
+    # Try connecting to WiFi. If it fails, supervise() below
+    # keeps trying while everything else runs
+    await shared.wifi.connect()
 
     # Setup the HTTP server
-    shared.api.start()
-
-    # Start an infinite loop
-    while True:
-        # Should check for wifi, check for wifi
-        if not shared.wifi._connected:
-            shared.wifi.connect()
+    await shared.api.start()
 
-        # Check for request data
-        shared.requestqueue.poll()
+    # Run each subsystem as its own long-lived task, so none
+    # of them can hold up button presses
+    await asyncio.gather(
+        shared.wifi.supervise(),
+        shared.requestqueue.run(),
+        shared.api.serve(),
+        update_manager.run(),
+    )
 
-        # Poll for api requests
-        shared.api.poll()
 
-        # Check for updates on an interval
-        if update_manager.should_check_update():
-            update_manager.try_update()
+def start():
+    asyncio.run(main())
 
 
 try:
@@ -1,10 +1,13 @@
+import asyncio
 import network
-import time
 from machine import Timer
 
 
 class WiFiController:
 
+    # How often the supervisor checks the connection
+    supervise_interval_s = 5
+
     def __init__(
         self,
         ssid: str,
@@ -29,7 +32,7 @@ class WiFiController:
 
         self.on_failed = on_failed
 
-    def connect(self):
+    async def connect(self):
         if self._backoff:
             return
 
@@ -83,6 +86,18 @@ class WiFiController:
 
             else:
                 print('Trying to connect to "' + self._ssid + '"...')
-                time.sleep(1)
+                await asyncio.sleep(1)
 
         self.on_failed('WiFi connection timed out after 10s', )
+
+    # Long-lived task which reconnects whenever the link drops
+    async def supervise(self):
+        while True:
+            if self._connected and not self.wlan.isconnected():
+                print('WiFi connection lost')
+                self._connected = False
+
+            if not self._connected:
+                await self.connect()
+
+            await asyncio.sleep(WiFiController.supervise_interval_s)
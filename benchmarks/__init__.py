@@ -0,0 +1,3 @@
+# MicroPython's asyncio.ThreadSafeFlag, which the app sets from
+# IRQ handlers, is provided on CPython by the simulation's loop
+import sim.loop
@@ -0,0 +1,70 @@
+# Measures the cost of dispatching a poll event to its request,
+# and of checking for timeouts, as the queue's capacity grows.
+#
+#   python3 -m benchmarks.bench_dispatch
+import random
+import select
+import time
+
+from app.requestqueue.connection import AWAITING
+from app.requestqueue.queue import RequestQueue
+from app.requestqueue.request import Request
+
+CAPACITIES = [4, 16, 64, 256, 1024]
+ITERATIONS = 20_000
+
+
+# Stands in for a connection which is waiting on a response,
+# so no sockets are needed
+class IdleConnection:
+
+    def __init__(self, key):
+        self.key = key
+        self.state = AWAITING
+        self.request = None
+        self.reused = False
+
+    def on_event(self, event):
+        return None
+
+
+def fill(capacity: int) -> RequestQueue:
+    queue = RequestQueue(capacity, '127.0.0.1', connections=capacity)
+
+    for key in range(capacity):
+        conn = IdleConnection(key)
+        req = Request('press', '{}')
+        req.connection = conn
+        req.started()
+        conn.request = req
+
+        queue.pool._connections[key] = conn
+        queue._requests[key] = req
+        queue._track_deadline(req)
+
+    return queue
+
+
+def measure(fn) -> float:
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        fn()
+    return (time.perf_counter() - start) / ITERATIONS * 1_000_000
+
+
+def main():
+    print('capacity   dispatch (us)   prune (us)')
+
+    for capacity in CAPACITIES:
+        queue = fill(capacity)
+        keys = [random.randrange(capacity) for _ in range(ITERATIONS)]
+        it = iter(keys)
+
+        dispatch = measure(lambda: queue._on_event(next(it), select.POLLIN))
+        prune = measure(queue.prune_queue)
+
+        print('%8d   %13.2f   %10.2f' % (capacity, dispatch, prune))
+
+
+if __name__ == '__main__':
+    main()
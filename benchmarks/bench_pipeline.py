@@ -0,0 +1,244 @@
+# Drives synthetic press storms through the button IRQs of a fully
+# set up board, against a local stand-in for Home Assistant, and
+# reports throughput, tail latency, allocations and dropped
+# presses for each scenario.
+#
+#   python3 -m benchmarks.bench_pipeline [--json results.json]
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from app import shared
+from app.board import layouts
+from app.config.config import Config, ConfigValue
+from app.metrics import latency
+from app.metrics.latency import LatencyStats
+from tests.fake_ha import FakeHomeAssistant
+
+# Large enough to hold every press of a scenario, so tail
+# percentiles aren't limited to the most recent presses
+HISTOGRAM_SIZE = 4096
+
+# How long to wait for the queue to drain after a storm
+DRAIN_TIMEOUT_S = 10
+
+
+class Scenario:
+
+    def __init__(
+        self,
+        name: str,
+        presses: int,
+        interval_ms: float,
+        delay_ms: float = 5,
+        batch: bool = False,
+        window_ms: int = 200,
+    ):
+        self.name = name
+        self.presses = presses
+        self.interval_ms = interval_ms
+
+        # How long the fake Home Assistant takes per request
+        self.delay_ms = delay_ms
+        self.batch = batch
+
+        # Repeats of a key within the window are coalesced. Storms
+        # turn this off, so every press reaches the queue
+        self.window_ms = window_ms
+
+
+SCENARIOS = [
+    Scenario('steady', presses=200, interval_ms=20),
+    Scenario('storm', presses=500, interval_ms=1, window_ms=0),
+    Scenario('storm-batched',
+             presses=500,
+             interval_ms=1,
+             batch=True,
+             window_ms=0),
+    Scenario('slow-ha', presses=200, interval_ms=10, delay_ms=50),
+]
+
+
+def setup(scenario: Scenario, port: int):
+    shared.config = Config()
+    value = ConfigValue()
+    value['name'] = 'bench'
+    value['layout'] = layouts.V7
+    value['home-assistant-ip'] = '127.0.0.1:' + str(port)
+    value['batch-presses'] = scenario.batch
+    value['press-window-ms'] = scenario.window_ms
+    shared.config.value = value
+
+    latency.stats = LatencyStats(HISTOGRAM_SIZE)
+
+    shared.setup_request_queue()
+    shared.setup_board()
+    shared.board.enable()
+
+
+# Count the keys carried by every request which succeeds or fails
+def count_outcomes() -> dict:
+    outcomes = {'acked': 0, 'failed': 0}
+    new_request = shared.batcher.new_request
+
+    def counted(keys: list[str]):
+        req = new_request(keys)
+        on_success = req.on_success
+        on_failure = req.on_failure
+
+        def succeeded():
+            outcomes['acked'] += len(keys)
+            on_success()
+
+        def failed():
+            outcomes['failed'] += len(keys)
+            on_failure()
+
+        req.on_success = succeeded
+        req.on_failure = failed
+        return req
+
+    shared.batcher.new_request = counted
+    return outcomes
+
+
+# Drive the button's simulated GPIO, firing its IRQ handler on
+# both edges
+def press(button):
+    pin = button.gpios[0]
+    pin.drive(0)
+    pin.drive(1)
+
+
+def is_idle() -> bool:
+    queue = shared.requestqueue
+    return len(queue._requests) == 0 and queue.pending() == 0
+
+
+async def storm(scenario: Scenario, seed: int) -> dict:
+    rng = random.Random(seed)
+    buttons = list(shared.board.buttons.values())
+    outcomes = count_outcomes()
+
+    runner = asyncio.create_task(shared.requestqueue.run())
+    start = time.perf_counter()
+
+    for _ in range(scenario.presses):
+        press(rng.choice(buttons))
+        await asyncio.sleep(scenario.interval_ms / 1000)
+
+    deadline = time.perf_counter() + DRAIN_TIMEOUT_S
+    while not is_idle() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+
+    elapsed = time.perf_counter() - start
+    runner.cancel()
+    shared.requestqueue.pool.close()
+
+    outcomes['elapsed'] = elapsed
+    return outcomes
+
+
+def run(scenario: Scenario, seed: int, trace: bool) -> dict:
+    ha = FakeHomeAssistant()
+    ha.delay_s = scenario.delay_ms / 1000
+
+    try:
+        setup(scenario, ha.port)
+
+        if trace:
+            tracemalloc.start()
+        outcomes = asyncio.run(storm(scenario, seed))
+        if trace:
+            outcomes['peak'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        return outcomes
+    finally:
+        ha.close()
+
+
+def measure(scenario: Scenario, seed: int = 1) -> dict:
+    # Allocations are traced in a second, identical run, since
+    # tracing slows everything down
+    outcomes = run(scenario, seed, trace=False)
+    total = latency.stats.histograms[latency.TOTAL]
+    p50, p95, p99 = total.percentiles(50, 95, 99)
+    peak = run(scenario, seed, trace=True)['peak']
+
+    acked = outcomes['acked']
+    dropped = outcomes['failed']
+    return {
+        'scenario': scenario.name,
+        'presses': scenario.presses,
+        'acked': acked,
+        'coalesced': scenario.presses - acked - dropped,
+        'dropped': dropped,
+        'throughput': acked / outcomes['elapsed'],
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'max_ms': total.max_ms,
+        'peak_kib': peak / 1024,
+    }
+
+
+def build() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    results = []
+    stdout = sys.stdout
+
+    # Presses are journaled relative to the working directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            with open(os.devnull, 'w') as devnull:
+                for scenario in SCENARIOS:
+                    # The pipeline logs every press
+                    sys.stdout = devnull
+                    try:
+                        results.append(measure(scenario))
+                    finally:
+                        sys.stdout = stdout
+        finally:
+            os.chdir(cwd)
+
+    print('build ' + build())
+    print('scenario        presses  acked  coalesced  dropped  '
+          'presses/s  p50/p95/p99 (ms)  max (ms)  peak (KiB)')
+    for r in results:
+        print('%-14s  %7d  %5d  %9d  %7d  %9.1f  %16s  %8d  %10.1f' % (
+            r['scenario'],
+            r['presses'],
+            r['acked'],
+            r['coalesced'],
+            r['dropped'],
+            r['throughput'],
+            '%d/%d/%d' % (r['p50_ms'], r['p95_ms'], r['p99_ms']),
+            r['max_ms'],
+            r['peak_kib'],
+        ))
+
+    if len(sys.argv) > 2 and sys.argv[1] == '--json':
+        with open(sys.argv[2], 'w') as f:
+            json.dump({'build': build(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
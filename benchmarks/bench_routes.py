@@ -0,0 +1,43 @@
+# Measures the cost of finding a request's route as the number
+# of routes grows, for exact paths and for the last pattern.
+#
+#   python3 -m benchmarks.bench_routes
+import time
+
+from app.api.server import Server
+
+ROUTE_COUNTS = [1, 8, 64, 256]
+ITERATIONS = 20_000
+
+
+def routes(count: int) -> Server:
+    server = Server()
+    for i in range(count):
+        server.add_route('/static/' + str(i), lambda r: None)
+        server.add_route('/pattern/' + str(i) + '/<key>', lambda r: None)
+    return server
+
+
+def measure(fn) -> float:
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        fn()
+    return (time.perf_counter() - start) / ITERATIONS * 1_000_000
+
+
+def main():
+    print('routes   static (us)   pattern (us)')
+
+    for count in ROUTE_COUNTS:
+        server = routes(count)
+        static = 'GET /static/' + str(count - 1) + ' HTTP/1.1\r\n\r\n'
+        pattern = 'GET /pattern/' + str(count - 1) + '/on HTTP/1.1\r\n\r\n'
+
+        static_us = measure(lambda: server.find_route(static))
+        pattern_us = measure(lambda: server.find_route(pattern))
+
+        print('%6d   %11.2f   %12.2f' % (count, static_us, pattern_us))
+
+
+if __name__ == '__main__':
+    main()
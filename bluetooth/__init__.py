@@ -1,4 +1,183 @@
-from unittest.mock import MagicMock
+# aioble waits on asyncio.ThreadSafeFlag, which the simulation's
+# loop provides on CPython
+import sim.loop
 
-UUID = MagicMock()
-BLE = MagicMock()
+FLAG_READ = 0x0002
+FLAG_WRITE_NO_RESPONSE = 0x0004
+FLAG_WRITE = 0x0008
+FLAG_NOTIFY = 0x0010
+FLAG_INDICATE = 0x0020
+
+_IRQ_CENTRAL_CONNECT = 1
+_IRQ_CENTRAL_DISCONNECT = 2
+_IRQ_GATTS_WRITE = 3
+
+
+class UUID:
+
+    def __init__(self, value):
+        if isinstance(value, UUID):
+            value = value._bytes
+        elif isinstance(value, int):
+            value = value.to_bytes(2, 'little')
+        elif isinstance(value, str):
+            # Written most significant byte first, stored least
+            # significant first, like the radio does
+            value = bytes.fromhex(value.replace('-', ''))[::-1]
+            if len(value) != 16:
+                raise ValueError('invalid UUID')
+
+        self._bytes = bytes(value)
+
+    def __bytes__(self) -> bytes:
+        return self._bytes
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, UUID) and self._bytes == other._bytes
+
+    def __hash__(self) -> int:
+        return hash(self._bytes)
+
+    def __repr__(self) -> str:
+        return 'UUID(' + self._bytes[::-1].hex() + ')'
+
+
+_radio = None
+
+
+# Stands in for the radio. Services live in a local attribute
+# table, and centrals connecting, writing and disconnecting are
+# driven by the simulation, arriving through the IRQ handler
+# just as they would from the real stack
+class BLE:
+
+    def __new__(cls):
+        global _radio
+        if _radio is None:
+            _radio = super().__new__(cls)
+            _radio._setup()
+        return _radio
+
+    def _setup(self):
+        self._active = False
+        self._handler = None
+        self._config = {
+            'mac': (0, b'\x28\xcd\xc1\x00\x00\x01'),
+            'gap_name': b'MPY BTSTACK',
+            'mtu': 23,
+        }
+
+        # Advertising interval, and payloads, while advertising
+        self.advertising = None
+        self.adv_data = None
+        self.resp_data = None
+
+        # Attribute values, by handle
+        self.values = {}
+        self._next_handle = 1
+
+        self.connections = set()
+        self._next_conn = 64
+
+        # (connection, handle, data) for each notification sent
+        self.notifications = []
+
+    def active(self, active=None):
+        if active is None:
+            return self._active
+        self._active = bool(active)
+        if not self._active:
+            self.advertising = None
+
+    def config(self, *args, **kwargs):
+        if len(args) == 1:
+            return self._config[args[0]]
+        self._config.update(kwargs)
+
+    def irq(self, handler):
+        self._handler = handler
+
+    def gap_advertise(self,
+                      interval_us,
+                      adv_data=None,
+                      resp_data=None,
+                      connectable=True):
+        self.advertising = interval_us
+        if adv_data is not None:
+            self.adv_data = bytes(adv_data)
+        if resp_data is not None:
+            self.resp_data = bytes(resp_data)
+
+    def gap_disconnect(self, conn_handle) -> bool:
+        if conn_handle not in self.connections:
+            return False
+        self.disconnect_central(conn_handle)
+        return True
+
+    # Each characteristic gets a value handle, followed by one for
+    # each of its descriptors
+    def gatts_register_services(self, services):
+        self.values = {}
+        self._next_handle = 1
+
+        handles = []
+        for _, characteristics in services:
+            service_handles = []
+            for characteristic in characteristics:
+                service_handles.append(self._allocate())
+                if len(characteristic) > 2:
+                    for _ in characteristic[2]:
+                        service_handles.append(self._allocate())
+            handles.append(tuple(service_handles))
+
+        return tuple(handles)
+
+    def _allocate(self) -> int:
+        handle = self._next_handle
+        self._next_handle += 1
+        self.values[handle] = b''
+        return handle
+
+    def gatts_read(self, value_handle) -> bytes:
+        return self.values[value_handle]
+
+    def gatts_write(self, value_handle, data, send_update=False):
+        self.values[value_handle] = bytes(data)
+        if send_update:
+            for conn_handle in self.connections:
+                self.gatts_notify(conn_handle, value_handle)
+
+    def gatts_notify(self, conn_handle, value_handle, data=None):
+        if data is None:
+            data = self.values[value_handle]
+        self.notifications.append((conn_handle, value_handle, bytes(data)))
+
+    def gatts_indicate(self, conn_handle, value_handle, data=None):
+        self.gatts_notify(conn_handle, value_handle, data)
+
+    def gatts_set_buffer(self, value_handle, length, append=False):
+        pass
+
+    def _irq(self, event, data):
+        if self._handler is not None:
+            return self._handler(event, data)
+
+    # Simulate a central connecting, returning its handle
+    def connect_central(self, addr=b'\x11\x22\x33\x44\x55\x66') -> int:
+        self._next_conn += 1
+        conn_handle = self._next_conn
+        self.connections.add(conn_handle)
+        self.advertising = None
+        self._irq(_IRQ_CENTRAL_CONNECT, (conn_handle, 0, addr))
+        return conn_handle
+
+    def disconnect_central(self,
+                           conn_handle,
+                           addr=b'\x11\x22\x33\x44\x55\x66'):
+        self.connections.discard(conn_handle)
+        self._irq(_IRQ_CENTRAL_DISCONNECT, (conn_handle, 0, addr))
+
+    # Simulate a central writing to a characteristic
+    def write_central(self, conn_handle, value_handle, data):
+        self.values[value_handle] = bytes(data)
+        self._irq(_IRQ_GATTS_WRITE, (conn_handle, value_handle))
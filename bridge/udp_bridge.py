@@ -0,0 +1,155 @@
+# Reference receiver for switches using the UDP transport. Each
+# press is forwarded to Home Assistant's webhook just as the
+# switch would have sent it, and acked once Home Assistant has
+# accepted it. Presses resent after that are acked again without
+# being forwarded twice.
+#
+#   python3 -m bridge.udp_bridge --ha 192.168.1.10:8123 \
+#       [--port 5555] [--name E6614104032B5A2C=hallway ...]
+import argparse
+import asyncio
+import binascii
+from collections import OrderedDict
+
+from app.requestqueue import udp
+from app.requestqueue.encoder import RequestEncoder
+from app.requestqueue.pool import ConnectionPool
+
+
+class Bridge(asyncio.DatagramProtocol):
+
+    # Sequence numbers remembered for each boot of each switch
+    remembered = 256
+
+    # How long Home Assistant has to accept a press. Until it does,
+    # resends of the press are ignored
+    post_timeout_s = 5
+
+    def __init__(self, ha: str, names: dict[str, str] | None = None):
+        self.ha_host, self.ha_port = ConnectionPool.parse_host(ha)
+        self.names = names if names is not None else {}
+        self.transport = None
+
+        # (device, boot) -> seq -> True once forwarded, or False
+        # while it's being forwarded
+        self._seen: dict[tuple, OrderedDict] = {}
+
+        self.forwarded = 0
+        self.duplicates = 0
+        self.failures = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        press = udp.decode_press(data)
+        if press is None:
+            return
+
+        device, _, _, boot, seq, _ = press
+        seen = self._seen.setdefault((device, boot), OrderedDict())
+
+        forwarded = seen.get(seq)
+        if forwarded:
+            self.duplicates += 1
+            self._ack(device, boot, seq, addr)
+            return
+        if forwarded is not None:
+            # Still being forwarded, and acked once it is
+            return
+
+        seen[seq] = False
+        while len(seen) > Bridge.remembered:
+            seen.popitem(last=False)
+
+        asyncio.ensure_future(self._forward(press, addr))
+
+    async def _forward(self, press: tuple, addr):
+        device, _, _, boot, seq, _ = press
+        seen = self._seen[(device, boot)]
+
+        try:
+            ok = await asyncio.wait_for(self.post(press),
+                                        Bridge.post_timeout_s)
+        except asyncio.TimeoutError:
+            print('Home Assistant took too long to accept a press')
+            ok = False
+        except OSError as e:
+            print('Failed to reach Home Assistant: ' + str(e))
+            ok = False
+
+        if not ok:
+            # Forget the press, so the switch's next resend tries
+            # again
+            self.failures += 1
+            seen.pop(seq, None)
+            return
+
+        seen[seq] = True
+        self.forwarded += 1
+        self._ack(device, boot, seq, addr)
+
+    def _ack(self, device: bytes, boot: int, seq: int, addr):
+        self.transport.sendto(udp.encode_ack(device, boot, seq), addr)
+
+    # POST a press to the webhook. Returns whether Home Assistant
+    # accepted it
+    async def post(self, press: tuple) -> bool:
+        device, layout, key, boot, seq, _ = press
+        device_id = binascii.hexlify(device).decode().upper()
+        id_text = '%08x-%08x' % (boot, seq)
+
+        encoder = RequestEncoder(self.ha_host,
+                                 self.names.get(device_id, device_id),
+                                 layout.decode())
+        body = encoder.press_body([key.decode()], id_text).encode()
+
+        reader, writer = await asyncio.open_connection(self.ha_host,
+                                                       self.ha_port)
+        try:
+            writer.write(('POST /api/webhook/press HTTP/1.1\r\n'
+                          'Host: %s\r\n'
+                          'Content-Type: application/json\r\n'
+                          'Content-Length: %d\r\n'
+                          'Idempotency-Key: %s\r\n'
+                          'Connection: close\r\n\r\n' %
+                          (self.ha_host, len(body), id_text)).encode() + body)
+            await writer.drain()
+            status = await reader.readline()
+        finally:
+            writer.close()
+
+        parts = status.split(b' ')
+        return len(parts) > 1 and parts[1].startswith(b'2')
+
+
+async def serve(ha: str, port: int, names: dict[str, str]):
+    loop = asyncio.get_running_loop()
+    await loop.create_datagram_endpoint(lambda: Bridge(ha, names),
+                                        local_addr=('0.0.0.0', port))
+    print('Bridging presses on :%d to %s' % (port, ha))
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ha', required=True, help='host[:port]')
+    parser.add_argument('--port',
+                        type=int,
+                        default=udp.UdpTransport.default_port)
+    parser.add_argument('--name',
+                        action='append',
+                        default=[],
+                        help='DEVICE=NAME, naming a switch by its id')
+    args = parser.parse_args()
+
+    names = {}
+    for name in args.name:
+        device, _, switch = name.partition('=')
+        names[device.upper()] = switch
+
+    asyncio.run(serve(args.ha, args.port, names))
+
+
+if __name__ == '__main__':
+    main()
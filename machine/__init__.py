@@ -1,5 +1,167 @@
-from unittest.mock import MagicMock
+from collections import deque
 
-Pin = MagicMock()
-Timer = MagicMock()
-PWM = MagicMock()
+# Code run against these stubs sets asyncio.ThreadSafeFlag from IRQ
+# handlers, which the simulation's loop provides on CPython
+import sim.loop
+from sim.clock import clock
+
+# Every pin created, by id, so simulations can drive inputs and
+# inspect outputs
+pins = {}
+
+
+# A GPIO. Inputs are driven by the simulation, and fire their
+# IRQ handler on matching edges
+class Pin:
+
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self.pull = pull
+
+        # Inputs float to their pull, and outputs start low
+        self.level = 1 if pull == Pin.PULL_UP else 0
+        if value is not None:
+            self.level = 1 if value else 0
+
+        self._handler = None
+        self._trigger = 0
+
+        pins[id] = self
+
+    def value(self, value=None):
+        if value is None:
+            return self.level
+
+        self.drive(value)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        self._handler = handler
+        self._trigger = trigger
+
+    # Set the level seen on the pin, firing the IRQ handler if
+    # the edge matches its trigger
+    def drive(self, level):
+        level = 1 if level else 0
+        if level == self.level:
+            return
+
+        self.level = level
+        edge = Pin.IRQ_RISING if level else Pin.IRQ_FALLING
+        if self._handler is not None and self._trigger & edge:
+            self._handler(self)
+
+
+# Hardware timers fire from the virtual clock
+class Timer:
+
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self,
+                 id=-1,
+                 mode=PERIODIC,
+                 period=-1,
+                 freq=-1,
+                 callback=None):
+        self._handle = None
+        self.fired = 0
+
+        if callback is not None:
+            self.init(mode=mode, period=period, freq=freq, callback=callback)
+
+    def init(self, mode=PERIODIC, period=-1, freq=-1, callback=None):
+        self.deinit()
+
+        if freq > 0:
+            period = 1000 // freq
+
+        self.mode = mode
+        self.period = max(1, period)
+        self.callback = callback
+        self._schedule()
+
+    def _schedule(self):
+        self._handle = clock.call_later(self.period, self._fire)
+
+    def _fire(self):
+        self._handle = None
+        if self.mode == Timer.PERIODIC:
+            self._schedule()
+
+        self.fired += 1
+        if self.callback is not None:
+            self.callback(self)
+
+    @property
+    def active(self) -> bool:
+        return self._handle is not None
+
+    def deinit(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+# PWM output, recording each duty cycle change with the tick it
+# was made at
+class PWM:
+
+    history_size = 256
+
+    def __init__(self, pin, freq=0, duty_u16=0):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty_u16
+        self.history = deque((), PWM.history_size)
+
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty_u16(self, value=None):
+        if value is None:
+            return self._duty
+
+        self._duty = value
+        self.history.append((clock.ticks_ms(), value))
+
+    def deinit(self):
+        self.duty_u16(0)
+
+
+class RTC:
+
+    def __init__(self):
+        self._datetime = (2000, 1, 1, 5, 0, 0, 0, 0)
+
+    def datetime(self, value=None):
+        if value is None:
+            return self._datetime
+        self._datetime = tuple(value)
+
+
+def unique_id() -> bytes:
+    return b'\xe6\x61\x41\x04\x03\x2b\x5a\x2c'
+
+
+# Rebooting ends the simulation
+def reset():
+    raise SystemExit('machine.reset()')
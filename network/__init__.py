@@ -1,9 +1,105 @@
-from unittest.mock import MagicMock
+from sim.clock import clock
 
-WLAN = MagicMock()
-STA_IF = MagicMock()
+STA_IF = 0
+AP_IF = 1
 
-STAT_GOT_IP = MagicMock()
-STAT_NO_AP_FOUND = MagicMock()
-STAT_WRONG_PASSWORD = MagicMock()
-STAT_CONNECT_FAIL = MagicMock()
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = -3
+STAT_NO_AP_FOUND = -2
+STAT_CONNECT_FAIL = -1
+STAT_GOT_IP = 3
+
+# Access points in range of the simulated radio, by SSID, with
+# their passwords
+access_points = {}
+
+# How long joining an access point takes
+connect_ms = 1500
+
+_interfaces = {}
+
+
+# The WiFi interface, as a state machine on the virtual clock:
+# idle -> connecting -> got IP, or one of the failure states
+class WLAN:
+
+    def __new__(cls, interface=STA_IF):
+        # Each interface is a single radio, however many times
+        # it's asked for
+        if interface not in _interfaces:
+            wlan = super().__new__(cls)
+            wlan._setup(interface)
+            _interfaces[interface] = wlan
+        return _interfaces[interface]
+
+    def _setup(self, interface):
+        self.interface = interface
+        self._active = False
+        self._status = STAT_IDLE
+        self._ssid = None
+        self._pending = None
+        self._ip = '0.0.0.0'
+        self.connects = 0
+
+    def active(self, is_active=None):
+        if is_active is None:
+            return self._active
+
+        self._active = bool(is_active)
+        if not self._active:
+            self.disconnect()
+
+    def connect(self, ssid=None, key=None):
+        if not self._active:
+            raise OSError('WLAN not active')
+
+        self._cancel()
+        self._ssid = ssid
+        self._status = STAT_CONNECTING
+        self.connects += 1
+        self._pending = clock.call_later(connect_ms,
+                                         lambda: self._associate(ssid, key))
+
+    def _associate(self, ssid, key):
+        self._pending = None
+
+        if ssid not in access_points:
+            self._status = STAT_NO_AP_FOUND
+        elif access_points[ssid] != key:
+            self._status = STAT_WRONG_PASSWORD
+        else:
+            self._status = STAT_GOT_IP
+            self._ip = '192.168.4.' + str(10 + len(_interfaces))
+
+    def _cancel(self):
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+
+    def disconnect(self):
+        self._cancel()
+        self._status = STAT_IDLE
+
+    def isconnected(self) -> bool:
+        return self._status == STAT_GOT_IP
+
+    def status(self, param=None):
+        if param == 'rssi':
+            return -50 if self.isconnected() else 0
+        return self._status
+
+    def ifconfig(self, config=None):
+        if config is None:
+            return (self._ip, '255.255.255.0', '192.168.4.1', '192.168.4.1')
+        self._ip = config[0]
+
+    def config(self, *args, **kwargs):
+        if len(args) == 1 and args[0] == 'ssid':
+            return self._ssid
+        return None
+
+    # Simulate the access point going away
+    def drop(self):
+        self._cancel()
+        self._status = STAT_CONNECT_FAIL
@@ -0,0 +1,115 @@
+import heapq
+import time
+
+
+# A callback scheduled on the clock, which can be cancelled
+# until it runs
+class Handle:
+
+    def __init__(self, due_ms: int, callback):
+        self.due_ms = due_ms
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+# Millisecond clock shared by every piece of simulated hardware.
+#
+# It follows real time by default, so code which doesn't care
+# about the simulation behaves as it would without it. Once
+# frozen, it only moves when advanced, firing hardware timers in
+# order along the way, so simulations are deterministic and run
+# as fast as the host allows
+class VirtualClock:
+
+    def __init__(self):
+        self._frozen = False
+        self._now_ms = 0
+
+        # Added to the real clock while following real time, so
+        # ticks start near zero and carry on from wherever a
+        # frozen stretch left them
+        self._offset = -VirtualClock._real_ms()
+
+        # Min-heap of (due, seq, handle)
+        self._timers: list[tuple] = []
+        self._seq = 0
+
+    @staticmethod
+    def _real_ms() -> int:
+        return int(time.monotonic() * 1000)
+
+    def ticks_ms(self) -> int:
+        if not self._frozen:
+            self._now_ms = VirtualClock._real_ms() + self._offset
+        return self._now_ms
+
+    @property
+    def frozen(self) -> bool:
+        return self._frozen
+
+    def freeze(self):
+        self.ticks_ms()
+        self._frozen = True
+
+    def thaw(self):
+        self._offset = self._now_ms - VirtualClock._real_ms()
+        self._frozen = False
+
+    def _set(self, now_ms: int):
+        if self._frozen:
+            self._now_ms = now_ms
+        else:
+            self._offset += now_ms - self.ticks_ms()
+            self._now_ms = now_ms
+
+    def call_at(self, due_ms: int, callback) -> Handle:
+        handle = Handle(due_ms, callback)
+        self._seq += 1
+        heapq.heappush(self._timers, (due_ms, self._seq, handle))
+        return handle
+
+    def call_later(self, delay_ms: int, callback) -> Handle:
+        return self.call_at(self.ticks_ms() + delay_ms, callback)
+
+    # Tick at which the next callback is due, or None
+    def next_due_ms(self) -> int | None:
+        while len(self._timers) > 0:
+            due_ms, _, handle = self._timers[0]
+            if not handle.cancelled:
+                return due_ms
+            heapq.heappop(self._timers)
+
+        return None
+
+    # Run every callback which is due by now, in order
+    def run_due(self):
+        now = self.ticks_ms()
+        while True:
+            due_ms = self.next_due_ms()
+            if due_ms is None or due_ms > now:
+                return
+
+            _, _, handle = heapq.heappop(self._timers)
+            handle.callback()
+
+    # Move time forward, running callbacks at the tick they're
+    # due as it passes
+    def advance(self, ms: int):
+        target = self.ticks_ms() + ms
+
+        while True:
+            due_ms = self.next_due_ms()
+            if due_ms is None or due_ms > target:
+                break
+
+            if due_ms > self.ticks_ms():
+                self._set(due_ms)
+            self.run_due()
+
+        self._set(target)
+
+
+clock = VirtualClock()
@@ -0,0 +1,121 @@
+import asyncio
+import selectors
+
+from .clock import clock
+
+
+# MicroPython's asyncio has a flag which can be set from an IRQ,
+# and which aioble waits on. CPython's doesn't, so this stands in
+class ThreadSafeFlag:
+
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+if not hasattr(asyncio, 'ThreadSafeFlag'):
+    asyncio.ThreadSafeFlag = ThreadSafeFlag
+
+
+# Wraps the loop's selector so that, rather than sleeping until
+# the next callback is due, the virtual clock jumps straight to
+# it, firing hardware timers on the way
+class _VirtualSelector(selectors.BaseSelector):
+
+    def __init__(self, speed: float | None):
+        self._selector = selectors.DefaultSelector()
+        self.speed = speed
+
+    def register(self, fileobj, events, data=None):
+        return self._selector.register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        return self._selector.unregister(fileobj)
+
+    def modify(self, fileobj, events, data=None):
+        return self._selector.modify(fileobj, events, data)
+
+    def get_map(self):
+        return self._selector.get_map()
+
+    def close(self):
+        self._selector.close()
+
+    def select(self, timeout=None):
+        clock.run_due()
+
+        events = self._selector.select(0)
+        if len(events) > 0 or (timeout is not None and timeout <= 0):
+            return events
+
+        step_ms = None
+        if timeout is not None:
+            step_ms = round(timeout * 1000)
+
+        due_ms = clock.next_due_ms()
+        if due_ms is not None:
+            until_due = max(0, due_ms - clock.ticks_ms())
+            if step_ms is None or until_due < step_ms:
+                step_ms = until_due
+
+        # Nothing is scheduled, so only real I/O can wake the loop
+        if step_ms is None:
+            return self._selector.select(None)
+
+        # Give real sockets a proportional share of real time, so
+        # servers on the other end get a chance to answer
+        if self.speed is not None:
+            real_s = step_ms / 1000 / self.speed
+            events = self._selector.select(real_s)
+            if len(events) > 0:
+                return events
+
+        clock.advance(step_ms)
+        return []
+
+
+# An event loop which runs on the virtual clock. With no speed,
+# idle time takes no real time at all. With a speed, idle time
+# passes that many times faster than real time
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self, speed: float | None = None):
+        super().__init__(_VirtualSelector(speed))
+
+        # Ticks are whole milliseconds, so callbacks due within one
+        # are run together, rather than stepping through fractions
+        self._clock_resolution = 0.001
+
+    def time(self) -> float:
+        return clock.ticks_ms() / 1000
+
+
+# Run a coroutine to completion on virtual time
+def run(main, speed: float | None = None):
+    clock.freeze()
+    loop = VirtualTimeLoop(speed)
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(main)
+    finally:
+        try:
+            # Cancel anything left running, like long-lived tasks
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+            clock.thaw()
@@ -0,0 +1,140 @@
+import socket
+import struct
+import threading
+
+from app.requestqueue import mqtt
+
+
+# Minimal MQTT 3.1.1 broker, recording what's published and keeping
+# retained messages, wills and which clients have sessions
+class FakeBroker:
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(4)
+        self.port = self.sock.getsockname()[1]
+
+        self.connections = 0
+        self.sessions = set()
+        self.clean_sessions = 0
+
+        # (topic, payload, retain, dup) for each PUBLISH
+        self.published = []
+        self.retained = {}
+        self.pings = 0
+
+        # Whether to ack QoS 1 publishes
+        self.ack = True
+
+        self._conns = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            self._conns.append(conn)
+            threading.Thread(target=self._serve, args=(conn, ),
+                             daemon=True).start()
+
+    def _serve(self, conn):
+        buf = b''
+        will = None
+        with conn:
+            while True:
+                try:
+                    data = conn.recv(4096)
+                except OSError:
+                    data = b''
+                if not data:
+                    break
+
+                buf += data
+                while True:
+                    parsed = mqtt.parse_packet(buf)
+                    if parsed is None:
+                        break
+                    first, body, used = parsed
+                    buf = buf[used:]
+
+                    kind = first & 0xf0
+                    if kind == mqtt.CONNECT:
+                        will = self._connect(conn, body)
+                    elif kind == mqtt.PUBLISH:
+                        self._publish(conn, first, body)
+                    elif kind == mqtt.PINGREQ:
+                        self.pings += 1
+                        self._send(conn, mqtt.packet(mqtt.PINGRESP))
+                    elif kind == mqtt.DISCONNECT:
+                        return
+
+        # Dropped without a DISCONNECT
+        if will is not None:
+            self.published.append((will[0], will[1], True, False))
+            self.retained[will[0]] = will[1]
+
+    def _connect(self, conn, body: bytes) -> tuple | None:
+        _, level, flags, _ = struct.unpack('!HxxxxBBH', body[0:10])
+        assert level == 4
+
+        fields = []
+        rest = body[10:]
+        while len(rest) > 0:
+            n = struct.unpack('!H', rest[0:2])[0]
+            fields.append(rest[2:2 + n])
+            rest = rest[2 + n:]
+
+        client_id = fields[0].decode()
+        present = client_id in self.sessions and not flags & 0x02
+        if flags & 0x02:
+            self.clean_sessions += 1
+        self.sessions.add(client_id)
+        self._send(conn, mqtt.packet(mqtt.CONNACK, bytes([int(present), 0])))
+
+        if flags & 0x04:
+            return fields[1].decode(), fields[2]
+        return None
+
+    def _publish(self, conn, first: int, body: bytes):
+        n = struct.unpack('!H', body[0:2])[0]
+        topic = body[2:2 + n].decode()
+        rest = body[2 + n:]
+
+        pid = None
+        if first & mqtt.QOS_1:
+            pid = rest[0:2]
+            rest = rest[2:]
+
+        retain = first & mqtt.RETAIN != 0
+        self.published.append((topic, rest, retain, first & mqtt.DUP != 0))
+        if retain:
+            self.retained[topic] = rest
+
+        if pid is not None and self.ack:
+            self._send(conn, mqtt.packet(mqtt.PUBACK, pid))
+
+    # Clients may hang up at any time, which the next receive
+    # notices
+    def _send(self, conn, data: bytes):
+        try:
+            conn.sendall(data)
+        except OSError:
+            pass
+
+    # Cut every client off, as if the network had gone away
+    def drop(self):
+        for conn in self._conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._conns = []
+
+    def close(self):
+        self.drop()
+        self.sock.close()
@@ -0,0 +1,79 @@
+import socket
+import threading
+import time
+
+
+# Minimal keep-alive webhook server, counting connections
+class FakeHomeAssistant:
+
+    response = b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n'
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(4)
+        self.port = self.sock.getsockname()[1]
+        self.connections = 0
+        self.requests = []
+        self.respond = True
+
+        # Responses to send before falling back to the default
+        self.responses = []
+
+        # How long Home Assistant takes to handle each request
+        self.delay_s = 0
+
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(conn, ),
+                             daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            buf = b''
+            while True:
+                try:
+                    data = conn.recv(4096)
+                except OSError:
+                    return
+                if not data:
+                    return
+
+                # Respond once the whole request has arrived
+                buf += data
+                end = buf.find(b'\r\n\r\n')
+                if end < 0:
+                    continue
+
+                length = 0
+                for line in buf[0:end].split(b'\r\n'):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line[15:])
+
+                if len(buf) < end + 4 + length:
+                    continue
+
+                self.requests.append(buf[0:end + 4 + length])
+                buf = buf[end + 4 + length:]
+                if self.delay_s > 0:
+                    time.sleep(self.delay_s)
+
+                # The client may have hung up meanwhile
+                try:
+                    if len(self.responses) > 0:
+                        conn.sendall(self.responses.pop(0))
+                    elif self.respond:
+                        conn.sendall(self.response)
+                except OSError:
+                    return
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,117 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from app.api.admission import Admission
+from app.api.server import Server
+
+
+class TestAdmission(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        patcher = mock.patch('app.clock.ticks_ms', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bucket(self):
+        """Addresses get a burst of requests, then rate_per_s"""
+        admission = Admission(rate_per_s=2, burst=3)
+
+        self.assertEqual([admission.allow('a') for _ in range(4)],
+                         [True, True, True, False])
+        self.assertTrue(admission.allow('b'))
+
+        self.now = 500
+        self.assertTrue(admission.allow('a'))
+        self.assertFalse(admission.allow('a'))
+
+        self.now = 60000
+        self.assertEqual([admission.allow('a') for _ in range(4)],
+                         [True, True, True, False])
+
+        self.assertEqual(admission.admitted, 8)
+        self.assertEqual(admission.rejected_rate, 3)
+
+    def test_tracking_bounded(self):
+        """Only so many addresses are tracked, forgetting full buckets
+        before those which are still limited"""
+        admission = Admission(rate_per_s=1, burst=2, max_tracked=2)
+        admission.allow('limited')
+        admission.allow('limited')
+        admission.allow('full')
+        self.now = 1000
+        admission.allow('new')
+
+        self.assertEqual(sorted(admission._buckets), ['limited', 'new'])
+
+    def test_slots(self):
+        """Connections beyond the slots are refused until one is freed"""
+        admission = Admission(slots=1)
+
+        self.assertTrue(admission.acquire())
+        self.assertFalse(admission.acquire())
+        admission.release()
+        self.assertTrue(admission.acquire())
+        self.assertEqual(admission.rejected_busy, 1)
+
+
+class TestServerAdmission(unittest.TestCase):
+
+    def run_with_server(self, client):
+        server = Server(host='127.0.0.1', port=0)
+        server.add_route('/info', lambda r: server.respond('{}'))
+
+        async def main():
+            await server.start()
+            port = server._server.sockets[0].getsockname()[1]
+            try:
+                return await client(port)
+            finally:
+                server.stop()
+                await asyncio.sleep(0.05)
+
+        return asyncio.run(main()), server.admission
+
+    async def get(self, port):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /info HTTP/1.1\r\nConnection: close\r\n\r\n')
+        response = await asyncio.wait_for(reader.read(), 1)
+        writer.close()
+        return response
+
+    def test_rate_limited(self):
+        """Clients over their rate get a 429"""
+
+        async def client(port):
+            return [await self.get(port) for _ in range(3)]
+
+        with mock.patch.object(Server, 'burst', 2):
+            responses, admission = self.run_with_server(client)
+
+        self.assertTrue(responses[1].startswith(b'HTTP/1.1 200'))
+        self.assertTrue(responses[2].startswith(b'HTTP/1.0 429'))
+        self.assertIn(b'Retry-After: 1\r\n', responses[2])
+        self.assertEqual(admission.rejected_rate, 1)
+
+    def test_busy(self):
+        """Connections beyond the slots get a 503, without holding up
+        those being served"""
+
+        async def client(port):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            await asyncio.sleep(0.05)
+
+            busy = await self.get(port)
+            writer.write(b'GET /info HTTP/1.1\r\nConnection: close\r\n\r\n')
+            served = await asyncio.wait_for(reader.read(), 1)
+            writer.close()
+            return busy, served
+
+        with mock.patch.object(Server, 'max_clients', 1):
+            (busy, served), admission = self.run_with_server(client)
+
+        self.assertTrue(busy.startswith(b'HTTP/1.0 503'))
+        self.assertTrue(served.startswith(b'HTTP/1.1 200'))
+        self.assertEqual(admission.rejected_busy, 1)
+        self.assertEqual(admission.busy, 0)
@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+
+from app.requestqueue.batcher import PressBatcher
+from app.requestqueue.queue import RequestQueue
+from app.requestqueue.request import Request, PRIORITY_NORMAL, PRIORITY_LOW
+
+
+class TestPressBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        patcher = mock.patch('app.clock.ticks_ms', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.queue = RequestQueue(5, '127.0.0.1')
+        self.sent = []
+
+        def new_request(keys):
+            self.sent.append(keys)
+            return Request('press', ','.join(keys))
+
+        self.batcher = PressBatcher(self.queue, new_request, window_ms=100)
+
+    def pending(self):
+        return [req.body for backlog in self.queue._pending for req in backlog]
+
+    def test_repeats_coalesced(self):
+        """Repeats of a key within the window are dropped"""
+        self.batcher.press('1')
+        self.now = 50
+        self.batcher.press('1')
+        self.batcher.press('2')
+        self.now = 150
+        self.batcher.press('1')
+
+        self.assertEqual(self.pending(), ['1', '2', '1'])
+        self.assertEqual(self.batcher.coalesced, 1)
+
+    def test_batching_joins_pending_request(self):
+        """Keys pressed before a request is sent join its body"""
+        self.batcher.batch = True
+
+        self.batcher.press('1')
+        self.batcher.press('2')
+        self.assertEqual(self.pending(), ['1,2'])
+
+        self.queue._pending[PRIORITY_NORMAL].clear()
+        self.batcher.press('3')
+        self.assertEqual(self.pending(), ['3'])
+
+    def test_dial_latest_selection_wins(self):
+        """Only the settled dial selection is sent"""
+        self.batcher.dial('red')
+        self.batcher.dial('blue')
+        self.assertEqual(self.pending(), [])
+
+        self.batcher._settle()
+        self.assertEqual(self.pending(), ['blue'])
+        self.assertEqual(self.queue._pending[PRIORITY_LOW][0].body, 'blue')
@@ -0,0 +1,67 @@
+import json
+import unittest
+
+from app.requestqueue.encoder import RequestEncoder
+from app.requestqueue.request import Request
+
+
+class TestRequestEncoder(unittest.TestCase):
+
+    def setUp(self):
+        self.encoder = RequestEncoder('ha.local', 'kitchen', 'v4')
+        self.buf = bytearray(512)
+
+    def split(self, raw):
+        head, body = bytes(raw).split(b'\r\n\r\n', 1)
+        return head.split(b'\r\n'), json.loads(body)
+
+    def test_press_from_template(self):
+        """Single key presses are rendered into the buffer"""
+        req = Request('press', keys=['on'])
+        raw = self.encoder.encode(req, self.buf)
+
+        self.assertIsInstance(raw, memoryview)
+        self.assertEqual(raw.obj, self.buf)
+
+        head, body = self.split(raw)
+        self.assertEqual(head[0], b'POST /api/webhook/press HTTP/1.1')
+        self.assertIn(b'Host: ha.local', head)
+        self.assertIn(b'Idempotency-Key: ' + req.id_text().encode(), head)
+        length = len(json.dumps(body).encode())
+        self.assertIn(b'Content-Length: %d' % length, head)
+        self.assertEqual(
+            body, {
+                "switch": "kitchen",
+                "layout": "v4",
+                "key": "on",
+                "id": req.id_text(),
+            })
+
+    def test_template_reused(self):
+        """Each press only changes the idempotency key"""
+        first = Request('press', keys=['1'])
+        second = Request('press', keys=['1'])
+
+        self.encoder.prepare('press', ['1'])
+        templates = dict(self.encoder._templates)
+        self.encoder.encode(first, self.buf)
+        _, body = self.split(self.encoder.encode(second, self.buf))
+
+        self.assertEqual(self.encoder._templates, templates)
+        self.assertEqual(body["id"], second.id_text())
+
+    def test_batched_press(self):
+        """Batched presses list every key"""
+        req = Request('press', keys=['1', '2'])
+        _, body = self.split(self.encoder.encode(req, self.buf))
+
+        self.assertEqual(body["key"], "1")
+        self.assertEqual(body["keys"], ["1", "2"])
+
+    def test_oversized_request(self):
+        """Requests larger than the buffer get their own"""
+        req = Request('press', '{"big": "' + 'x' * 1000 + '"}')
+        raw = self.encoder.encode(req, self.buf)
+
+        self.assertIsInstance(raw, bytes)
+        self.assertEqual(self.split(raw)[1]["big"], 'x' * 1000)
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from app import shared
+from app.api import events
+from app.api.events import EventStream, Subscriber
+from app.api.routes import setup_routes
+from app.api.server import Server
+from app.requestqueue.encoder import RequestEncoder
+from app.requestqueue.request import Request
+
+
+class TestSubscriber(unittest.TestCase):
+
+    def test_drops_oldest(self):
+        """A full ring drops its oldest events to make room"""
+        subscriber = Subscriber(3)
+        for i in range(5):
+            subscriber.put(i)
+
+        self.assertEqual(subscriber.take(), [2, 3, 4])
+        self.assertEqual(subscriber.dropped, 2)
+
+        subscriber.put(5)
+        self.assertEqual(subscriber.take(), [5])
+        self.assertEqual(subscriber.take(), [])
+
+
+class TestEventStream(unittest.TestCase):
+
+    def test_encoded_once(self):
+        """Events are encoded once and shared by every subscriber"""
+        stream = EventStream()
+        stream.publish(events.PRESS, {'key': 'on'})
+
+        first = stream.subscribe()
+        second = stream.subscribe()
+        stream.publish(events.PRESS, {'key': 'off'})
+
+        sent = first.take()
+        self.assertEqual(sent,
+                         [b'id: 1\nevent: press\ndata: {"key": "off"}\n\n'])
+        self.assertIs(second.take()[0], sent[0])
+
+    def test_subscribers_capped(self):
+        """Only so many clients may watch at once"""
+        stream = EventStream()
+        subscribers = [
+            stream.subscribe() for _ in range(stream.max_subscribers)
+        ]
+
+        self.assertIsNone(stream.subscribe())
+        stream.unsubscribe(subscribers[0])
+        self.assertIsNotNone(stream.subscribe())
+
+
+class TestDeliveries(unittest.TestCase):
+
+    def test_deliver_never_drops(self):
+        """Deliveries skip subscribers without room, rather than
+        dropping what they haven't sent"""
+        stream = EventStream()
+        done = lambda ok: None
+        self.assertFalse(stream.deliver('press', '{}', done))
+
+        subscriber = stream.subscribe()
+        for _ in range(EventStream.ring_size):
+            self.assertTrue(stream.deliver('press', '{}', done))
+
+        self.assertFalse(stream.deliver('press', '{}', done))
+        self.assertEqual(subscriber.dropped, 0)
+
+        subscriber.take()
+        self.assertTrue(stream.deliver('press', '{}', done))
+
+    def test_unwritten_returned(self):
+        """Deliveries still waiting when a client leaves are handed
+        back"""
+        stream = EventStream()
+        results = []
+        subscriber = stream.subscribe()
+        stream.deliver('press', '{}', results.append)
+
+        stream.unsubscribe(subscriber)
+        self.assertEqual(results, [False])
+
+    def test_push_press(self):
+        """Presses go to consumers as the webhook's body, and only
+        while there are any"""
+        results = []
+        queue = SimpleNamespace(encoder=RequestEncoder('ha', 'hall', 'v7'),
+                                push_done=lambda req, ok: results.append(ok))
+        req = Request('press', keys=['on'])
+
+        with mock.patch.object(shared, 'requestqueue', queue, create=True):
+            self.assertFalse(shared.push_press(req))
+
+            subscriber = events.deliveries.subscribe()
+            try:
+                self.assertTrue(shared.push_press(req))
+                event, done = subscriber.take()[0]
+            finally:
+                events.deliveries.unsubscribe(subscriber)
+
+            done(True)
+
+        self.assertEqual(results, [True])
+        event = event.decode()
+        self.assertIn('event: press\n', event)
+        body = json.loads(event.split('data: ')[1])
+        self.assertEqual(body['key'], 'on')
+        self.assertEqual(body['id'], req.id_text())
+
+
+class TestEventsRoute(unittest.TestCase):
+
+    def test_streams_events(self):
+        """Subscribers to /events are sent presses as they happen"""
+        server = Server(host='127.0.0.1', port=0)
+        setup_routes(server)
+
+        async def main():
+            await server.start()
+            port = server._server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /events HTTP/1.1\r\n\r\n')
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 1)
+
+            shared.publish_press('on')
+            shared.publish_press('3-long')
+            sent = await asyncio.wait_for(reader.readuntil(b'3"}\n\n'), 1)
+
+            writer.close()
+            await asyncio.sleep(0.05)
+            subscribers = list(events.stream.subscribers)
+            server.stop()
+            return head, sent, subscribers
+
+        head, sent, subscribers = asyncio.run(main())
+
+        self.assertTrue(head.startswith(b'HTTP/1.1 200'))
+        self.assertIn(b'Content-Type: text/event-stream\r\n', head)
+        self.assertIn(b'event: press\ndata: {"key": "on"}\n\n', sent)
+        self.assertIn(b'event: long-press\ndata: {"key": "3"}\n\n', sent)
+        self.assertEqual(subscribers, [])
+
+
+class TestPressesRoute(unittest.TestCase):
+
+    def serve(self, push_presses, client):
+        server = Server(host='127.0.0.1', port=0)
+        setup_routes(server, push_presses=push_presses)
+
+        async def main():
+            await server.start()
+            port = server._server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /presses HTTP/1.1\r\n\r\n')
+            try:
+                return await client(reader)
+            finally:
+                writer.close()
+                await asyncio.sleep(0.05)
+                server.stop()
+
+        return asyncio.run(main())
+
+    def test_opt_in(self):
+        """Presses are only offered to consumers when enabled"""
+
+        async def client(reader):
+            return await asyncio.wait_for(reader.readline(), 1)
+
+        self.assertTrue(self.serve(False, client).startswith(b'HTTP/1.1 404'))
+
+    def test_done_once_written(self):
+        """Deliveries are done once written to the consumer"""
+        results = []
+
+        async def client(reader):
+            await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 1)
+            events.deliveries.deliver('press', '{"key": "on"}', results.append)
+            sent = await asyncio.wait_for(reader.readuntil(b'}\n\n'), 1)
+            await asyncio.sleep(0.05)
+            return sent
+
+        sent = self.serve(True, client)
+        self.assertIn(b'event: press\ndata: {"key": "on"}\n\n', sent)
+        self.assertEqual(results, [True])
@@ -0,0 +1,87 @@
+import json
+import unittest
+
+from app import shared
+from app.api.request import HTTPRequest
+from app.api.routes import setup_routes
+from app.api.server import Server
+from app.config.config import Config, ConfigValue
+
+
+class FakeWriter:
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+
+
+class TestInfo(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Config()
+        self.config.raw = ConfigValue({
+            'name': 'hall',
+            'wifi': {
+                'ssid': 'home',
+                'pass': 'secret'
+            },
+        })
+        self.config.version = 'v1.2.3'
+
+        self.original = getattr(shared, 'config', None)
+        shared.config = self.config
+
+        self.server = Server()
+        setup_routes(self.server)
+
+    def tearDown(self):
+        shared.config = self.original
+
+    def get(self, *headers):
+        head = b'\r\n'.join((b'GET /info HTTP/1.1', ) + headers)
+        request = HTTPRequest.parse_head(head)
+        request.writer = FakeWriter()
+        self.server._handle(request, None, self.server.find_route(request))
+        return request.writer.writes[0]
+
+    def etag(self, response):
+        return response.split(b'ETag: ')[1].split(b'\r\n')[0]
+
+    def test_encoded_once(self):
+        """The info document is encoded once, without the wifi"""
+        body, etag = self.config.encodedinfo()
+
+        self.assertIs(self.config.encodedinfo()[0], body)
+        self.assertEqual(json.loads(body)['config'], {'name': 'hall'})
+        self.assertEqual(json.loads(body)['_version'], 'v1.2.3')
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+
+    def test_changes_invalidate(self):
+        """Changing the config or version gives a new document and tag"""
+        body, etag = self.config.encodedinfo()
+
+        self.config.version = 'v1.2.4'
+        self.config.changed()
+
+        new_body, new_etag = self.config.encodedinfo()
+        self.assertIn(b'v1.2.4', new_body)
+        self.assertNotEqual(new_etag, etag)
+
+    def test_not_modified(self):
+        """Clients with the current document get a 304 without it"""
+        response = self.get()
+        etag = self.etag(response)
+        self.assertTrue(response.startswith(b'HTTP/1.1 200'))
+        self.assertTrue(response.endswith(self.config.encodedinfo()[0]))
+
+        cached = self.get(b'If-None-Match: W/"0", ' + etag)
+        self.assertTrue(cached.startswith(b'HTTP/1.1 304'))
+        self.assertIn(b'ETag: ' + etag + b'\r\n', cached)
+        self.assertNotIn(b'Content-Length', cached)
+        self.assertNotIn(b'Content-Type', cached)
+        self.assertTrue(cached.endswith(b'\r\n\r\n'))
+
+        stale = self.get(b'If-None-Match: "0"')
+        self.assertTrue(stale.startswith(b'HTTP/1.1 200'))
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from app.requestqueue.journal import PressJournal
+
+
+class TestPressJournal(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.filename)
+        self.addCleanup(
+            lambda: os.path.exists(self.filename) and os.remove(self.filename))
+
+    def replay(self, journal, room=lambda: True):
+        sent = []
+        self.idents = []
+
+        def submit(key, priority, ident):
+            if not room():
+                return False
+            sent.append((key, priority))
+            self.idents.append(ident)
+            return True
+
+        asyncio.run(journal.replay(submit))
+        return sent
+
+    def test_survives_restart(self):
+        """Presses are replayed in order after reopening the journal"""
+        journal = PressJournal(self.filename, slots=8)
+        journal.append('on')
+        journal.append('3', 2)
+
+        journal = PressJournal(self.filename, slots=8)
+        self.assertEqual(self.replay(journal), [('on', None), ('3', 2)])
+
+        # Acked presses aren't replayed again, even after a restart
+        journal = PressJournal(self.filename, slots=8)
+        self.assertEqual(self.replay(journal), [])
+
+    def test_keeps_idempotency_key(self):
+        """Replays carry the key the press was made with, so
+        replaying again after a restart can't double a press"""
+        journal = PressJournal(self.filename, slots=8)
+        journal.append('on', None, 0x12345678, 42)
+
+        journal = PressJournal(self.filename, slots=8)
+        self.assertEqual(self.replay(journal), [('on', None)])
+        self.assertEqual(self.idents, [(0x12345678, 42)])
+
+    def test_without_key(self):
+        """Presses journaled without a key are given a new one"""
+        journal = PressJournal(self.filename, slots=8)
+        journal.append('on')
+
+        self.assertEqual(self.replay(journal), [('on', None)])
+        self.assertEqual(self.idents, [None])
+
+    def test_ring_wraps(self):
+        """Only the newest presses survive once the ring fills"""
+        journal = PressJournal(self.filename, slots=4)
+        for i in range(6):
+            journal.append(str(i))
+
+        self.assertEqual(os.path.getsize(self.filename), 4 * 64)
+        self.assertEqual([key for key, _ in self.replay(journal)],
+                         ['2', '3', '4', '5'])
+
+    def test_old_presses_skipped(self):
+        """Presses older than max_age_s are dropped on replay"""
+        journal = PressJournal(self.filename, slots=8, max_age_s=60)
+        journal.append('1')
+
+        with mock.patch('time.time', lambda: time.time_ns() / 1e9 + 120):
+            self.assertEqual(self.replay(journal), [])
+
+    def test_waits_for_room(self):
+        """Replay waits for the queue to have room"""
+        journal = PressJournal(self.filename, slots=8)
+        journal.append('1')
+        calls = []
+
+        def room():
+            calls.append(True)
+            return len(calls) > 2
+
+        with mock.patch.object(PressJournal, 'replay_wait_s', 0):
+            self.assertEqual(self.replay(journal, room), [('1', None)])
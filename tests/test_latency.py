@@ -0,0 +1,75 @@
+import unittest
+from unittest import mock
+
+from app import clock
+from app.board.basics import PushButton
+from app.metrics import latency
+from app.metrics.latency import Histogram, LatencyStats
+from app.requestqueue.queue import RequestQueue
+from app.requestqueue.request import Request
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        """Percentiles use the nearest rank"""
+        histogram = Histogram(100)
+        for ms in range(1, 101):
+            histogram.add(ms)
+
+        self.assertEqual(histogram.percentiles(50, 95, 99), (50, 95, 99))
+        self.assertEqual(histogram.summary()["max"], 100)
+
+    def test_ring_keeps_recent_samples(self):
+        """Old samples are overwritten, but still count towards the max"""
+        histogram = Histogram(4)
+        for ms in (500, 1, 2, 3, 4):
+            histogram.add(ms)
+
+        self.assertEqual(histogram.percentiles(99), (4, ))
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.max_ms, 500)
+
+    def test_empty(self):
+        """Empty histograms report zeros"""
+        self.assertEqual(Histogram().percentiles(50, 99), (0, 0))
+
+
+class TestLatencyStats(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = LatencyStats()
+        patcher = mock.patch.object(latency, 'stats', self.stats)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_timed_from_interrupt(self):
+        """Requests made by a button's handlers are timed from its interrupt"""
+        button = PushButton([], 'on')
+        button.gpios = [mock.Mock(value=lambda: 0)]
+        requests = []
+        button.on_press = lambda key: requests.append(Request('press'))
+
+        with mock.patch('app.board.basics.Timer'):
+            with mock.patch.object(clock, 'ticks_ms', return_value=1000):
+                button._on_interrupt()
+
+        self.assertEqual(requests[0].pressed_ms, 1000)
+        self.assertNotEqual(Request('press').pressed_ms, 1000)
+
+    def test_queue_records_stages(self):
+        """Each stage is recorded as the request reaches it"""
+        queue = RequestQueue(4, '127.0.0.1')
+        self.assertIs(queue.latency, self.stats)
+
+        with mock.patch.object(clock, 'ticks_ms', return_value=1000):
+            req = Request('press')
+        req.pressed_ms = 990
+
+        with mock.patch.object(clock, 'ticks_ms', return_value=1020):
+            queue.add(req)
+
+        queued = self.stats.histograms[latency.QUEUED]
+        self.assertEqual(queued.count, 1)
+        self.assertEqual(queued.max_ms, 30)
+        queue.pool.close()
@@ -0,0 +1,222 @@
+import errno
+import json
+import time
+import unittest
+from unittest import mock
+
+from app import clock
+from app.requestqueue import mqtt
+from app.requestqueue.encoder import RequestEncoder
+from app.requestqueue.mqtt import MqttTransport
+from app.requestqueue.queue import RequestQueue
+from app.requestqueue.request import Request
+from app.requestqueue.retry import RetryPolicy
+from tests.fake_broker import FakeBroker
+from tests.fake_ha import FakeHomeAssistant
+
+
+class TestPackets(unittest.TestCase):
+
+    def test_remaining_length(self):
+        """Lengths take as few bytes as they need, and parse back"""
+        for n, size in ((0, 1), (127, 1), (128, 2), (16383, 2), (16384, 3)):
+            raw = mqtt.packet(mqtt.PUBLISH, bytes(n))
+            self.assertEqual(len(raw), 1 + size + n)
+            self.assertEqual(mqtt.parse_packet(raw),
+                             (mqtt.PUBLISH, bytes(n), len(raw)))
+
+    def test_partial(self):
+        """Packets aren't parsed until all of them has arrived"""
+        raw = mqtt.publish_packet('a/b', b'hello', pid=7)
+
+        for i in range(len(raw)):
+            self.assertIsNone(mqtt.parse_packet(raw[0:i]))
+        self.assertEqual(
+            mqtt.parse_packet(raw + b'\xc0'),
+            (mqtt.PUBLISH | mqtt.QOS_1, b'\x00\x03a/b\x00\x07hello', len(raw)))
+
+
+class TestMqttTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.broker = FakeBroker()
+        self.ha = FakeHomeAssistant()
+
+        self.queue = RequestQueue(
+            5,
+            '127.0.0.1:' + str(self.ha.port),
+            retry=RetryPolicy(max_attempts=1),
+        )
+        self.transport = MqttTransport('127.0.0.1:' + str(self.broker.port),
+                                       'E661',
+                                       RequestEncoder('ha', 'hall', 'v7'))
+        self.queue.use_transport(self.transport)
+
+    def tearDown(self):
+        self.transport.close()
+        self.queue.pool.close()
+        self.broker.close()
+        self.ha.close()
+
+    def run_until(self, done):
+        give_up = time.monotonic() + 2
+        while not done():
+            self.assertLess(time.monotonic(), give_up)
+            self.queue.flush()
+            self.queue.poll(20)
+
+    def send(self, req: Request) -> bool:
+        done = []
+        req.on_success = lambda: done.append(True)
+        req.on_failure = lambda: done.append(False)
+
+        self.queue.add(req)
+        self.run_until(lambda: len(done) > 0)
+        return done[0]
+
+    def presses(self) -> list:
+        return [p for p in self.broker.published if p[0].endswith('/press')]
+
+    def test_publishes_presses(self):
+        """Presses are published with the webhook's body over one
+        connection, leaving the switch marked online"""
+        first = Request('press', keys=['on'])
+        self.assertTrue(self.send(first))
+        self.assertTrue(self.send(Request('press', keys=['off'])))
+
+        # The state isn't acked, so may arrive after the press is
+        self.run_until(lambda: b'off' in self.broker.retained.get(
+            'pico-switch/E661/state', b''))
+
+        self.assertEqual(self.broker.connections, 1)
+        self.assertEqual(self.broker.clean_sessions, 0)
+        self.assertEqual(len(self.ha.requests), 0)
+
+        topic, payload, retain, dup = self.presses()[0]
+        self.assertEqual(topic, 'pico-switch/E661/press')
+        self.assertFalse(retain or dup)
+        body = json.loads(payload)
+        self.assertEqual(body['key'], 'on')
+        self.assertEqual(body['id'], first.id_text())
+
+        self.assertEqual(self.broker.retained['pico-switch/E661/availability'],
+                         b'online')
+        self.assertEqual(
+            json.loads(self.broker.retained['pico-switch/E661/state'])['key'],
+            'off')
+
+    def test_window(self):
+        """Only so many presses await acks at once, whatever the
+        queue's capacity for webhook requests"""
+        self.assertGreater(MqttTransport.window, self.queue.capacity)
+        self.broker.ack = False
+        for key in range(MqttTransport.window + 2):
+            self.queue.add(Request('press', keys=[str(key)]))
+
+        self.run_until(lambda: len(self.presses()) == MqttTransport.window)
+        self.assertTrue(self.transport.busy())
+        self.assertEqual(self.queue.pending(), 2)
+
+    def test_resends_after_reconnecting(self):
+        """Presses unacked when the connection drops are resent as
+        duplicates once it's back, and the will marks the switch
+        offline meanwhile"""
+        self.broker.ack = False
+        done = []
+        req = Request('press', keys=['on'])
+        req.on_success = lambda: done.append(True)
+        self.queue.add(req)
+        self.run_until(lambda: len(self.presses()) == 1)
+
+        self.broker.ack = True
+        self.broker.drop()
+        with mock.patch.object(MqttTransport, 'reconnect_ms', 0):
+            self.run_until(lambda: len(done) > 0)
+
+        self.assertEqual(self.broker.connections, 2)
+        self.assertTrue(self.transport.session_present)
+        self.assertEqual([p[3] for p in self.presses()], [False, True])
+        self.assertIn(
+            ('pico-switch/E661/availability', b'offline', True, False),
+            self.broker.published)
+        self.assertEqual(self.broker.retained['pico-switch/E661/availability'],
+                         b'online')
+
+    def test_send_fails_while_resending(self):
+        """A connection which dies partway through resending presses
+        is taken as lost, rather than raising"""
+        self.run_until(lambda: self.transport.state == mqtt.CONNECTED)
+        real = self.transport.socket
+        self.transport.socket = mock.Mock(
+            fileno=real.fileno,
+            send=mock.Mock(
+                side_effect=[1024, OSError(errno.ECONNRESET, 'reset')]))
+
+        self.transport.state = mqtt.HANDSHAKE
+        for key in ('on', 'off', 'up'):
+            self.transport._publish(Request('press', keys=[key]),
+                                    'pico-switch/E661/press', b'{}')
+        self.transport._on_packet(mqtt.CONNACK, b'\x00\x00')
+        real.close()
+
+        self.assertEqual(self.transport.state, mqtt.CLOSED)
+        self.assertIsNone(self.transport.socket)
+        self.assertEqual(len(self.transport._publishes), 3)
+
+    def test_unreachable_broker(self):
+        """Presses don't wait forever on a broker which can't be
+        reached"""
+        self.transport.close()
+
+        def getaddrinfo(*args):
+            raise OSError(-2, 'Name or service not known')
+
+        with mock.patch('socket.getaddrinfo', getaddrinfo), \
+                mock.patch.object(MqttTransport, 'reconnect_ms', 0):
+            self.transport = MqttTransport('broker.invalid', 'E661',
+                                           RequestEncoder('ha', 'hall', 'v7'))
+            self.queue.use_transport(self.transport)
+            self.assertFalse(self.send(Request('press', keys=['on'])))
+
+        self.assertEqual(self.transport.in_flight(), 0)
+        self.assertTrue(self.queue.has_room())
+
+    def test_unacked_presses_time_out(self):
+        """Presses the broker never acks fail like webhook requests"""
+        self.broker.ack = False
+        with mock.patch.object(Request, 'request_timeout_ms', 50):
+            self.assertFalse(self.send(Request('press', keys=['on'])))
+
+        self.assertEqual(self.transport.in_flight(), 0)
+
+    def test_malformed_packet(self):
+        """Malformed packets drop the connection, rather than raising
+        out of the run loop"""
+        self.run_until(lambda: self.transport.state == mqtt.CONNECTED)
+        self.transport._on_packet(mqtt.PUBACK, b'\x00')
+        self.assertEqual(self.transport.state, mqtt.CLOSED)
+
+        self.transport._on_packet(mqtt.CONNACK, b'')
+        self.assertEqual(self.transport.state, mqtt.CLOSED)
+
+    def test_keepalive(self):
+        """Quiet connections are pinged once the keep-alive is up"""
+        self.run_until(lambda: self.transport.state == mqtt.CONNECTED)
+        self.transport.service()
+        self.assertEqual(self.transport.pings, 0)
+
+        later = clock.ticks_ms() + MqttTransport.keepalive_s * 1000
+        with mock.patch.object(clock, 'ticks_ms', lambda: later):
+            self.assertEqual(self.transport.next_due_ms(), 0)
+            self.run_until(
+                lambda: self.broker.pings == 1 and not self.transport._pinging)
+
+        self.assertEqual(self.transport.pings, 1)
+        self.assertEqual(self.transport.state, mqtt.CONNECTED)
+
+    def test_close(self):
+        """Closing leaves the switch marked offline"""
+        self.run_until(lambda: self.transport.state == mqtt.CONNECTED)
+        self.transport.close()
+        self.run_until(lambda: self.broker.retained.get(
+            'pico-switch/E661/availability') == b'offline')
@@ -0,0 +1,262 @@
+import asyncio
+import errno
+import time
+import unittest
+from unittest import mock
+
+from app import clock
+from app.requestqueue.queue import RequestQueue
+from app.requestqueue.retry import RetryPolicy
+from app.requestqueue.request import Request, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from tests.fake_ha import FakeHomeAssistant
+
+
+class TestRequestQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.ha = FakeHomeAssistant()
+        self.queue = RequestQueue(
+            4,
+            '127.0.0.1:' + str(self.ha.port),
+            retry=RetryPolicy(max_attempts=1),
+        )
+
+    def tearDown(self):
+        self.queue.pool.close()
+        self.ha.close()
+
+    def send(self, req: Request):
+        done = []
+        req.on_success = lambda: done.append(True)
+        req.on_failure = lambda: done.append(False)
+
+        self.queue.add(req)
+        while len(done) == 0:
+            self.queue.flush()
+            self.queue.poll(100)
+
+        return done[0]
+
+    def test_add_defers_send(self):
+        """Adding a request only queues it for the run loop"""
+        req = Request('press', '{}')
+
+        self.queue.add(req)
+
+        self.assertIsNone(req.connection)
+        self.assertEqual(self.queue._pending[PRIORITY_NORMAL], [req])
+
+        # The run loop is woken to send it
+        asyncio.run(asyncio.wait_for(self.queue._wake.wait(), 0.1))
+
+    def test_add_respects_capacity(self):
+        """Requests beyond the backlog are turned away, not dropped
+        silently"""
+        queue = RequestQueue(1, '127.0.0.1', backlog=1)
+        rejected = Request('press', '{}')
+        failed = []
+        rejected.on_failure = lambda: failed.append(True)
+
+        self.assertTrue(queue.add(Request('press', '{}')))
+        self.assertFalse(queue.add(rejected))
+
+        self.assertEqual(queue.pending(), 1)
+        self.assertEqual(failed, [True])
+
+    def test_backlog_separate_from_slots(self):
+        """Requests beyond the in-flight slots wait in the backlog"""
+        queue = RequestQueue(1,
+                             '127.0.0.1:' + str(self.ha.port),
+                             connections=2,
+                             backlog=4)
+        self.ha.respond = False
+        for _ in range(4):
+            self.assertTrue(queue.add(Request('press', '{}')))
+        queue.flush()
+        self.assertTrue(queue.add(Request('press', '{}')))
+
+        self.assertEqual(queue._in_flight(), 1)
+        self.assertEqual(queue.pending(), 4)
+        self.assertFalse(queue.has_room())
+        queue.pool.close()
+
+    def test_push(self):
+        """Requests taken by a local consumer are done once it's
+        written them, without sending"""
+        req = Request('press', '{}')
+        succeeded = []
+        req.on_success = lambda: succeeded.append(True)
+        self.queue.push = lambda r: True
+
+        self.assertTrue(self.queue.add(req))
+        self.assertEqual(succeeded, [])
+        self.assertEqual(self.queue.pending(), 0)
+
+        self.queue.push_done(req, True)
+        self.assertEqual(succeeded, [True])
+        self.assertEqual(self.queue.pushed, 1)
+
+    def test_push_falls_back(self):
+        """Requests a local consumer never wrote go to the webhook"""
+        req = Request('press', '{}')
+        self.queue.push = lambda r: True
+
+        self.queue.add(req)
+        self.queue.push_done(req, False)
+
+        self.assertEqual(self.queue._next(), req)
+        self.assertEqual(self.queue.pushed, 0)
+
+    def test_priority_order(self):
+        """Higher priority requests are sent first, and evict lower ones"""
+        queue = RequestQueue(2, '127.0.0.1', backlog=2)
+        low = Request('press', 'low', priority=PRIORITY_LOW)
+        normal = Request('press', 'normal')
+        high = Request('press', 'high', priority=PRIORITY_HIGH)
+
+        queue.add(low)
+        queue.add(normal)
+        queue.add(high)
+
+        self.assertEqual(queue._next(), high)
+        self.assertEqual(queue.pending(), 2)
+        self.assertEqual(queue.evicted, 1)
+        self.assertEqual(queue._pending[PRIORITY_LOW], [])
+
+    def test_backpressure(self):
+        """The board is told when the backlog fills and drains"""
+        queue = RequestQueue(4, '127.0.0.1', backlog=4)
+        signals = []
+        queue.on_backpressure = lambda active: signals.append(active)
+
+        for _ in range(3):
+            queue.add(Request('press', '{}'))
+        self.assertEqual(signals, [True])
+
+        queue._pending[PRIORITY_NORMAL] = []
+        queue._update_backpressure()
+        self.assertEqual(signals, [True, False])
+
+    def test_connection_reused(self):
+        """Consecutive presses share one keep-alive connection"""
+        self.assertTrue(self.send(Request('press', '{"key": "1"}')))
+        self.assertTrue(self.send(Request('press', '{"key": "2"}')))
+
+        self.assertEqual(self.ha.connections, 1)
+        self.assertEqual(len(self.ha.requests), 2)
+        self.assertIn(b'Connection: keep-alive', self.ha.requests[0])
+
+    def test_reconnects_after_server_close(self):
+        """A connection closed by the server is replaced"""
+        FakeHomeAssistant.response = (b'HTTP/1.1 200 OK\r\n'
+                                      b'Connection: close\r\n'
+                                      b'Content-Length: 0\r\n\r\n')
+        try:
+            self.assertTrue(self.send(Request('press', '{}')))
+            self.assertTrue(self.send(Request('press', '{}')))
+        finally:
+            FakeHomeAssistant.response = (b'HTTP/1.1 200 OK\r\n'
+                                          b'Content-Length: 0\r\n\r\n')
+
+        self.assertEqual(self.ha.connections, 2)
+
+    def test_flush_does_not_block(self):
+        """Sending never waits on a server which doesn't respond"""
+        self.ha.respond = False
+        req = Request('press', '{}')
+        failed = []
+        req.on_failure = lambda: failed.append(True)
+
+        start = time.monotonic()
+        self.queue.add(req)
+        self.queue.flush()
+        self.queue.poll(0)
+        self.assertLess(time.monotonic() - start, 0.1)
+
+        req.expiry = clock.ticks_add(clock.ticks_ms(), -1)
+        self.queue.prune_queue()
+        self.assertEqual(failed, [True])
+        self.assertEqual(self.queue.pool.open(), 0)
+
+    def test_deadlines(self):
+        """Requests expire in deadline order, bounding the poll timeout"""
+        self.ha.respond = False
+        now = [clock.ticks_ms()]
+        patcher = mock.patch('app.clock.ticks_ms', lambda: now[0])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        failed = []
+        for i in range(2):
+            req = Request('press', str(i))
+            req.on_failure = lambda i=i: failed.append(i)
+            self.queue.add(req)
+            self.queue.flush()
+            now[0] += 1000
+
+        self.assertEqual(self.queue.next_deadline_ms(),
+                         Request.request_timeout_ms - 2000)
+
+        now[0] += Request.request_timeout_ms - 2000 + 1
+        self.queue.poll(0)
+        self.assertEqual(failed, [0])
+        self.assertEqual(self.queue.next_deadline_ms(), 999)
+
+        now[0] += 1000
+        self.queue.poll(0)
+        self.assertEqual(failed, [0, 1])
+        self.assertIsNone(self.queue.next_deadline_ms())
+
+    def test_partial_writes(self):
+        """Bodies larger than the socket buffer are written in pieces"""
+        body = '{"key": "' + 'x' * 4_000_000 + '"}'
+
+        self.assertTrue(self.send(Request('press', body)))
+        self.assertTrue(self.ha.requests[0].endswith(body.encode()))
+
+    def test_write_would_block(self):
+        """A request whose first write would block on an idle
+        connection is sent once the socket is writable"""
+        self.assertTrue(self.send(Request('press', '{}')))
+
+        conn = next(iter(self.queue.pool._connections.values()))
+        real = conn.socket
+        sends = []
+
+        def send(data):
+            sends.append(len(data))
+            if len(sends) == 1:
+                raise OSError(errno.EAGAIN, 'would block')
+            return real.send(data)
+
+        conn.socket = mock.Mock(wraps=real, send=send)
+        start = time.monotonic()
+        self.assertTrue(self.send(Request('press', '{}')))
+
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(len(sends), 2)
+        self.assertEqual(len(self.ha.requests), 2)
+
+    def test_retry_keeps_idempotency_key(self):
+        """Retryable failures are sent again with the same key"""
+        self.queue.retry = RetryPolicy(base_delay_ms=1)
+        self.ha.responses.append(b'HTTP/1.1 503 Service Unavailable\r\n'
+                                 b'Content-Length: 0\r\n\r\n')
+        req = Request('press', '{}')
+
+        self.assertTrue(self.send(req))
+
+        self.assertEqual(req.attempts, 2)
+        self.assertEqual(len(self.ha.requests), 2)
+        key = b'Idempotency-Key: ' + req.id_text().encode()
+        self.assertIn(key, self.ha.requests[0])
+        self.assertIn(key, self.ha.requests[1])
+
+    def test_client_errors_not_retried(self):
+        """4xx responses fail straight away"""
+        self.queue.retry = RetryPolicy(base_delay_ms=1)
+        self.ha.responses.append(b'HTTP/1.1 404 Not Found\r\n'
+                                 b'Content-Length: 0\r\n\r\n')
+
+        self.assertFalse(self.send(Request('press', '{}')))
+        self.assertEqual(len(self.ha.requests), 1)
@@ -0,0 +1,80 @@
+import unittest
+
+from app.requestqueue.response import ResponseParser
+
+
+class TestResponseParser(unittest.TestCase):
+
+    def feed(self, *pieces):
+        parser = ResponseParser()
+        for piece in pieces:
+            parser.feed(piece)
+        return parser
+
+    def test_split_across_segments(self):
+        """Responses split at any byte are parsed the same"""
+        raw = (b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n'
+               b'Content-Length: 5\r\n\r\nhello')
+
+        for i in range(1, len(raw)):
+            parser = self.feed(raw[0:i], raw[i:])
+            self.assertTrue(parser.done, i)
+            self.assertEqual(parser.status, 200)
+            self.assertTrue(parser.keep_alive)
+
+    def test_incomplete_body(self):
+        """A response isn't done until its body arrives"""
+        parser = self.feed(b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhel')
+        self.assertFalse(parser.done)
+
+        parser.feed(b'lo')
+        self.assertTrue(parser.done)
+
+    def test_chunked(self):
+        """Chunked bodies are skipped chunk by chunk"""
+        parser = self.feed(
+            b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'4\r\nWiki\r\n', b'A;ext=1\r\n0123456789\r\n0\r\n', b'\r\n')
+
+        self.assertTrue(parser.done)
+        self.assertFalse(parser.error)
+
+    def test_stops_at_end_of_response(self):
+        """Bytes after the response are left unconsumed"""
+        raw = b'HTTP/1.1 204 No Content\r\n\r\nHTTP/1.1'
+        parser = ResponseParser()
+
+        self.assertEqual(parser.feed(raw), len(raw) - 8)
+        self.assertTrue(parser.done)
+
+    def test_connection_close(self):
+        """HTTP/1.0 and Connection: close responses aren't kept alive"""
+        parser = self.feed(b'HTTP/1.0 200 OK\r\nContent-Length: 0\r\n\r\n')
+        self.assertFalse(parser.keep_alive)
+
+        parser = self.feed(b'HTTP/1.1 500 Oops\r\nCONNECTION: Close\r\n'
+                           b'Content-Length: 0\r\n\r\n')
+        self.assertEqual(parser.status, 500)
+        self.assertFalse(parser.keep_alive)
+
+    def test_body_until_close(self):
+        """Unframed bodies end when the server closes"""
+        parser = self.feed(b'HTTP/1.1 200 OK\r\n\r\nsome body')
+        self.assertFalse(parser.done)
+
+        self.assertTrue(parser.finish())
+        self.assertFalse(parser.keep_alive)
+
+    def test_informational_skipped(self):
+        """1xx responses are followed by the final one"""
+        parser = self.feed(
+            b'HTTP/1.1 100 Continue\r\n\r\n'
+            b'HTTP/1.1 201 Created\r\nContent-Length: 0\r\n\r\n')
+        self.assertTrue(parser.done)
+        self.assertEqual(parser.status, 201)
+
+    def test_malformed(self):
+        """Garbage and overlong lines are errors"""
+        self.assertTrue(self.feed(b'SSH-2.0-OpenSSH\r\n').error)
+        self.assertTrue(
+            self.feed(b'HTTP/1.1 200 OK\r\nX: ' + b'a' * 300).error)
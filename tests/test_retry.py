@@ -0,0 +1,48 @@
+import unittest
+from unittest import mock
+
+from app.requestqueue.request import Request
+from app.requestqueue.retry import RetryPolicy
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        patcher = mock.patch('app.clock.ticks_ms', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_delay_grows_with_jitter(self):
+        """Delays double each attempt, within half to full"""
+        policy = RetryPolicy(base_delay_ms=100, max_delay_ms=1000)
+
+        for attempt, delay in ((1, 100), (2, 200), (3, 400), (5, 1000)):
+            for _ in range(20):
+                ms = policy.delay_ms(attempt)
+                self.assertGreaterEqual(ms, delay // 2)
+                self.assertLessEqual(ms, delay)
+
+    def test_attempts_limited(self):
+        """Requests are given up on after max_attempts"""
+        policy = RetryPolicy(max_attempts=2)
+        req = Request('press')
+
+        req.attempts = 1
+        self.assertIsNotNone(policy.next_retry(req))
+        req.attempts = 2
+        self.assertIsNone(policy.next_retry(req))
+
+    def test_budget(self):
+        """Retries stop when the budget runs out, until it refills"""
+        policy = RetryPolicy(budget=2)
+        req = Request('press')
+        req.attempts = 1
+
+        self.assertIsNotNone(policy.next_retry(req))
+        self.assertIsNotNone(policy.next_retry(req))
+        self.assertIsNone(policy.next_retry(req))
+        self.assertEqual(policy.exhausted, 1)
+
+        self.now += RetryPolicy.budget_refill_ms
+        self.assertIsNotNone(policy.next_retry(req))
@@ -0,0 +1,420 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from app.api.request import HTTPRequest, RequestError, read_request
+from app.api.server import Server
+
+
+class TestServer(unittest.TestCase):
+
+    def run_with_server(self, client):
+        server = Server(host="127.0.0.1", port=0)
+        server.add_route(
+            "/hello", lambda r: server.send("HTTP/1.0 200 OK"
+                                            "\r\n\r\nhello"))
+
+        async def main():
+            await server.start()
+            port = server._server.sockets[0].getsockname()[1]
+            try:
+                return await client(port)
+            finally:
+                server.stop()
+
+        return asyncio.run(main())
+
+    async def get(self, port, path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET " + path + b" HTTP/1.1\r\nHost: switch\r\n"
+                     b"Connection: close\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        return response
+
+    def test_routes(self):
+        """Requests reach their route, or get a 404"""
+
+        async def client(port):
+            return (await self.get(port, b"/hello"), await
+                    self.get(port, b"/missing"))
+
+        found, missing = self.run_with_server(client)
+
+        self.assertTrue(found.endswith(b"\r\n\r\nhello"))
+        self.assertTrue(missing.startswith(b"HTTP/1.1 404"))
+
+    def test_slow_client_does_not_block(self):
+        """A client which never finishes its request doesn't hold up others"""
+
+        async def client(port):
+            _, slow = await asyncio.open_connection("127.0.0.1", port)
+            slow.write(b"GET /hello HTTP/1.1\r\n")
+
+            response = await asyncio.wait_for(self.get(port, b"/hello"), 1)
+            slow.close()
+
+            # Let the server see the slow client go
+            await asyncio.sleep(0.05)
+            return response
+
+        self.assertTrue(self.run_with_server(client).endswith(b"hello"))
+
+    def test_read_deadline(self):
+        """Clients which stall are disconnected"""
+
+        async def client(port):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /hello HTTP/1.1\r\n")
+            response = await asyncio.wait_for(reader.read(), 1)
+            writer.close()
+            return response
+
+        with mock.patch.object(Server, "read_timeout_s", 0.1):
+            self.assertEqual(self.run_with_server(client), b"")
+
+    def test_body(self):
+        """Request bodies are read up to their Content-Length"""
+        bodies = []
+        server = Server(host="127.0.0.1", port=0)
+        server.add_route("/echo",
+                         lambda r: bodies.append(r.body),
+                         method="POST")
+
+        async def main():
+            await server.start()
+            port = server._server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"POST /echo HTTP/1.1\r\nContent-Length: 5\r\n\r\n"
+                         b"hello")
+            await reader.read()
+            writer.close()
+            server.stop()
+
+        asyncio.run(main())
+        self.assertEqual(bodies, [b"hello"])
+
+    def request(self, server, data):
+
+        async def main():
+            await server.start()
+            port = server._server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(data)
+            response = await asyncio.wait_for(reader.read(), 1)
+            writer.close()
+            server.stop()
+            return response
+
+        return asyncio.run(main())
+
+    def test_streamed_body(self):
+        """Streaming routes read bodies over the limit in chunks"""
+        chunks = []
+        server = Server(host="127.0.0.1", port=0)
+
+        async def upload(request):
+            while True:
+                chunk = await request.read(512)
+                if len(chunk) == 0:
+                    break
+                chunks.append(len(chunk))
+            request.send("HTTP/1.0 204 No Content\r\n\r\n")
+
+        server.add_route("/upload", upload, method="POST", stream=True)
+        body = b"x" * (Server.max_body_size * 2)
+        response = self.request(
+            server,
+            b"POST /upload HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % len(body)
+            + body)
+
+        self.assertTrue(response.startswith(b"HTTP/1.0 204"))
+        self.assertEqual(sum(chunks), len(body))
+        self.assertTrue(max(chunks) <= 512)
+
+    def test_body_too_large(self):
+        """Bodies over the limit are refused by other routes"""
+        server = Server(host="127.0.0.1", port=0)
+        server.add_route("/echo", lambda r: None, method="POST")
+        response = self.request(
+            server, b"POST /echo HTTP/1.1\r\nContent-Length: %d\r\n\r\n" %
+            (Server.max_body_size + 1))
+
+        self.assertTrue(response.startswith(b"HTTP/1.0 413"))
+
+    def test_headers_too_large(self):
+        """Oversized heads are refused without waiting for their end"""
+        server = Server(host="127.0.0.1", port=0)
+        response = self.request(
+            server, b"GET / HTTP/1.1\r\nX: " + b"x" * Server.max_header_size)
+
+        self.assertTrue(response.startswith(b"HTTP/1.0 431"))
+
+    def test_malformed(self):
+        """Requests which can't be parsed get a 400"""
+        server = Server(host="127.0.0.1", port=0)
+        response = self.request(server, b"nonsense\r\n\r\n")
+
+        self.assertTrue(response.startswith(b"HTTP/1.0 400"))
+
+
+class TestKeepAlive(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(host="127.0.0.1", port=0)
+        self.server.add_route("/info", lambda r: self.server.respond("{}"))
+        self.server.add_route(
+            "/old", lambda r: self.server.send("HTTP/1.0 200 OK\r\n\r\nold"))
+
+    def run_client(self, client):
+
+        async def main():
+            await self.server.start()
+            port = self.server._server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            try:
+                return await client(reader, writer)
+            finally:
+                writer.close()
+                self.server.stop()
+                await asyncio.sleep(0.05)
+
+        return asyncio.run(main())
+
+    async def response(self, reader):
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 1)
+        length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+        return head + await reader.readexactly(length)
+
+    def test_reused(self):
+        """HTTP/1.1 clients make several requests on one connection"""
+
+        async def client(reader, writer):
+            responses = []
+            for _ in range(3):
+                writer.write(b"GET /info HTTP/1.1\r\n\r\n")
+                responses.append(await self.response(reader))
+            return responses
+
+        responses = self.run_client(client)
+        self.assertEqual(len(responses), 3)
+        for response in responses:
+            self.assertTrue(response.startswith(b"HTTP/1.1 200"))
+            self.assertNotIn(b"Connection:", response)
+
+    def test_pipelined(self):
+        """Pipelined requests are answered in order"""
+
+        async def client(reader, writer):
+            writer.write(b"GET /info HTTP/1.1\r\n\r\n"
+                         b"GET /missing HTTP/1.1\r\n\r\n"
+                         b"GET /info HTTP/1.1\r\nConnection: close\r\n\r\n")
+            return await asyncio.wait_for(reader.read(), 1)
+
+        response = self.run_client(client)
+        self.assertEqual(response.count(b"HTTP/1.1 200"), 2)
+        self.assertLess(response.find(b"HTTP/1.1 404"),
+                        response.rfind(b"HTTP/1.1 200"))
+        self.assertTrue(response.endswith(b"Connection: close\r\n\r\n{}"))
+
+    def test_http_1_0(self):
+        """HTTP/1.0 clients only keep their connection when they ask"""
+
+        async def client(reader, writer):
+            writer.write(b"GET /info HTTP/1.0\r\nConnection: keep-alive"
+                         b"\r\n\r\n")
+            kept = await self.response(reader)
+            writer.write(b"GET /info HTTP/1.0\r\n\r\n")
+            return kept, await asyncio.wait_for(reader.read(), 1)
+
+        kept, closed = self.run_client(client)
+        self.assertIn(b"Connection: keep-alive\r\n", kept)
+        self.assertTrue(closed.startswith(b"HTTP/1.0 200"))
+        self.assertNotIn(b"Connection:", closed)
+
+    def test_unframed_closes(self):
+        """Responses sent in fragments end the connection"""
+
+        async def client(reader, writer):
+            writer.write(b"GET /old HTTP/1.1\r\n\r\n")
+            return await asyncio.wait_for(reader.read(), 1)
+
+        self.assertTrue(self.run_client(client).endswith(b"old"))
+
+    def test_idle_timeout(self):
+        """Idle connections are closed once they've waited too long"""
+
+        async def client(reader, writer):
+            writer.write(b"GET /info HTTP/1.1\r\n\r\n")
+            await self.response(reader)
+            return await asyncio.wait_for(reader.read(), 1)
+
+        with mock.patch.object(Server, "idle_timeout_s", 0.1):
+            self.assertEqual(self.run_client(client), b"")
+
+    def test_idle_cap(self):
+        """Without room to idle, connections are closed after answering"""
+
+        async def client(reader, writer):
+            writer.write(b"GET /info HTTP/1.1\r\n\r\n")
+            return await asyncio.wait_for(reader.read(), 1)
+
+        with mock.patch.object(Server, "max_idle_clients", 0):
+            response = self.run_client(client)
+        self.assertIn(b"Connection: close\r\n", response)
+
+
+class FakeWriter:
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+
+
+class TestResponses(unittest.TestCase):
+
+    def handle(self, handler):
+        server = Server()
+        server.add_route("/", lambda r: handler(server))
+        request = HTTPRequest.parse_head(b"GET / HTTP/1.0")
+        request.writer = FakeWriter()
+        server._handle(request, None, server.find_route(request))
+        return request.writer.writes
+
+    def test_respond(self):
+        """Responses carry their Content-Length and are written at once"""
+        writes = self.handle(lambda s: s.respond(
+            "{}", content_type="application/json", extend_headers=["X-A: 1"]))
+
+        self.assertEqual(writes, [
+            b"HTTP/1.0 200 Ok\r\nContent-Type: application/json\r\n"
+            b"Content-Length: 2\r\nX-A: 1\r\n\r\n{}"
+        ])
+
+    def test_fragments_written_together(self):
+        """Fragments sent by a handler go out in one write"""
+
+        def handler(server):
+            server.send("HTTP/1.0 200 OK\r\n")
+            server.send("Content-Type: text/plain\r\n\r\n")
+            server.send("hello")
+
+        writes = self.handle(handler)
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].endswith(b"\r\n\r\nhello"))
+
+    def test_error_replaces_partial_response(self):
+        """A handler which fails part way answers with only the 500"""
+
+        def handler(server):
+            server.send("HTTP/1.0 200 OK\r\n")
+            raise ValueError("oops")
+
+        with mock.patch("builtins.print"):
+            writes = self.handle(handler)
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith(b"HTTP/1.0 500"))
+        self.assertTrue(writes[0].endswith(b"Error: oops"))
+
+
+class FakeReader:
+
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    async def read(self, size):
+        if len(self.chunks) == 0:
+            return b""
+        chunk = self.chunks.pop(0)
+        self.chunks[0:0] = [chunk[size:]] if len(chunk) > size else []
+        return chunk[0:size]
+
+
+class TestRequest(unittest.TestCase):
+
+    def test_parse_head(self):
+        """The request line and headers are parsed once"""
+        request = HTTPRequest.parse_head(
+            b"POST /keys/on?x=1&y=2 HTTP/1.1\r\nContent-Length: 3\r\n"
+            b"X-Thing:  a:b ")
+
+        self.assertEqual(request.method, "POST")
+        self.assertEqual(request.path, "/keys/on")
+        self.assertEqual(request.query, "x=1&y=2")
+        self.assertEqual(request.content_length, 3)
+        self.assertEqual(request.headers["x-thing"], "a:b")
+
+        params = request.query_params()
+        self.assertEqual(params, {"x": "1", "y": "2"})
+        self.assertIs(request.query_params(), params)
+
+    def test_bad_content_length(self):
+        """Content-Lengths which aren't counts are refused"""
+        for length in (b"lots", b"-1"):
+            with self.assertRaises(RequestError) as raised:
+                HTTPRequest.parse_head(b"POST / HTTP/1.1\r\n"
+                                       b"Content-Length: " + length)
+            self.assertEqual(raised.exception.status, 400)
+
+    def test_body_across_reads(self):
+        """Body bytes which arrive with the head are kept, and the rest
+        is read after them"""
+        reader = FakeReader(b"POST / HTTP/1.1\r\nContent-Length: 11\r\n",
+                            b"\r\nhello", b" world", b"GET / HTTP/1.1")
+
+        async def main():
+            request = await read_request(reader, 2048)
+            return request, await request.read_body()
+
+        request, body = asyncio.run(main())
+        self.assertEqual(body, b"hello world")
+        self.assertEqual(request.post_params(), {"hello world": ""})
+        self.assertEqual(reader.chunks, [b"GET / HTTP/1.1"])
+
+    def test_body_cut_short(self):
+        """Clients which leave mid-body are refused"""
+        reader = FakeReader(b"POST / HTTP/1.1\r\nContent-Length: 9\r\n\r\n",
+                            b"hello")
+
+        async def main():
+            request = await read_request(reader, 2048)
+            await request.read_body()
+
+        with self.assertRaises(RequestError):
+            asyncio.run(main())
+
+
+class TestRoutes(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server()
+        self.server.add_route("/info", lambda r: "info")
+        self.server.add_route("/info", lambda r: "set", method="POST")
+        self.server.add_route("/keys/<key>/presses/<n>", lambda r: "press")
+        self.server.add_route("/files/.*", lambda r: "file")
+
+    def find(self, request):
+        route = self.server.find_route(request)
+        return None if route is None else route["handler"](request)
+
+    def test_static(self):
+        """Exact paths are matched by method, ignoring the query"""
+        self.assertEqual(self.find("GET /info HTTP/1.1\r\n\r\n"), "info")
+        self.assertEqual(self.find("POST /info?x=1 HTTP/1.1\r\n\r\n"), "set")
+        self.assertIsNone(self.find("PUT /info HTTP/1.1\r\n\r\n"))
+        self.assertIsNone(self.find("GET /info/more HTTP/1.1\r\n\r\n"))
+
+    def test_named_segments(self):
+        """Named segments are captured into params"""
+        self.assertEqual(self.find("GET /keys/on/presses/3 HTTP/1.1\r\n"),
+                         "press")
+        self.assertEqual(self.server.params, {"key": "on", "n": "3"})
+
+        self.assertIsNone(self.find("GET /keys/on/presses HTTP/1.1\r\n"))
+
+    def test_regex(self):
+        """Paths with regex syntax are still matched as patterns"""
+        self.assertEqual(self.find("GET /files/a/b HTTP/1.1\r\n"), "file")
+        self.assertEqual(self.server.params, {})
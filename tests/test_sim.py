@@ -0,0 +1,185 @@
+import asyncio
+import unittest
+
+import bluetooth
+import machine
+import network
+from sim import loop
+from sim.clock import clock
+
+from app import clock as app_clock
+from app.board.basics import PushButton, RgbLED
+from app.lib import aioble
+from app.wifi.wifi import WiFiController
+
+
+class TestVirtualClock(unittest.TestCase):
+
+    def test_timers_fire_in_order(self):
+        """Advancing the clock fires timers at the tick they're due"""
+        fired = []
+        clock.freeze()
+        start = clock.ticks_ms()
+        machine.Timer(mode=machine.Timer.ONE_SHOT,
+                      period=30,
+                      callback=lambda t: fired.append(
+                          ('once', clock.ticks_ms() - start)))
+        periodic = machine.Timer(mode=machine.Timer.PERIODIC,
+                                 period=20,
+                                 callback=lambda t: fired.append(
+                                     ('tick', clock.ticks_ms() - start)))
+
+        try:
+            clock.advance(65)
+        finally:
+            clock.thaw()
+            periodic.deinit()
+
+        self.assertEqual(fired, [('tick', 20), ('once', 30), ('tick', 40),
+                                 ('tick', 60)])
+
+    def test_app_ticks_follow_clock(self):
+        """The app's ticks come from the virtual clock"""
+        clock.freeze()
+        try:
+            before = app_clock.ticks_ms()
+            clock.advance(1000)
+            self.assertEqual(app_clock.ticks_ms() - before, 1000)
+        finally:
+            clock.thaw()
+
+    def test_loop_skips_idle_time(self):
+        """Sleeping on the virtual loop takes no real time"""
+
+        async def main():
+            start = clock.ticks_ms()
+            await asyncio.sleep(3600)
+            return clock.ticks_ms() - start
+
+        self.assertEqual(loop.run(main()), 3600 * 1000)
+
+
+class TestHardware(unittest.TestCase):
+
+    def test_button_irq_edges(self):
+        """Driving a pin fires the button's IRQ, and long presses fire"""
+        button = PushButton([40], 'on')
+        events = []
+        button.on_press = lambda key: events.append('press')
+        button.on_long_press = lambda key: events.append('long')
+        button.on_release = lambda key: events.append('release')
+
+        pin = machine.pins[40]
+        clock.freeze()
+        try:
+            pin.drive(0)
+            clock.advance(PushButton.longpress_ms + 1)
+            pin.drive(1)
+            pin.drive(0)
+            pin.drive(1)
+            clock.advance(PushButton.longpress_ms + 1)
+        finally:
+            clock.thaw()
+
+        self.assertEqual(events,
+                         ['press', 'long', 'release', 'press', 'release'])
+
+    def test_pwm_history(self):
+        """PWM duty changes are recorded with their ticks"""
+        led = RgbLED(41, 42, 43)
+
+        async def main():
+            start = clock.ticks_ms()
+            await led.flash(100, 0, 0, seconds=0.1, times=2)
+            return start
+
+        start = loop.run(main())
+        red = [(t - start, duty) for t, duty in led.r.history][-4:]
+
+        self.assertEqual(red, [(0, 65535), (100, 0), (200, 65535), (300, 0)])
+
+
+class TestWiFi(unittest.TestCase):
+
+    def setUp(self):
+        network._interfaces.clear()
+        network.access_points.clear()
+        network.access_points['home'] = 'secret'
+
+    def connect(self, ssid, psk):
+        wifi = WiFiController(ssid, psk)
+        failures = []
+        wifi.on_failed = failures.append
+        loop.run(wifi.connect())
+        return wifi, failures
+
+    def test_connects(self):
+        """The controller joins a known access point"""
+        wifi, failures = self.connect('home', 'secret')
+
+        self.assertTrue(wifi._connected)
+        self.assertEqual(failures, [])
+
+    def test_wrong_password(self):
+        """Bad passwords are reported"""
+        _, failures = self.connect('home', 'guess')
+
+        self.assertEqual(failures, ['WiFi connection failed: Wrong password'])
+
+    def test_link_lost(self):
+        """The supervisor reconnects after the link drops"""
+        wifi, _ = self.connect('home', 'secret')
+        wifi._backoff = False
+
+        async def main():
+            supervisor = asyncio.create_task(wifi.supervise())
+            wifi.wlan.drop()
+            await asyncio.sleep(WiFiController.supervise_interval_s * 2)
+            supervisor.cancel()
+
+        loop.run(main())
+        self.assertEqual(wifi.wlan.connects, 2)
+        self.assertTrue(wifi.wlan.isconnected())
+
+
+class TestBluetooth(unittest.TestCase):
+
+    def test_uuid(self):
+        """UUIDs parse like the radio's, and reject bad characters"""
+        uuid = bluetooth.UUID('19B10001-E8F2-537E-4F6C-D104768A1214')
+
+        self.assertEqual(bytes(uuid)[0], 0x14)
+        self.assertEqual(uuid, bluetooth.UUID(str(uuid)[5:-1]))
+        with self.assertRaises(ValueError):
+            bluetooth.UUID('19B10001-E8F2-537E-4F6Cg-D104768A1214')
+
+    def test_central_connects(self):
+        """A simulated central connects and reads a characteristic"""
+        radio = bluetooth.BLE()
+        service = aioble.Service(bluetooth.UUID(0x181A))
+        char = aioble.Characteristic(service,
+                                     bluetooth.UUID(0x2A6E),
+                                     read=True,
+                                     notify=True)
+        aioble.register_services(service)
+        char.write(b'21.5')
+
+        async def main():
+            # CPython won't add str to bytes like MicroPython does,
+            # so the name is given as bytes
+            advertising = asyncio.create_task(
+                aioble.advertise(250000, name=b'sim'))
+            await asyncio.sleep(0.1)
+            self.assertEqual(radio.advertising, 250000)
+
+            conn_handle = radio.connect_central()
+            connection = await advertising
+            char.write(b'22.0', send_update=True)
+            radio.disconnect_central(conn_handle)
+            await connection.disconnected()
+            return conn_handle
+
+        conn_handle = loop.run(main())
+        self.assertEqual(radio.gatts_read(char._value_handle), b'22.0')
+        self.assertIn((conn_handle, char._value_handle, b'22.0'),
+                      radio.notifications)
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import socket
+import threading
+import unittest
+from unittest import mock
+
+from app.requestqueue import udp
+from app.requestqueue.queue import RequestQueue
+from app.requestqueue.request import Request
+from app.requestqueue.retry import RetryPolicy
+from app.requestqueue.udp import UdpTransport
+from bridge.udp_bridge import Bridge
+from tests.fake_ha import FakeHomeAssistant
+
+DEVICE = b'\xe6\x61\x41\x04\x03\x2b\x5a\x2c'
+
+
+class TestFrames(unittest.TestCase):
+
+    def test_press_round_trip(self):
+        """Presses fit one small frame, and decode to what was sent"""
+        frame = udp.encode_press(DEVICE, b'v7', b'on', 1, 2, 3)
+
+        self.assertEqual(len(frame), udp.PRESS_SIZE)
+        self.assertLessEqual(udp.PRESS_SIZE, 48)
+        self.assertEqual(udp.decode_press(frame),
+                         (DEVICE, b'v7', b'on', 1, 2, 3))
+
+    def test_rejects_other_frames(self):
+        """Frames of the wrong kind or size aren't decoded"""
+        ack = udp.encode_ack(DEVICE, 1, 2)
+
+        self.assertEqual(udp.decode_ack(ack), (DEVICE, 1, 2))
+        self.assertIsNone(udp.decode_press(ack))
+        self.assertIsNone(udp.decode_ack(ack[0:-1]))
+        self.assertIsNone(udp.decode_ack(b'XX' + ack[2:]))
+
+
+class TestUdpTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.ha = FakeHomeAssistant()
+
+        # Stands in for the bridge, until one is started
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.bind(('127.0.0.1', 0))
+        self.port = self.receiver.getsockname()[1]
+
+        self.queue = RequestQueue(
+            4,
+            '127.0.0.1:' + str(self.ha.port),
+            retry=RetryPolicy(max_attempts=1),
+        )
+        self.transport = UdpTransport('127.0.0.1:' + str(self.port), DEVICE,
+                                      'v7')
+        self.queue.use_transport(self.transport)
+
+    def tearDown(self):
+        self.transport.close()
+        self.queue.pool.close()
+        self.receiver.close()
+        self.ha.close()
+
+    def start_bridge(self) -> Bridge:
+        self.receiver.close()
+        bridge = Bridge('127.0.0.1:' + str(self.ha.port), {})
+        started = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(
+                loop.create_datagram_endpoint(lambda: bridge,
+                                              local_addr=('127.0.0.1',
+                                                          self.port)))
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait(1)
+        return bridge
+
+    def send(self, req: Request):
+        done = []
+        req.on_success = lambda: done.append(True)
+        req.on_failure = lambda: done.append(False)
+
+        self.queue.add(req)
+        while len(done) == 0:
+            self.queue.flush()
+            self.queue.poll(20)
+
+        return done[0]
+
+    def test_bridged(self):
+        """Presses reach the webhook through the bridge in one frame"""
+        bridge = self.start_bridge()
+        req = Request('press', keys=['on'])
+
+        self.assertTrue(self.send(req))
+
+        self.assertEqual(bridge.forwarded, 1)
+        self.assertEqual(len(self.ha.requests), 1)
+        head, body = self.ha.requests[0].split(b'\r\n\r\n')
+        self.assertIn(b'Idempotency-Key: ' + req.id_text().encode(), head)
+        self.assertEqual(json.loads(body)['key'], 'on')
+        self.assertEqual(json.loads(body)['layout'], 'v7')
+
+    def test_retransmits(self):
+        """Unacked presses are resent, then given up on"""
+        with mock.patch.object(UdpTransport, 'retransmit_ms', 10):
+            self.assertFalse(self.send(Request('press', keys=['on'])))
+
+        self.assertEqual(self.transport.retransmits,
+                         UdpTransport.max_transmits - 1)
+        self.receiver.settimeout(0)
+        frames = []
+        try:
+            while True:
+                frames.append(self.receiver.recv(64))
+        except OSError:
+            pass
+        self.assertEqual(len(frames), UdpTransport.max_transmits)
+        self.assertEqual(len(set(frames)), 1)
+
+    def test_resolves_lazily(self):
+        """Bridges which can't be resolved yet don't stop the switch
+        starting, and are tried again for later sends"""
+        resolve = socket.getaddrinfo
+        calls = []
+
+        def getaddrinfo(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise OSError(-2, 'Name or service not known')
+            return resolve(*args)
+
+        transport = UdpTransport('127.0.0.1:' + str(self.port), DEVICE, 'v7')
+        with mock.patch.object(socket, 'getaddrinfo', getaddrinfo), \
+                mock.patch.object(UdpTransport, 'retransmit_ms', 0):
+            transport.open(self.queue.poller)
+            self.assertEqual(calls, [])
+
+            self.assertTrue(transport.send(Request('press', keys=['on'])))
+            self.assertIsNone(transport.socket)
+
+            transport.service()
+
+        self.assertIsNotNone(transport.socket)
+        self.receiver.settimeout(1)
+        self.assertIsNotNone(udp.decode_press(self.receiver.recv(64)))
+        transport.close()
+
+    def test_batches_use_webhook(self):
+        """Batched presses are left to the webhook"""
+        self.assertTrue(self.send(Request('press', keys=['on', '1'])))
+
+        self.assertEqual(self.transport.in_flight(), 0)
+        self.assertEqual(len(self.ha.requests), 1)
+
+    def test_window(self):
+        """The transport keeps its own window of presses in flight,
+        apart from the webhook's connections, and batches still go
+        to the webhook while it's full"""
+        for key in range(UdpTransport.window):
+            self.queue.add(Request('press', keys=[str(key)]))
+        self.queue.flush()
+
+        self.assertGreater(UdpTransport.window, self.queue.capacity)
+        self.assertEqual(self.transport.in_flight(), UdpTransport.window)
+        self.assertTrue(self.transport.busy())
+
+        self.assertTrue(self.send(Request('press', keys=['on', '1'])))
+        self.assertEqual(len(self.ha.requests), 1)
+
+
+class TestBridge(unittest.TestCase):
+
+    def test_duplicates_acked_once_forwarded(self):
+        """Resent presses are acked again, but forwarded once"""
+        bridge = Bridge('127.0.0.1:1')
+        posted = []
+        sent = []
+
+        async def post(press):
+            posted.append(press)
+            return True
+
+        bridge.post = post
+        bridge.transport = mock.Mock(
+            sendto=lambda data, addr: sent.append(data))
+        frame = udp.encode_press(DEVICE, b'v7', b'on', 1, 2, 3)
+
+        async def main():
+            bridge.datagram_received(frame, None)
+            bridge.datagram_received(frame, None)
+            await asyncio.sleep(0.01)
+            bridge.datagram_received(frame, None)
+
+        asyncio.run(main())
+        self.assertEqual(len(posted), 1)
+        self.assertEqual(sent, [udp.encode_ack(DEVICE, 1, 2)] * 2)
+        self.assertEqual(bridge.duplicates, 1)
+
+    def test_forwarding_times_out(self):
+        """Presses Home Assistant never accepts are forgotten, so
+        resends of them are tried again"""
+        bridge = Bridge('127.0.0.1:1')
+        posted = []
+
+        async def post(press):
+            posted.append(press)
+            await asyncio.Event().wait()
+
+        bridge.post = post
+        bridge.transport = mock.Mock()
+        frame = udp.encode_press(DEVICE, b'v7', b'on', 1, 2, 3)
+
+        async def main():
+            bridge.datagram_received(frame, None)
+            await asyncio.sleep(0.05)
+            bridge.datagram_received(frame, None)
+            await asyncio.sleep(0)
+
+        with mock.patch.object(Bridge, 'post_timeout_s', 0.01):
+            asyncio.run(main())
+
+        self.assertEqual(len(posted), 2)
+        self.assertEqual(bridge.failures, 1)